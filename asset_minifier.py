@@ -0,0 +1,181 @@
+"""
+Модуль минификации встроенных в HTML шаблон стилей и скриптов.
+Работает консервативно: удаляет комментарии, отступы и пустые строки,
+не переписывая сам код, поэтому переводы строк в JS сохраняются.
+"""
+
+import re
+
+
+def minify_css(css: str) -> str:
+    """
+    Минифицирует CSS: удаляет комментарии и лишние пробелы.
+
+    Args:
+        css: Исходный CSS
+
+    Returns:
+        Минифицированный CSS
+    """
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};:,>])\s*', r'\1', css)
+    css = css.replace(';}', '}')
+    return css.strip()
+
+
+# Символы и слова, после которых '/' начинает литерал регулярного выражения, а не деление
+_REGEX_PRECEDING_CHARS = set('(,=:[!&|?{};+-*%<>~^')
+_REGEX_PRECEDING_WORDS = {'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void',
+                          'throw', 'case', 'do', 'else', 'yield', 'await'}
+
+
+def _skip_regex(js: str, i: int) -> int:
+    """Возвращает позицию после литерала регулярного выражения, начинающегося в js[i]."""
+    length = len(js)
+    in_class = False
+    i += 1
+    while i < length and js[i] != '\n':
+        char = js[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            i += 1
+            # Флаги
+            while i < length and (js[i].isalnum() or js[i] == '_'):
+                i += 1
+            return i
+        i += 1
+    return i
+
+
+def strip_js_comments(js: str) -> str:
+    """
+    Удаляет комментарии из JS с учетом строковых литералов, шаблонных строк
+    (включая вложенные выражения ${...}) и литералов регулярных выражений.
+
+    Args:
+        js: Исходный JS
+
+    Returns:
+        JS без комментариев
+    """
+    result = []
+    i = 0
+    length = len(js)
+    quote = None
+    # Глубина фигурных скобок каждого открытого выражения ${...} шаблонной строки
+    template_depths = []
+    # Последний значимый символ и последнее слово кода (для отличия регулярного выражения от деления)
+    last_char = ''
+    last_word = ''
+
+    while i < length:
+        char = js[i]
+
+        if quote:
+            result.append(char)
+            if char == '\\' and i + 1 < length:
+                result.append(js[i + 1])
+                i += 2
+                continue
+            if char == quote:
+                quote = None
+                last_char, last_word = char, ''
+            elif quote == '`' and js.startswith('${', i):
+                # Выражение внутри шаблонной строки разбирается как код
+                result.append('{')
+                template_depths.append(0)
+                quote = None
+                last_char, last_word = '{', ''
+                i += 2
+                continue
+            i += 1
+            continue
+
+        if char in '\'"`':
+            quote = char
+            result.append(char)
+            i += 1
+        elif js.startswith('//', i):
+            # Строчный комментарий до конца строки
+            end = js.find('\n', i)
+            i = length if end == -1 else end
+        elif js.startswith('/*', i):
+            end = js.find('*/', i + 2)
+            i = length if end == -1 else end + 2
+        elif char == '/' and (not last_char or last_char in _REGEX_PRECEDING_CHARS
+                              or last_word in _REGEX_PRECEDING_WORDS):
+            end = _skip_regex(js, i)
+            result.append(js[i:end])
+            last_char, last_word = '/', ''
+            i = end
+        else:
+            if template_depths and char == '{':
+                template_depths[-1] += 1
+            elif template_depths and char == '}':
+                if template_depths[-1] == 0:
+                    # Конец выражения ${...}: продолжается шаблонная строка
+                    template_depths.pop()
+                    quote = '`'
+                else:
+                    template_depths[-1] -= 1
+            if char.isalnum() or char in '_$':
+                # Слово продолжается, только если предыдущий символ тоже часть слова
+                joined = result and (result[-1].isalnum() or result[-1] in '_$')
+                last_word = last_word + char if joined else char
+                last_char = char
+            elif not char.isspace():
+                last_char, last_word = char, ''
+            result.append(char)
+            i += 1
+
+    return ''.join(result)
+
+
+def minify_js(js: str) -> str:
+    """
+    Минифицирует JS: удаляет комментарии, отступы и пустые строки.
+    Переводы строк сохраняются, чтобы не менять автоматическую расстановку точек с запятой.
+
+    Args:
+        js: Исходный JS
+
+    Returns:
+        Минифицированный JS
+    """
+    js = strip_js_comments(js)
+    lines = (line.strip() for line in js.split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+def minify_html(html: str) -> str:
+    """
+    Минифицирует HTML страницу: встроенные <style> и <script> блоки, отступы и пустые строки.
+
+    Args:
+        html: Исходный HTML (может быть шаблоном str.format с удвоенными фигурными скобками)
+
+    Returns:
+        Минифицированный HTML
+    """
+    blocks = []
+
+    def keep(minified: str) -> str:
+        blocks.append(minified)
+        return '\x00{}\x00'.format(len(blocks) - 1)
+
+    html = re.sub(r'(<style>)(.*?)(</style>)',
+                  lambda m: m.group(1) + keep(minify_css(m.group(2))) + m.group(3), html, flags=re.S)
+    html = re.sub(r'(<script>)(.*?)(</script>)',
+                  lambda m: m.group(1) + keep(minify_js(m.group(2))) + m.group(3), html, flags=re.S)
+
+    lines = (line.strip() for line in html.split('\n'))
+    html = '\n'.join(line for line in lines if line)
+
+    return re.sub(r'\x00(\d+)\x00', lambda m: blocks[int(m.group(1))], html)
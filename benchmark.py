@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Скрипт для замера производительности этапов parse -> generate на синтетической
+или реальной поездке. Результаты сохраняются в JSON для сравнения между запусками.
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+from typing import Any, Callable, Dict, List
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from generate_html import parse_trip_file
+from html_generator import HTMLGenerator
+from trip_source import LocalDirSource
+from synthetic_trip import SyntheticTripGenerator
+from trip_stats import TripStats
+from pothole_dedup import PotholeDeduplicator
+
+
+def bench_parse_gps_data(trip_dir: str) -> Callable[[], Any]:
+    source = LocalDirSource(trip_dir)
+    return lambda: parse_trip_file(source, 'gps.csv')
+
+
+def bench_parse_detections_data(trip_dir: str) -> Callable[[], Any]:
+    source = LocalDirSource(trip_dir)
+    return lambda: parse_trip_file(source, 'detections.json')
+
+
+def bench_parse_times_data(trip_dir: str) -> Callable[[], Any]:
+    source = LocalDirSource(trip_dir)
+    return lambda: parse_trip_file(source, 'times_full.json')
+
+
+def bench_trip_stats(trip_dir: str) -> Callable[[], Any]:
+    source = LocalDirSource(trip_dir)
+    gps_data = parse_trip_file(source, 'gps.csv')
+    events = parse_trip_file(source, 'detections.json')
+    trip_stats = TripStats()
+    return lambda: trip_stats.compute(gps_data, events)
+
+
+def _bench_dedup(size: int, frames: int = 8) -> Callable[[str], Callable[[], Any]]:
+    """
+    Бенчмарк объединения обнаружений: size / frames ям в случайных точках трека,
+    каждая обнаружена на frames соседних кадрах со смещением до 0.5 м.
+    """
+    def prepare(trip_dir: str) -> Callable[[], Any]:
+        gps_data = parse_trip_file(LocalDirSource(trip_dir), 'gps.csv')
+        random_state = random.Random(size)
+        detections = []
+        while len(detections) < size:
+            point = random_state.choice(gps_data)
+            lat = point['lat'] + random_state.uniform(-1, 1) * 1e-4
+            lon = point['lon'] + random_state.uniform(-1, 1) * 1e-4
+            for frame in range(frames):
+                detections.append({
+                    'type': 'pothole',
+                    'event_type': 'pothole',
+                    'time': point['time'] + frame / 30,
+                    'lat': lat + random_state.uniform(-1, 1) * 4.5e-6,
+                    'lon': lon + random_state.uniform(-1, 1) * 8e-6,
+                    'confidence': random_state.random()
+                })
+        deduplicator = PotholeDeduplicator()
+        return lambda: deduplicator.deduplicate(detections)
+    return prepare
+
+
+def bench_generate_html(trip_dir: str) -> Callable[[], Any]:
+    # Парсинг входит в подготовку и не замеряется
+    source = LocalDirSource(trip_dir)
+    gps_data = parse_trip_file(source, 'gps.csv')
+    events = parse_trip_file(source, 'detections.json')
+    device_info = parse_trip_file(source, 'device.txt')
+    times_data = parse_trip_file(source, 'times_full.json')
+    html_generator = HTMLGenerator()
+    return lambda: html_generator.generate_html(gps_data, events, device_info, [], None, times_data)
+
+
+# Бенчмарки: имя -> функция подготовки, возвращающая замеряемый вызов
+BENCHMARKS: Dict[str, Callable[[str], Callable[[], Any]]] = {
+    'parse_gps_data': bench_parse_gps_data,
+    'parse_detections_data': bench_parse_detections_data,
+    'parse_times_data': bench_parse_times_data,
+    'trip_stats': bench_trip_stats,
+    'dedup_10k': _bench_dedup(10_000),
+    'dedup_100k': _bench_dedup(100_000),
+    'dedup_300k': _bench_dedup(300_000),
+    'generate_html': bench_generate_html
+}
+
+
+def _peak_rss_kb() -> int:
+    """Пиковый RSS текущего процесса в килобайтах (0, если недоступен)."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # На macOS ru_maxrss в байтах, на Linux - в килобайтах
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _output_size(result: Any) -> int:
+    """Размер результата в байтах (HTML или компактный JSON)."""
+    if isinstance(result, str):
+        return len(result.encode('utf-8'))
+    return len(json.dumps(result, separators=(',', ':'), default=str))
+
+
+def _run_case(name: str, trip_dir: str, repeats: int, queue):
+    """Выполняет один бенчмарк в отдельном процессе, чтобы пиковый RSS не смешивался."""
+    run = BENCHMARKS[name](trip_dir)
+    gc.collect()
+    baseline_rss = _peak_rss_kb()
+
+    timings = []
+    result = None
+    for _ in range(repeats):
+        result = None
+        gc.collect()
+        start = time.perf_counter()
+        result = run()
+        timings.append(time.perf_counter() - start)
+
+    queue.put({
+        'wall_s_min': min(timings),
+        'wall_s_median': statistics.median(timings),
+        'repeats': repeats,
+        'baseline_rss_kb': baseline_rss,
+        'peak_rss_kb': _peak_rss_kb(),
+        'output_bytes': _output_size(result)
+    })
+
+
+def run_benchmarks(trip_dir: str, names: List[str], repeats: int = 3) -> Dict[str, Dict[str, Any]]:
+    """
+    Запускает бенчмарки, каждый в отдельном процессе.
+
+    Args:
+        trip_dir: Папка с файлами поездки
+        names: Имена бенчмарков из BENCHMARKS
+        repeats: Количество повторов каждого замера
+
+    Returns:
+        Словарь {имя бенчмарка: результаты}
+    """
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name in names:
+        queue = context.Queue()
+        process = context.Process(target=_run_case, args=(name, trip_dir, repeats, queue))
+        process.start()
+        results[name] = queue.get()
+        process.join()
+        print(f"{name}: {results[name]['wall_s_median']:.3f} с, "
+              f"пиковый RSS {results[name]['peak_rss_kb'] / 1024:.1f} МБ, "
+              f"вывод {results[name]['output_bytes']} байт")
+    return results
+
+
+def compare_results(previous: Dict[str, Any], current: Dict[str, Any]):
+    """Выводит сравнение с предыдущим запуском."""
+    print("\nСравнение с предыдущим запуском:")
+    for name, result in current['results'].items():
+        before = previous.get('results', {}).get(name)
+        if not before:
+            continue
+        parts = []
+        for key in ['wall_s_median', 'peak_rss_kb', 'output_bytes']:
+            if before.get(key):
+                parts.append(f"{key} x{result[key] / before[key]:.2f}")
+        print(f"  {name}: {', '.join(parts)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарки парсинга и генерации HTML')
+    parser.add_argument('--trip', help='Папка с реальной поездкой (по умолчанию генерируется синтетическая)')
+    parser.add_argument('--duration', type=float, default=6 * 3600, help='Длительность синтетической поездки, с')
+    parser.add_argument('--gps-rate', type=float, default=1.0, help='Частота GPS точек, Гц')
+    parser.add_argument('--fps', type=float, default=30.0, help='Частота кадров видео')
+    parser.add_argument('--events-per-minute', type=float, default=2.0, help='Среднее количество событий в минуту')
+    parser.add_argument('--cases', nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS), help='Бенчмарки для запуска')
+    parser.add_argument('--repeats', type=int, default=3, help='Количество повторов каждого замера')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='Файл для результатов')
+    parser.add_argument('--compare', help='JSON предыдущего запуска для сравнения')
+
+    args = parser.parse_args()
+
+    meta = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform()
+    }
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        trip_dir = args.trip
+        if trip_dir is None:
+            trip_dir = temp_dir
+            print("Генерация синтетической поездки...")
+            generator = SyntheticTripGenerator(args.duration, args.gps_rate, args.fps, args.events_per_minute)
+            meta['synthetic'] = {
+                'duration': args.duration,
+                'gps_rate': args.gps_rate,
+                'fps': args.fps,
+                'events_per_minute': args.events_per_minute,
+                'file_sizes': generator.write(trip_dir)
+            }
+        else:
+            meta['trip'] = os.path.abspath(trip_dir)
+
+        results = {'meta': meta, 'results': run_benchmarks(trip_dir, args.cases, args.repeats)}
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Результаты сохранены: {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare_results(json.load(f), results)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
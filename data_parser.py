@@ -1,70 +1,103 @@
 """
 Модуль для парсинга данных GPS, событий и информации об устройстве.
+Парсеры принимают содержимое файла: строку, байты, буфер (bytes, memoryview, mmap)
+или бинарный поток. Пути к файлам не принимаются - файлы открывает TripSource.
 """
 
+import io
+import os
 import json
 import csv
-from typing import List, Dict, Any
+from typing import List, Dict, Any, BinaryIO, Iterable, Union
+from pipeline_metrics import METRICS
+from mp4_probe import probe_videos
+
+# Входные данные парсеров
+ParserInput = Union[str, bytes, bytearray, memoryview, BinaryIO]
+
+
+def _input_size(data: ParserInput) -> int:
+    """Размер входных данных парсера в байтах (для потока - размер файла, если известен)."""
+    if isinstance(data, str):
+        return len(data)
+    if isinstance(data, memoryview):
+        return data.nbytes
+    try:
+        return len(data)
+    except TypeError:
+        pass
+    try:
+        return os.fstat(data.fileno()).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return 0
+
+
+def _text_lines(data: ParserInput) -> Iterable[str]:
+    """Строки текста из входных данных (поток и mmap читаются построчно, без копии целиком)."""
+    if isinstance(data, str):
+        return io.StringIO(data, newline='')
+    if isinstance(data, (bytes, bytearray)):
+        return io.StringIO(data.decode('utf-8'), newline='')
+    if isinstance(data, memoryview):
+        return io.StringIO(str(data, 'utf-8'), newline='')
+    return (line.decode('utf-8') for line in iter(data.readline, b''))
+
+
+def _load_json(data: ParserInput) -> Any:
+    """Разбирает JSON из входных данных."""
+    if isinstance(data, (str, bytes, bytearray)):
+        return json.loads(data)
+    if isinstance(data, memoryview):
+        return json.loads(str(data, 'utf-8'))
+    # Поток или mmap
+    return json.loads(data.read())
 
 
 class DataParser:
     """Класс для парсинга различных типов данных."""
     
     @staticmethod
-    def parse_gps_data(gps_data: str) -> List[Dict[str, Any]]:
-        """Парсит GPS данные из CSV строки."""
+    @METRICS.timed('parse', 'gps.csv', lambda args, result: (_input_size(args[0]), len(result)))
+    def parse_gps_data(gps_data: ParserInput, start_time: float = None) -> List[Dict[str, Any]]:
+        """
+        Парсит GPS данные из содержимого CSV файла.
+        
+        Args:
+            gps_data: Содержимое CSV (с заголовком)
+            start_time: Время начала записи для нормализации (по умолчанию - время первой точки)
+        """
         gps_data_list = []
         
-        # Если это путь к файлу, читаем файл
-        if isinstance(gps_data, str) and '\n' not in gps_data and len(gps_data) < 255:
-            # Это путь к файлу
-            with open(gps_data, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    gps_data_list.append({
-                        'time': float(row['time']),
-                        'lat': float(row['lat']),
-                        'lon': float(row['lon']),
-                        'accuracy': float(row['accuracy']),
-                        'altitude': float(row['altitude']),
-                        'speed': float(row['speed']),
-                        'course': float(row['course']) if 'course' in row else None
-                    })
-        else:
-            # Это данные в памяти
-            import io
-            reader = csv.DictReader(io.StringIO(gps_data))
-            for row in reader:
-                gps_data_list.append({
-                    'time': float(row['time']),
-                    'lat': float(row['lat']),
-                    'lon': float(row['lon']),
-                    'accuracy': float(row['accuracy']),
-                    'altitude': float(row['altitude']),
-                    'speed': float(row['speed']),
-                    'course': float(row['course']) if 'course' in row else None
-                })
+        reader = csv.DictReader(_text_lines(gps_data))
+        for row in reader:
+            gps_data_list.append({
+                'time': float(row['time']),
+                'lat': float(row['lat']),
+                'lon': float(row['lon']),
+                'accuracy': float(row['accuracy']),
+                'altitude': float(row['altitude']),
+                'speed': float(row['speed']),
+                'course': float(row['course']) if 'course' in row else None
+            })
         
-        # Нормализуем время относительно первого timestamp
+        # Нормализуем время относительно первого timestamp (или заданного начала записи)
         if gps_data_list:
-            start_time = gps_data_list[0]['time']
+            if start_time is None:
+                start_time = gps_data_list[0]['time']
             for point in gps_data_list:
                 point['time'] = point['time'] - start_time
         
         return gps_data_list
     
     @staticmethod
-    def parse_detections_data(detections_data: str, gps_start_time: float = None) -> List[Dict[str, Any]]:
-        """Парсит данные о событиях из JSON строки."""
-        # Если это путь к файлу, читаем файл
-        if isinstance(detections_data, str) and '\n' not in detections_data and len(detections_data) < 255:
-            # Это путь к файлу
-            with open(detections_data, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        else:
-            # Это данные в памяти
-            data = json.loads(detections_data)
-        
+    @METRICS.timed('parse', 'detections.json', lambda args, result: (_input_size(args[0]), len(result)))
+    def parse_detections_data(detections_data: ParserInput, gps_start_time: float = None) -> List[Dict[str, Any]]:
+        """Парсит данные о событиях из содержимого JSON файла."""
+        return DataParser.detections_to_events(_load_json(detections_data))
+    
+    @staticmethod
+    def detections_to_events(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Преобразует разобранный detections.json (manualEvents, potholes) в список событий."""
         events = []
         
         # Обрабатываем ручные события
@@ -97,28 +130,16 @@ class DataParser:
         return events
     
     @staticmethod
-    def parse_device_info(device_data: str) -> Dict[str, Any]:
-        """Парсит информацию об устройстве."""
-        # Если это путь к файлу, читаем файл
-        if isinstance(device_data, str) and '\n' not in device_data and len(device_data) < 255:
-            # Это путь к файлу
-            with open(device_data, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        else:
-            # Это данные в памяти
-            return json.loads(device_data)
+    @METRICS.timed('parse', 'device.txt', lambda args, result: (_input_size(args[0]), len(result)))
+    def parse_device_info(device_data: ParserInput) -> Dict[str, Any]:
+        """Парсит информацию об устройстве из содержимого JSON файла."""
+        return _load_json(device_data)
     
     @staticmethod
-    def parse_times_data(times_data: str) -> Dict[str, Any]:
-        """Парсит данные о временных метках кадров из JSON строки."""
-        # Если это путь к файлу, читаем файл
-        if isinstance(times_data, str) and '\n' not in times_data and len(times_data) < 255:
-            # Это путь к файлу
-            with open(times_data, 'r', encoding='utf-8') as f:
-                times_data = json.load(f)
-        else:
-            # Это данные в памяти
-            times_data = json.loads(times_data)
+    @METRICS.timed('parse', 'times_full.json', lambda args, result: (_input_size(args[0]), len(result['frame_times'])))
+    def parse_times_data(times_data: ParserInput) -> Dict[str, Any]:
+        """Парсит данные о временных метках кадров из содержимого JSON файла."""
+        times_data = _load_json(times_data)
         
         if not times_data:
             return {'start_time': 0, 'end_time': 0, 'duration': 0, 'frame_times': []}
@@ -156,3 +177,17 @@ class DataParser:
                 video_files.append(video_path)
         
         return video_files
+    
+    @staticmethod
+    def probe_video_files(video_files: List[str]) -> List[Dict[str, Any]]:
+        """
+        Читает метаданные найденных видео из атома moov, не читая кадры
+        (длительность, количество кадров, частота кадров, ключевые кадры).
+        
+        Args:
+            video_files: Пути к видео (например, из find_video_files)
+            
+        Returns:
+            Метаданные каждого видео (None для файлов, которые не удалось разобрать)
+        """
+        return probe_videos(video_files)
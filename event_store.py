@@ -0,0 +1,237 @@
+"""
+Модуль компактного хранилища событий поездки.
+Хранит события в виде столбцов (struct-of-arrays) с интернированными строками.
+"""
+
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+
+
+class EventStore:
+    """Компактное хранилище событий, упорядоченных по времени."""
+
+    # Отсутствующее значение для кодов строк (например, custom_name у ям)
+    NO_CODE = -1
+
+    def __init__(self):
+        # Таблица интернированных строк
+        self.strings: List[str] = []
+        self._string_codes: Dict[str, int] = {}
+
+        # Столбцы событий (всегда отсортированы по времени)
+        self.times = array('d')
+        self.lats = array('d')
+        self.lons = array('d')
+        self.confidences = array('d')
+        self.type_codes = array('i')
+        self.event_type_codes = array('i')
+        self.name_codes = array('i')
+        # Количество объединенных обнаружений (1 - событие не объединялось)
+        self.hits = array('I')
+
+        # Индексы по типу события: код event_type -> позиции в порядке времени
+        self._type_index: Dict[int, array] = {}
+
+    @classmethod
+    def from_events(cls, events: Iterable[Dict[str, Any]]) -> 'EventStore':
+        """
+        Создает хранилище из списка событий в формате DataParser.
+
+        Args:
+            events: События (словари с ключами type, event_type, time, lat, lon, ...)
+
+        Returns:
+            Заполненное хранилище
+        """
+        store = cls()
+        events = list(events)
+
+        # Порядок по времени строится один раз
+        order = sorted(range(len(events)), key=lambda i: events[i]['time'])
+        for i in order:
+            store._append(events[i])
+
+        store._build_type_index()
+        return store
+
+    def _intern(self, value: Optional[str]) -> int:
+        """Возвращает код строки, добавляя ее в таблицу при необходимости."""
+        if value is None:
+            return self.NO_CODE
+        code = self._string_codes.get(value)
+        if code is None:
+            code = len(self.strings)
+            self.strings.append(value)
+            self._string_codes[value] = code
+        return code
+
+    def _append(self, event: Dict[str, Any]):
+        """Добавляет событие в конец столбцов."""
+        confidence = event.get('confidence')
+
+        self.times.append(float(event['time']))
+        self.lats.append(float(event['lat']))
+        self.lons.append(float(event['lon']))
+        self.confidences.append(float(confidence) if confidence is not None else math.nan)
+        self.type_codes.append(self._intern(event.get('type')))
+        self.event_type_codes.append(self._intern(event.get('event_type')))
+        self.name_codes.append(self._intern(event.get('custom_name')))
+        self.hits.append(event.get('hits', 1))
+
+    def _build_type_index(self):
+        """Строит отсортированные по времени индексы для каждого типа события."""
+        self._type_index = {}
+        for position, code in enumerate(self.event_type_codes):
+            if code not in self._type_index:
+                self._type_index[code] = array('I')
+            self._type_index[code].append(position)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for position in range(len(self)):
+            yield self.event(position)
+
+    def event(self, position: int) -> Dict[str, Any]:
+        """
+        Восстанавливает событие в формате DataParser.
+
+        Args:
+            position: Позиция события в порядке времени
+
+        Returns:
+            Словарь события
+        """
+        event = {
+            'type': self._string(self.type_codes[position]),
+            'event_type': self._string(self.event_type_codes[position]),
+            'time': self.times[position],
+            'lat': self.lats[position],
+            'lon': self.lons[position]
+        }
+
+        name_code = self.name_codes[position]
+        if name_code != self.NO_CODE:
+            event['custom_name'] = self.strings[name_code]
+
+        confidence = self.confidences[position]
+        if not math.isnan(confidence):
+            event['confidence'] = confidence
+
+        if self.hits[position] > 1:
+            event['hits'] = self.hits[position]
+
+        return event
+
+    def _string(self, code: int) -> Optional[str]:
+        """Возвращает строку по коду."""
+        return self.strings[code] if code != self.NO_CODE else None
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """Возвращает все события списком словарей в порядке времени."""
+        return list(self)
+
+    @property
+    def start_time(self) -> Optional[float]:
+        """Время первого события."""
+        return self.times[0] if self.times else None
+
+    @property
+    def end_time(self) -> Optional[float]:
+        """Время последнего события."""
+        return self.times[-1] if self.times else None
+
+    def event_types(self) -> List[str]:
+        """Возвращает список типов событий, присутствующих в хранилище."""
+        return [self.strings[code] for code in self._type_index]
+
+    def range_by_time(self, start: float, end: float) -> range:
+        """
+        Находит события в интервале времени [start, end] за O(log n).
+
+        Args:
+            start: Начало интервала
+            end: Конец интервала
+
+        Returns:
+            Диапазон позиций событий
+        """
+        lo = bisect_left(self.times, start)
+        hi = bisect_right(self.times, end, lo)
+        return range(lo, hi)
+
+    def slice(self, start: float, end: float, offset: float = 0.0) -> 'EventStore':
+        """
+        Возвращает хранилище с событиями из интервала [start, end] за O(log n + k).
+
+        Args:
+            start: Начало интервала
+            end: Конец интервала
+            offset: Величина, вычитаемая из времени событий (для перевода в время среза)
+
+        Returns:
+            Новое хранилище (таблица строк общая с исходным)
+        """
+        positions = self.range_by_time(start, end)
+        lo, hi = positions.start, positions.stop
+
+        store = EventStore()
+        store.strings = self.strings
+        store._string_codes = self._string_codes
+        store.times = array('d', (t - offset for t in self.times[lo:hi])) if offset else self.times[lo:hi]
+        store.lats = self.lats[lo:hi]
+        store.lons = self.lons[lo:hi]
+        store.confidences = self.confidences[lo:hi]
+        store.type_codes = self.type_codes[lo:hi]
+        store.event_type_codes = self.event_type_codes[lo:hi]
+        store.name_codes = self.name_codes[lo:hi]
+        store.hits = self.hits[lo:hi]
+        store._build_type_index()
+        return store
+
+    def filter_by_type(self, event_type: str, start: float = None, end: float = None) -> array:
+        """
+        Находит события заданного типа, опционально в интервале времени, за O(log n).
+
+        Args:
+            event_type: Тип события (event_type)
+            start: Начало интервала (опционально)
+            end: Конец интервала (опционально)
+
+        Returns:
+            Позиции событий в порядке времени
+        """
+        code = self._string_codes.get(event_type)
+        positions = self._type_index.get(code) if code is not None else None
+        if positions is None:
+            return array('I')
+
+        time_at = self.times.__getitem__
+        lo = bisect_left(positions, start, key=time_at) if start is not None else 0
+        hi = bisect_right(positions, end, lo, key=time_at) if end is not None else len(positions)
+        return positions[lo:hi]
+
+    def to_compact(self) -> Dict[str, Any]:
+        """
+        Сериализует хранилище в компактный столбцовый вид для встраивания в страницу.
+
+        Returns:
+            Словарь со столбцами и таблицей строк
+        """
+        compact = {
+            'strings': self.strings,
+            'time': [round(t, 3) for t in self.times],
+            'lat': [round(lat, 7) for lat in self.lats],
+            'lon': [round(lon, 7) for lon in self.lons],
+            'confidence': [None if math.isnan(c) else round(c, 4) for c in self.confidences],
+            'type': list(self.type_codes),
+            'event_type': list(self.event_type_codes),
+            'custom_name': list(self.name_codes)
+        }
+        # Столбец объединенных обнаружений нужен, только если события объединялись
+        if any(hits > 1 for hits in self.hits):
+            compact['hits'] = list(self.hits)
+        return compact
@@ -5,10 +5,189 @@
 
 import os
 import sys
+import time
+import asyncio
 import argparse
+from concurrent.futures import Executor
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from data_parser import DataParser
 from yandex_downloader import YandexDownloader
 from html_generator import HTMLGenerator
+from event_store import EventStore
+from precompress import precompress_file, print_sizes
+from pipeline_metrics import METRICS
+from trip_slice import parse_time_value
+from trip_source import TripSource, LocalDirSource, YandexSource, is_archive, open_trip_source
+from tile_builder import TILE_THRESHOLD
+from leaflet_bundle import BUNDLE_MODES, VENDOR_DIR
+
+
+# Парсеры файлов поездки по имени файла
+FILE_PARSERS = {
+    'gps.csv': DataParser.parse_gps_data,
+    'detections.json': DataParser.parse_detections_data,
+    'device.txt': DataParser.parse_device_info,
+    'times_full.json': DataParser.parse_times_data
+}
+
+# Расширения архивов поездок (для имени папки с распакованными видео)
+ARCHIVE_EXTENSIONS = ['.tar.gz', '.tar.bz2', '.tar.xz', '.tgz', '.tar', '.zip']
+
+# Файлы, без которых страницу поездки не построить
+REQUIRED_TRIP_FILES = ['gps.csv', 'detections.json', 'device.txt']
+
+
+def parse_trip_file(source: TripSource, filename: str) -> Any:
+    """
+    Парсит файл поездки из источника, передавая парсеру бинарный поток.
+    
+    Args:
+        source: Источник файлов поездки
+        filename: Имя файла из FILE_PARSERS
+        
+    Returns:
+        Результат парсера
+    """
+    with source.open(filename) as f:
+        return FILE_PARSERS[filename](f)
+
+
+def iter_trip(source: TripSource) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Загружает поездку из источника по этапам для прогрессивного отображения.
+    
+    Сначала загружается только gps.csv, чтобы карту с траекторией можно было
+    показать как можно раньше; события, информация об устройстве, временные
+    метки и видео добавляются следующими этапами.
+    
+    Args:
+        source: Источник файлов поездки
+        
+    Yields:
+        Кортежи (название этапа, текущие данные поездки). Этапы: 'listing', 'gps', 'events', 'complete'
+    """
+    trip = {
+        'gps_data': [],
+        'events': EventStore(),
+        'device_info': {},
+        'video_files': [],
+        'video_info': [],
+        'times_data': None
+    }
+    
+    def parse_optional(filename: str) -> Any:
+        if not source.exists(filename):
+            print(f"Файл {filename} не найден")
+            return None
+        return parse_trip_file(source, filename)
+    
+    # Для Яндекс.Диска первое обращение к источнику запрашивает список файлов
+    has_gps = source.exists('gps.csv')
+    yield 'listing', trip
+    
+    # Траектория нужна первой: по ней строится карта
+    if not has_gps:
+        raise Exception("Не удалось загрузить файл gps.csv")
+    trip['gps_data'] = parse_trip_file(source, 'gps.csv')
+    yield 'gps', trip
+    
+    events = parse_optional('detections.json')
+    if events is not None:
+        trip['events'] = EventStore.from_events(events)
+    device_info = parse_optional('device.txt')
+    if device_info is not None:
+        trip['device_info'] = device_info
+    yield 'events', trip
+    
+    trip['times_data'] = parse_optional('times_full.json')
+    trip['video_files'] = source.video_files()
+    # Метаданные видео читаются из заголовка MP4 (для Яндекс.Диска - запросами Range)
+    trip['video_info'] = source.probe_videos(trip['video_files'])
+    yield 'complete', trip
+
+
+def load_trip(source: TripSource) -> Dict[str, Any]:
+    """
+    Загружает и парсит данные поездки из источника.
+    
+    Args:
+        source: Источник файлов поездки (локальная папка, архив, память или Яндекс.Диск)
+        
+    Returns:
+        Словарь с разобранными данными поездки (аргументы для render_trip)
+    """
+    for filename in REQUIRED_TRIP_FILES:
+        if not source.exists(filename):
+            raise Exception(f"Файл не найден: {filename} ({source})")
+    
+    for _, trip in iter_trip(source):
+        pass
+    return trip
+
+
+def load_trip_from_yandex(url: str, yandex_downloader: YandexDownloader = None) -> Dict[str, Any]:
+    """
+    Загружает и парсит данные поездки с Яндекс.Диска.
+    
+    Args:
+        url: URL папки на Яндекс.Диске
+        yandex_downloader: Загрузчик (по умолчанию создается новый)
+        
+    Returns:
+        Словарь с разобранными данными поездки (аргументы для render_trip)
+    """
+    return load_trip(YandexSource(url, yandex_downloader))
+
+
+def load_trip_from_dir(data_dir: str) -> Dict[str, Any]:
+    """
+    Загружает и парсит данные поездки из локальной папки.
+    
+    Args:
+        data_dir: Путь к папке с данными
+        
+    Returns:
+        Словарь с разобранными данными поездки (аргументы для render_trip)
+    """
+    with LocalDirSource(data_dir) as source:
+        return load_trip(source)
+
+
+def iter_trip_from_yandex(url: str, yandex_downloader: YandexDownloader = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Загружает поездку с Яндекс.Диска по этапам (см. iter_trip).
+    
+    Args:
+        url: URL папки на Яндекс.Диске
+        yandex_downloader: Загрузчик (по умолчанию создается новый)
+        
+    Yields:
+        Кортежи (название этапа, текущие данные поездки)
+    """
+    yield from iter_trip(YandexSource(url, yandex_downloader))
+
+
+def render_trip(trip: Dict[str, Any], html_generator: HTMLGenerator = None,
+                time_range: Tuple[float, float] = None) -> str:
+    """
+    Генерирует HTML для разобранных данных поездки.
+    
+    Args:
+        trip: Данные поездки из load_trip_from_yandex
+        html_generator: Генератор HTML (по умолчанию создается новый)
+        time_range: Фрагмент поездки (начало, конец) в секундах; разобранные данные
+            (например, из кэша) не копируются целиком, срез берется бинарным поиском
+        
+    Returns:
+        HTML содержимое как строка
+    """
+    if html_generator is None:
+        html_generator = HTMLGenerator()
+    
+    return html_generator.generate_html(trip['gps_data'], trip['events'], trip['device_info'],
+                                        trip['video_files'], None, trip['times_data'], time_range,
+                                        trip.get('video_info'))
+
 
 def generate_html_from_yandex(url: str) -> str:
     """
@@ -20,137 +199,223 @@ def generate_html_from_yandex(url: str) -> str:
     Returns:
         HTML содержимое как строка
     """
-    # Инициализируем компоненты
-    data_parser = DataParser()
+    return render_trip(load_trip_from_yandex(url))
+
+
+async def generate_html_from_yandex_async(url: str, parse_executor: Optional[Executor] = None) -> Dict[str, Any]:
+    """
+    Асинхронно генерирует HTML из данных с Яндекс.Диска.
+    
+    Загрузка файлов идет параллельно, парсинг каждого файла начинается сразу
+    после получения его содержимого. Сетевые запросы выполняются в пуле потоков,
+    парсинг и генерация HTML - в parse_executor, так что цикл событий не блокируется.
+    
+    Args:
+        url: URL папки на Яндекс.Диске
+        parse_executor: Пул для парсинга и генерации HTML (по умолчанию пул потоков цикла)
+        
+    Returns:
+        Словарь {'html': HTML содержимое, 'timings': длительность этапов в секундах}
+    """
+    loop = asyncio.get_running_loop()
     yandex_downloader = YandexDownloader()
     html_generator = HTMLGenerator()
+    timings = {}
+    pipeline_start = time.perf_counter()
+    
+    # Один запрос списка файлов используется и для данных, и для ссылок на видео
+    stage_start = time.perf_counter()
+    files_data = await loop.run_in_executor(None, yandex_downloader.list_files, url)
+    timings['listing'] = time.perf_counter() - stage_start
+    
+    if not files_data:
+        raise Exception("Не удалось получить список файлов")
+    
+    async def load_file(filename: str):
+        stage_start = time.perf_counter()
+        content = await loop.run_in_executor(None, yandex_downloader.download_file, files_data[filename])
+        timings[f'download:{filename}'] = time.perf_counter() - stage_start
+        if content is None:
+            return filename, None
+        
+        stage_start = time.perf_counter()
+        parsed = await loop.run_in_executor(parse_executor, FILE_PARSERS[filename], content)
+        timings[f'parse:{filename}'] = time.perf_counter() - stage_start
+        return filename, parsed
     
-    # Загружаем с Яндекс.Диска
-    loaded_data = yandex_downloader.get_data_from_yandex_disk(url)
+    # Ссылки на видео берутся из того же списка, пока идут загрузки
+    stage_start = time.perf_counter()
+    video_urls = yandex_downloader.get_video_urls_from_files(files_data)
+    timings['video_urls'] = time.perf_counter() - stage_start
     
-    if not loaded_data:
-        raise Exception("Не удалось загрузить необходимые файлы")
+    async def probe_videos():
+        stage_start = time.perf_counter()
+        video_info = await loop.run_in_executor(None, yandex_downloader.probe_videos_from_files, files_data)
+        timings['probe_video'] = time.perf_counter() - stage_start
+        return [video_info.get(name) for name in video_urls]
     
-    # Парсим данные
-    gps_data = data_parser.parse_gps_data(loaded_data.get('gps.csv'))
-    events = data_parser.parse_detections_data(loaded_data.get('detections.json'))
-    device_info = data_parser.parse_device_info(loaded_data.get('device.txt'))
+    tasks = [load_file(filename) for filename in FILE_PARSERS if filename in files_data]
+    # Заголовки видео читаются параллельно с загрузкой файлов данных
+    *parsed_items, video_info = await asyncio.gather(*tasks, probe_videos())
+    parsed_data = dict(parsed_items)
     
-    # Парсим временные метки
-    times_data = None
-    if 'times_full.json' in loaded_data:
-        times_data = data_parser.parse_times_data(loaded_data.get('times_full.json'))
+    for filename in ['gps.csv', 'detections.json', 'device.txt']:
+        if parsed_data.get(filename) is None:
+            raise Exception(f"Не удалось загрузить файл {filename}")
     
-    # Получаем ссылки на видео
-    video_urls = yandex_downloader.get_video_urls_from_yandex_disk(url)
-    video_files = list(video_urls.values())
+    # Генерируем HTML вне цикла событий
+    stage_start = time.perf_counter()
+    html_content = await loop.run_in_executor(
+        parse_executor, html_generator.generate_html,
+        parsed_data['gps.csv'], parsed_data['detections.json'], parsed_data['device.txt'],
+        list(video_urls.values()), None, parsed_data.get('times_full.json'), None, video_info
+    )
+    timings['generate'] = time.perf_counter() - stage_start
+    timings['total'] = time.perf_counter() - pipeline_start
     
-    # Генерируем HTML и возвращаем как строку
-    return html_generator.generate_html(gps_data, events, device_info, video_files, None, times_data)
+    return {'html': html_content, 'timings': timings}
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Генерация HTML для просмотра поездки')
-    parser.add_argument('input', help='URL Яндекс.Диска или путь к папке с данными')
+def archive_stem(path: str) -> str:
+    """Имя архива без расширения (trip.tar.gz -> trip)."""
+    name = os.path.basename(path)
+    for extension in ARCHIVE_EXTENSIONS:
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def main(argv: List[str] = None):
+    if argv is None:
+        argv = sys.argv[1:]
+    
+    # Подкоманда serve: HTTP сервер страниц поездок
+    if argv and argv[0] == 'serve':
+        from trip_server import main as serve_main
+        return serve_main(argv[1:])
+    
+    # Подкоманда live: живой просмотр записываемой поездки
+    if argv and argv[0] == 'live':
+        from live_trip import main as live_main
+        return live_main(argv[1:])
+    
+    parser = argparse.ArgumentParser(description='Генерация HTML для просмотра поездки',
+                                     epilog='Подкоманда "serve" запускает HTTP сервер (см. serve --help), '
+                                            '"live" - живой просмотр записываемой поездки (см. live --help)')
+    parser.add_argument('input', help='URL Яндекс.Диска, путь к папке с данными или к архиву (.zip, .tar.gz)')
     parser.add_argument('-o', '--output', default='index.html', help='Выходной HTML файл')
-    parser.add_argument('--local', action='store_true', help='Использовать локальные файлы вместо загрузки с Яндекс.Диска')
+    parser.add_argument('--local', action='store_true',
+                        help='Считать вход локальным путем (по умолчанию определяется автоматически)')
+    parser.add_argument('--mmap', action='store_true', help='Отображать локальные файлы в память вместо чтения')
+    parser.add_argument('--video-dir', metavar='DIR',
+                        help='Папка для видео, распакованных из архива (по умолчанию рядом с выходным файлом)')
+    parser.add_argument('--no-video', action='store_true', help='Не подключать видео (из архива видео не распаковываются)')
+    parser.add_argument('--from', dest='time_from', type=parse_time_value, metavar='TIME',
+                        help='Начало фрагмента от начала записи (секунды, ММ:СС или ЧЧ:ММ:СС)')
+    parser.add_argument('--to', dest='time_to', type=parse_time_value, metavar='TIME',
+                        help='Конец фрагмента от начала записи (секунды, ММ:СС или ЧЧ:ММ:СС)')
+    parser.add_argument('--dedup', type=float, nargs='?', const=3.0, metavar='METERS',
+                        help='Объединить повторные обнаружения ям на соседних кадрах (расстояние, по умолчанию 3 м)')
+    parser.add_argument('--tiles-dir', metavar='DIR',
+                        help='Папка для PNG тайлов трека и событий большой поездки (по умолчанию рядом с выходным файлом)')
+    parser.add_argument('--tile-threshold', type=int, default=TILE_THRESHOLD, metavar='N',
+                        help=f'Строить тайлы, если точек и событий больше N (по умолчанию {TILE_THRESHOLD})')
+    parser.add_argument('--tile-url', metavar='URL',
+                        help='Шаблон адреса тайлов подложки, например прокси: http://127.0.0.1:8003/{z}/{x}/{y}.png')
+    parser.add_argument('--no-tiles', action='store_true', help='Всегда рисовать трек и события в браузере')
+    parser.add_argument('--bundle', choices=BUNDLE_MODES, default='cdn',
+                        help='Подключение Leaflet: cdn - с unpkg, inline - встроить в страницу, '
+                             'shared - общие файлы в --assets-dir (по умолчанию cdn)')
+    parser.add_argument('--assets-dir', metavar='DIR',
+                        help='Папка общих файлов для --bundle shared (по умолчанию assets рядом с выходным файлом)')
+    parser.add_argument('--vendor-dir', default=VENDOR_DIR, metavar='DIR',
+                        help='Папка сохраненной копии Leaflet (см. python leaflet_bundle.py fetch)')
+    parser.add_argument('--minify', action='store_true', help='Минифицировать встроенные CSS/JS и JSON данные')
+    parser.add_argument('--precompress', action='store_true', help='Записать рядом сжатые копии .gz и .br')
+    parser.add_argument('--compress-level', type=int, default=9, help='Уровень сжатия gzip для --precompress (1-9)')
+    parser.add_argument('--brotli-quality', type=int, default=11, help='Качество сжатия brotli для --precompress (0-11)')
+    parser.add_argument('--telemetry', action='store_true', help='Встроить в страницу телеметрию производительности')
+    parser.add_argument('--telemetry-endpoint', metavar='URL', help='URL для отправки сводки телеметрии (POST)')
+    parser.add_argument('--profile', metavar='JSON', help='Сохранить длительность, байты и элементы по этапам в JSON')
+    parser.add_argument('--profile-cprofile', metavar='DIR', help='Сохранить профиль cProfile каждого этапа в папку')
+    parser.add_argument('--profile-tracemalloc', action='store_true', help='Замерять пик памяти каждого этапа (tracemalloc)')
+    
+    args = parser.parse_args(argv)
     
-    args = parser.parse_args()
+    time_range = None
+    if args.time_from is not None or args.time_to is not None:
+        time_range = (args.time_from, args.time_to)
+    
+    if args.profile or args.profile_cprofile or args.profile_tracemalloc:
+        METRICS.configure(keep_records=True, cprofile_dir=args.profile_cprofile,
+                          trace_memory=args.profile_tracemalloc)
     
     try:
+        # Тайлы большой поездки кладутся рядом со страницей: output.html -> output_tiles/
+        tiles_dir = None
+        if not args.no_tiles:
+            tiles_dir = args.tiles_dir or os.path.splitext(os.path.abspath(args.output))[0] + '_tiles'
+        
         # Инициализируем компоненты
-        data_parser = DataParser()
-        html_generator = HTMLGenerator()
+        html_generator = HTMLGenerator(minify=args.minify, telemetry=args.telemetry or bool(args.telemetry_endpoint),
+                                       telemetry_endpoint=args.telemetry_endpoint, dedup_radius=args.dedup,
+                                       tiles_dir=tiles_dir, tile_threshold=args.tile_threshold,
+                                       tile_url=args.tile_url, bundle=args.bundle, vendor_dir=args.vendor_dir,
+                                       assets_dir=args.assets_dir or os.path.join(
+                                           os.path.dirname(os.path.abspath(args.output)), 'assets'))
         
-        if args.local:
-            # Используем локальные файлы
-            data_dir = args.input
-            gps_file = os.path.join(data_dir, 'gps.csv')
-            detections_file = os.path.join(data_dir, 'detections.json')
-            device_file = os.path.join(data_dir, 'device.txt')
-            
-            # Проверяем наличие файлов
-            for file_path in [gps_file, detections_file, device_file]:
-                if not os.path.exists(file_path):
-                    print(f"Файл не найден: {file_path}")
-                    return 1
-        else:
-            # Загружаем с Яндекс.Диска
-            print("Загрузка данных с Яндекс.Диска...")
-            yandex_downloader = YandexDownloader()
-            loaded_data = yandex_downloader.get_data_from_yandex_disk(args.input)
-            
-            if not loaded_data:
-                print("Не удалось загрузить необходимые файлы")
-                return 1
-            
-            gps_data = loaded_data.get('gps.csv')
-            detections_data = loaded_data.get('detections.json')
-            device_data = loaded_data.get('device.txt')
-            times_data = loaded_data.get('times_full.json')
-        
-        # Парсим данные
-        print("Парсинг GPS данных...")
-        if args.local:
-            gps_data = data_parser.parse_gps_data(gps_file)
-        else:
-            gps_data = data_parser.parse_gps_data(gps_data)
+        # Видео из архива распаковываются, только если они нужны странице
+        video_dir = None
+        if not args.no_video and is_archive(args.input):
+            video_dir = args.video_dir or os.path.join(os.path.dirname(os.path.abspath(args.output)),
+                                                       archive_stem(args.input) + '_video')
         
-        # Получаем оригинальный start_time для нормализации событий
-        gps_start_time = None
-        if gps_data:
-            gps_start_time = gps_data[0]['time'] if gps_data else None
+        # Источник файлов: локальная папка, архив или Яндекс.Диск
+        source = open_trip_source(args.input, local=True if args.local else None, use_mmap=args.mmap,
+                                  video_dir=video_dir)
+        print(f"Источник данных: {source}")
         
-        print("Парсинг событий...")
-        if args.local:
-            events = data_parser.parse_detections_data(detections_file)
-        else:
-            events = data_parser.parse_detections_data(detections_data)
+        with source:
+            print("Загрузка и парсинг данных...")
+            trip = load_trip(source)
         
-        print("Парсинг информации об устройстве...")
-        if args.local:
-            device_info = data_parser.parse_device_info(device_file)
-        else:
-            device_info = data_parser.parse_device_info(device_data)
-        
-        # Парсим данные о временных метках кадров
-        print("Парсинг временных меток...")
-        if args.local:
-            times_file = os.path.join(data_dir, 'times_full.json')
-            if os.path.exists(times_file):
-                times_data = data_parser.parse_times_data(times_file)
-                print(f"Продолжительность видео: {times_data['duration']:.2f} секунд")
-            else:
-                print("Файл times_full.json не найден, используем данные GPS")
-                times_data = None
-        else:
-            if times_data:
-                times_data = data_parser.parse_times_data(times_data)
-                print(f"Продолжительность видео: {times_data['duration']:.2f} секунд")
-            else:
-                print("Файл times_full.json не найден, используем данные GPS")
-                times_data = None
-        
-        # Ищем видео файлы
-        if args.local:
-            data_dir = args.input
-            video_files = data_parser.find_video_files(data_dir)
-            print(f"Найдено локальных видео файлов: {len(video_files)}")
+        gps_data = trip['gps_data']
+        events = trip['events']
+        device_info = trip['device_info']
+        times_data = trip['times_data']
+        video_files = [] if args.no_video else trip['video_files']
+        video_info = [] if args.no_video else trip['video_info']
+        probed = next((info for info in video_info if info), None)
+        
+        if times_data:
+            print(f"Продолжительность видео: {times_data['duration']:.2f} секунд")
+        elif probed:
+            print(f"Файл times_full.json не найден, продолжительность из заголовка видео: "
+                  f"{probed['duration']:.2f} секунд ({probed['frame_count']} кадров, {probed['fps']} к/с)")
         else:
-            # Получаем прямые ссылки на видео с Яндекс.Диска
-            print("Получение ссылок на видео с Яндекс.Диска...")
-            video_urls = yandex_downloader.get_video_urls_from_yandex_disk(args.input)
-            video_files = list(video_urls.values())
-            print(f"Найдено ссылок на видео: {len(video_files)}")
-            for video_name, video_url in video_urls.items():
-                print(f"  {video_name}: {video_url}")
-            
-            if not video_files:
-                print("Предупреждение: Видео файлы не найдены. HTML будет создан без видео.")
+            print("Файл times_full.json не найден, используем данные GPS")
+        
+        print(f"Найдено видео: {len(video_files)}")
+        for video_file in video_files:
+            print(f"  {video_file}")
+        if not video_files:
+            print("Предупреждение: Видео файлы не найдены. HTML будет создан без видео.")
         
         # Генерируем HTML
         print("Генерация HTML...")
-        html_content = html_generator.generate_html(gps_data, events, device_info, video_files, args.output, times_data)
+        if time_range:
+            print(f"Фрагмент поездки: {args.time_from or 0:.1f} - "
+                  f"{'конец' if args.time_to is None else format(args.time_to, '.1f')} с")
+        html_content = html_generator.generate_html(gps_data, events, device_info, video_files, args.output,
+                                                    times_data, time_range, video_info)
+        
+        if args.precompress:
+            print("Сжатие HTML...")
+            print_sizes(precompress_file(args.output, args.compress_level, args.brotli_quality))
+        
+        if args.profile:
+            METRICS.dump_json(args.profile)
+            print(f"Метрики этапов сохранены: {args.profile}")
         
         print("Готово!")
         
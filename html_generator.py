@@ -2,15 +2,272 @@
 Модуль для генерации HTML страницы.
 """
 
+import os
 import json
-from typing import List, Dict, Any
+import hashlib
+from bisect import bisect_right
+from typing import List, Dict, Any, Optional, Tuple, Union
+from event_store import EventStore
+from trip_slice import slice_trip
+from trip_stats import TripStats, format_stats_html
+from pothole_dedup import PotholeDeduplicator
+from tile_builder import TileBuilder, TILE_THRESHOLD, needs_tiles
+from leaflet_bundle import LeafletAssets, VENDOR_DIR, cdn_tags
+from asset_minifier import minify_html
+from pipeline_metrics import METRICS
+
+# Модуль телеметрии страницы (подключается опционально, перед основным скриптом)
+TELEMETRY_SCRIPT = """
+    <script>
+        // Телеметрия производительности страницы
+        (function() {
+            const endpoint = %(endpoint)s;
+            const maxSamples = 5000;
+            const samples = {};
+            const longTasks = [];
+
+            function mark(name) {
+                performance.mark(name);
+            }
+
+            function measure(name, startMark, endMark) {
+                try {
+                    performance.measure(name, startMark, endMark);
+                } catch (e) {
+                    // Метка еще не поставлена
+                }
+            }
+
+            // Длительности хранятся в кольцевом буфере фиксированного размера
+            function record(name, duration) {
+                let series = samples[name];
+                if (!series) {
+                    series = samples[name] = {values: [], next: 0, count: 0};
+                }
+                if (series.values.length < maxSamples) {
+                    series.values.push(duration);
+                } else {
+                    series.values[series.next] = duration;
+                    series.next = (series.next + 1) %% maxSamples;
+                }
+                series.count++;
+            }
+
+            function percentile(sorted, p) {
+                if (!sorted.length) return null;
+                const index = Math.min(sorted.length - 1, Math.ceil(p / 100 * sorted.length) - 1);
+                return sorted[Math.max(index, 0)];
+            }
+
+            if (window.PerformanceObserver && (PerformanceObserver.supportedEntryTypes || []).includes('longtask')) {
+                new PerformanceObserver(list => {
+                    list.getEntries().forEach(entry => longTasks.push({start: entry.startTime, duration: entry.duration}));
+                }).observe({type: 'longtask', buffered: true});
+            }
+
+            function summary() {
+                const handlers = {};
+                Object.keys(samples).forEach(name => {
+                    const sorted = samples[name].values.slice().sort((a, b) => a - b);
+                    handlers[name] = {
+                        count: samples[name].count,
+                        p50: percentile(sorted, 50),
+                        p99: percentile(sorted, 99),
+                        max: sorted[sorted.length - 1]
+                    };
+                });
+
+                const measures = {};
+                performance.getEntriesByType('measure').forEach(entry => {
+                    measures[entry.name] = entry.duration;
+                });
+
+                const mapReady = performance.getEntriesByName('map-ready')[0];
+                const initEnd = mapReady ? mapReady.startTime : Infinity;
+                const initTasks = longTasks.filter(task => task.start < initEnd);
+
+                return {
+                    page: location.pathname,
+                    userAgent: navigator.userAgent,
+                    measures: measures,
+                    handlers: handlers,
+                    longTasks: {
+                        count: longTasks.length,
+                        total: longTasks.reduce((sum, task) => sum + task.duration, 0),
+                        max: longTasks.reduce((max, task) => Math.max(max, task.duration), 0),
+                        duringInit: initTasks.length,
+                        duringInitTotal: initTasks.reduce((sum, task) => sum + task.duration, 0)
+                    }
+                };
+            }
+
+            function report() {
+                const data = summary();
+                if (endpoint) {
+                    const body = JSON.stringify(data);
+                    if (!(navigator.sendBeacon && navigator.sendBeacon(endpoint, body))) {
+                        fetch(endpoint, {method: 'POST', body: body, keepalive: true}).catch(() => {});
+                    }
+                }
+                return data;
+            }
+
+            window.addEventListener('pagehide', report);
+            window.tripTelemetry = {mark, measure, record, summary, report};
+        })();
+    </script>"""
+
+# Живой режим: новые GPS точки и события приходят потоком Server-Sent Events
+# (подключается после основного скрипта и использует его данные и функции)
+LIVE_SCRIPT = """
+    <script>
+        // Живой режим: дописываем трек и события без перезагрузки страницы
+        (function() {
+            const stream = new EventSource(%(endpoint)s);
+
+            // Раскраска по скорости строится один раз и в живом режиме не обновляется
+            document.getElementById('trackModeBtn').style.display = 'none';
+
+            stream.addEventListener('gps', message => {
+                const points = JSON.parse(message.data);
+                if (!points.length) return;
+                for (const point of points) {
+                    gpsData.push(point);
+                    trajectory.addLatLng([point.lat, point.lon]);
+                }
+                extendTimeline(points[points.length - 1].time);
+                // Без воспроизведения маркер следует за последней точкой
+                if (!isPlaying) {
+                    currentTime = endTime;
+                    updateMapMarker(currentTime);
+                    updateTimeline(currentTime);
+                    updateTimeDisplay();
+                }
+            });
+
+            stream.addEventListener('events', message => {
+                for (const event of JSON.parse(message.data)) {
+                    events.push(event);
+                    addEventMarker(event);
+                    addTimelineEvent(event);
+                }
+            });
+        })();
+    </script>"""
+
+# Интервалы скорости для раскраски трека: (верхняя граница в км/ч, цвет, подпись)
+SPEED_BINS = [
+    (5, '#7f8c8d', 'стоянка (< 5 км/ч)'),
+    (20, '#c0392b', '5-20 км/ч'),
+    (40, '#e67e22', '20-40 км/ч'),
+    (60, '#f1c40f', '40-60 км/ч'),
+    (90, '#27ae60', '60-90 км/ч'),
+    (float('inf'), '#2980b9', '> 90 км/ч')
+]
+_SPEED_BIN_LIMITS = [limit for limit, _, _ in SPEED_BINS[:-1]]
+
+# Тайлы подложки карты по умолчанию (прокси тайлов задается параметром tile_url)
+OSM_TILE_URL = 'https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png'
+
+# Минифицированные шаблоны по хэшу исходного шаблона (минифицируются один раз на версию)
+_minified_templates: Dict[str, str] = {}
+
+# Шаблоны со встроенным Leaflet по (хэшу шаблона, хэшу копии Leaflet)
+_bundled_templates: Dict[Tuple[str, str], str] = {}
+
+
+def page_relative_url(path: str, output_file: str = None) -> str:
+    """
+    Адрес локального файла или папки для страницы: относительно папки output_file
+    (без файла страницы - путь как есть), с разделителем '/'.
+    """
+    if output_file:
+        try:
+            path = os.path.relpath(os.path.abspath(path), os.path.dirname(os.path.abspath(output_file)))
+        except ValueError:
+            # Другой диск (Windows): относительного пути нет
+            path = os.path.abspath(path)
+    return path.replace(os.sep, '/')
 
 
 class HTMLGenerator:
     """Класс для генерации HTML страницы просмотра поездки."""
     
-    def __init__(self):
+    def __init__(self, minify: bool = False, telemetry: bool = False, telemetry_endpoint: str = None,
+                 live_endpoint: str = None, dedup_radius: float = None, dedup_time_gap: float = 5.0,
+                 tiles_dir: str = None, tile_threshold: int = TILE_THRESHOLD, tile_jobs: int = None,
+                 tile_url: str = None, bundle: str = 'cdn', assets_dir: str = None, vendor_dir: str = VENDOR_DIR):
+        """
+        Args:
+            minify: Минифицировать встроенные CSS/JS и записывать JSON без пробелов
+            telemetry: Встроить телеметрию производительности страницы
+            telemetry_endpoint: URL для отправки сводки телеметрии (POST при закрытии страницы)
+            live_endpoint: URL потока Server-Sent Events с новыми точками и событиями (живой режим)
+            dedup_radius: Расстояние (м) объединения повторных обнаружений ям (None - не объединять)
+            dedup_time_gap: Максимальный интервал (с) между обнаружениями одной ямы
+            tiles_dir: Папка для PNG тайлов трека и событий больших поездок (None - всегда рисовать в браузере)
+            tile_threshold: Количество точек и событий, начиная с которого строятся тайлы
+            tile_jobs: Количество процессов построения тайлов (по умолчанию - по числу ядер)
+            tile_url: Шаблон адреса тайлов подложки, например кэширующего прокси (по умолчанию OpenStreetMap)
+            bundle: Подключение Leaflet: 'cdn' - с unpkg, 'inline' - встроить в страницу,
+                'shared' - общие файлы в assets_dir, записываемые один раз
+            assets_dir: Папка общих файлов для режима 'shared'
+            vendor_dir: Папка сохраненной копии Leaflet
+        """
+        self.minify = minify
         self.template = self._load_template()
+        if minify:
+            self.template = self._minify_template(self.template)
+        
+        # Leaflet с CDN, встроенный в шаблон или из общей папки рядом со страницами
+        self.leaflet_tags = cdn_tags()
+        self.leaflet_dir = None
+        if bundle == 'inline':
+            self.template = self._bundle_template(self.template, LeafletAssets.load(vendor_dir))
+        elif bundle == 'shared':
+            if not assets_dir:
+                raise ValueError("Для режима shared нужна папка assets_dir")
+            self.leaflet_dir = LeafletAssets.load(vendor_dir).write_shared(assets_dir)
+        elif bundle != 'cdn':
+            raise ValueError(f"Неизвестный режим подключения Leaflet: {bundle}")
+        
+        self.telemetry_html = ''
+        if telemetry:
+            self.telemetry_html = TELEMETRY_SCRIPT % {'endpoint': json.dumps(telemetry_endpoint)}
+            if minify:
+                self.telemetry_html = minify_html(self.telemetry_html)
+        
+        self.live_html = ''
+        if live_endpoint:
+            self.live_html = LIVE_SCRIPT % {'endpoint': json.dumps(live_endpoint)}
+            if minify:
+                self.live_html = minify_html(self.live_html)
+        
+        self.deduplicator = PotholeDeduplicator(dedup_radius, dedup_time_gap) if dedup_radius else None
+        
+        self.tiles_dir = tiles_dir
+        self.tile_threshold = tile_threshold
+        self.tile_builder = TileBuilder(jobs=tile_jobs) if tiles_dir else None
+        self.tile_url = tile_url or OSM_TILE_URL
+    
+    @staticmethod
+    def _minify_template(template: str) -> str:
+        """Возвращает минифицированный шаблон, кэшируя результат для каждой версии шаблона."""
+        key = hashlib.sha1(template.encode('utf-8')).hexdigest()
+        if key not in _minified_templates:
+            _minified_templates[key] = minify_html(template)
+        return _minified_templates[key]
+    
+    @staticmethod
+    def _bundle_template(template: str, assets: LeafletAssets) -> str:
+        """Возвращает шаблон со встроенным Leaflet, собирая его один раз для шаблона и копии Leaflet."""
+        key = (hashlib.sha1(template.encode('utf-8')).hexdigest(), assets.digest)
+        if key not in _bundled_templates:
+            # Фигурные скобки кода Leaflet экранируются для str.format
+            css_tag, js_tag = (tag.replace('{', '{{').replace('}', '}}') for tag in assets.inline_tags())
+            _bundled_templates[key] = (template.replace('{leaflet_css_html}', css_tag)
+                                       .replace('{leaflet_js_html}', js_tag))
+        return _bundled_templates[key]
     
     def _load_template(self) -> str:
         """Загружает HTML шаблон."""
@@ -20,7 +277,7 @@ class HTMLGenerator:
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Просмотр поездки</title>
-    <link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css" />
+    {leaflet_css_html}
     <style>
         * {{
             margin: 0;
@@ -84,6 +341,29 @@ class HTMLGenerator:
             margin-bottom: 10px;
         }}
         
+        .video-stack {{
+            flex: 1;
+            display: flex;
+            gap: 10px;
+            min-height: 0;
+        }}
+        
+        .video-stack.dual .video-player {{
+            width: 50%;
+            border: 2px solid transparent;
+        }}
+        
+        .video-stack.dual .video-player.primary {{
+            border-color: #007bff;
+        }}
+        
+        .drift-display {{
+            align-self: center;
+            font-family: monospace;
+            font-size: 12px;
+            color: #666;
+        }}
+        
         .video-switcher {{
             display: flex;
             gap: 10px;
@@ -125,6 +405,8 @@ class HTMLGenerator:
         .timeline-event {{
             position: absolute;
             top: 0;
+            /* Положение задается временем события (--t) относительно длительности таймлайна */
+            left: calc(var(--t) / var(--timeline-duration) * 100%);
             width: 4px;
             height: 100%;
             transform: translateX(-50%);
@@ -150,6 +432,21 @@ class HTMLGenerator:
             width: 100%;
         }}
         
+        .trip-stats {{
+            display: flex;
+            flex-wrap: wrap;
+            gap: 4px 16px;
+            padding: 8px 10px;
+            font-size: 13px;
+            border-bottom: 1px solid #dee2e6;
+            flex-shrink: 0;
+        }}
+        
+        .trip-stat strong {{
+            color: #555;
+            font-weight: normal;
+        }}
+        
         .device-info {{
             background: #f8f9fa;
             padding: 10px;
@@ -190,6 +487,37 @@ class HTMLGenerator:
             margin-right: 10px;
         }}
         
+        .track-mode-btn {{
+            padding: 8px 12px;
+            background: white;
+            color: #007bff;
+            border: 1px solid #007bff;
+            border-radius: 4px;
+            cursor: pointer;
+        }}
+        
+        .track-mode-btn.active {{
+            background: #007bff;
+            color: white;
+        }}
+        
+        .speed-legend {{
+            background: white;
+            padding: 6px 8px;
+            border-radius: 4px;
+            font-size: 12px;
+            line-height: 18px;
+            box-shadow: 0 1px 4px rgba(0, 0, 0, 0.3);
+        }}
+        
+        .speed-legend i {{
+            display: inline-block;
+            width: 14px;
+            height: 4px;
+            margin-right: 6px;
+            vertical-align: middle;
+        }}
+        
         .time-display {{
             display: inline-block;
             margin-left: 10px;
@@ -205,6 +533,10 @@ class HTMLGenerator:
 <body>
     <div class="container">
         <div class="left-panel">
+            <div class="trip-stats" id="tripStats">
+                {trip_stats_html}
+            </div>
+            
             <div class="device-info" onclick="toggleDeviceInfo()">
                 <h3>Информация об устройстве</h3>
                 <div class="device-details" id="deviceDetails">
@@ -217,10 +549,12 @@ class HTMLGenerator:
                     <div class="video-switcher" id="videoSwitcher">
                         {video_switcher_html}
                     </div>
-                    {video_html}
+                    <div class="video-stack" id="videoStack">
+                        {video_html}
+                    </div>
                 </div>
                 
-                <div class="timeline" id="timeline" onclick="seekToTime(event)">
+                <div class="timeline" id="timeline" onclick="seekToTime(event)" style="--timeline-duration: {timeline_duration}">
                     <div class="timeline-marker" id="timelineMarker"></div>
                     {timeline_events_html}
                 </div>
@@ -228,6 +562,7 @@ class HTMLGenerator:
             
             <div class="controls">
                 <button class="play-pause-btn" id="playPauseBtn" onclick="togglePlayPause()">▶️ Воспроизведение</button>
+                <button class="track-mode-btn" id="trackModeBtn" onclick="toggleSpeedTrack()">🚦 Скорость</button>
                 <span class="time-display" id="timeDisplay">00:00 / 00:00</span>
             </div>
         </div>
@@ -241,37 +576,163 @@ class HTMLGenerator:
         </div>
     </div>
 
-    <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+    {leaflet_js_html}
+    {telemetry_html}
     <script>
+        // Телеметрия (если подключена)
+        const telemetry = window.tripTelemetry || null;
+        
         // Данные GPS
         const gpsData = {gps_data_json};
         
-        // События
-        const events = {events_json};
+        // События (компактное столбцовое представление EventStore)
+        const eventStore = {events_json};
+        const events = unpackEvents(eventStore);
+        
+        // Восстановление списка событий из столбцов
+        function unpackEvents(store) {{
+            const result = new Array(store.time.length);
+            for (let i = 0; i < store.time.length; i++) {{
+                const event = {{
+                    type: store.strings[store.type[i]],
+                    event_type: store.strings[store.event_type[i]],
+                    time: store.time[i],
+                    lat: store.lat[i],
+                    lon: store.lon[i]
+                }};
+                if (store.custom_name[i] >= 0) event.custom_name = store.strings[store.custom_name[i]];
+                if (store.confidence[i] !== null) event.confidence = store.confidence[i];
+                if (store.hits && store.hits[i] > 1) event.hits = store.hits[i];
+                result[i] = event;
+            }}
+            return result;
+        }}
         
         // Информация об устройстве
         const deviceInfo = {device_info_json};
         
-        // Данные временных меток кадров
+        // Время записи каждого кадра видео (секунды от начала записи)
         const frameTimes = {frame_times_json};
         
+        // Смещение среза поездки: начало в исходной записи, индекс первого кадра и число кадров в файле
+        const timeOffset = {time_offset};
+        const frameOffset = {frame_offset};
+        const frameCount = {frame_count};
+        
+        // Ключевые кадры каждого видео из заголовков MP4 (null - индекс неизвестен):
+        // t - время в файле, мс; o - смещения в файле, байт (только для видео по ссылке); оба в разностях
+        const keyframeIndex = {keyframe_index_json}.map(packed => {{
+            if (!packed) return null;
+            const times = new Float64Array(packed.t.length);
+            const offsets = packed.o ? new Float64Array(packed.o.length) : null;
+            let time = 0;
+            let offset = 0;
+            for (let i = 0; i < times.length; i++) {{
+                time += packed.t[i];
+                times[i] = time / 1000;
+                if (offsets) {{
+                    offset += packed.o[i];
+                    offsets[i] = offset;
+                }}
+            }}
+            return {{times, offsets}};
+        }});
+        
+        // Грубые переходы (перетаскивание по таймлайну, переход к событию) ставятся на ключевой
+        // кадр не дальше KEYFRAME_SNAP секунд: декодер начинает с него, не догружая предыдущую группу кадров
+        const KEYFRAME_SNAP = 2;
+        
+        // Предзагрузка видео по ссылке около ближайших событий (с до / после события, не больше байт)
+        const PRELOAD_EVENTS = 3;
+        const PRELOAD_BEFORE = 2;
+        const PRELOAD_AFTER = 5;
+        const PRELOAD_MAX_BYTES = 4 * 1024 * 1024;
+        
         // Временной диапазон
         const startTime = {start_time};
-        const endTime = {end_time};
-        const duration = endTime - startTime;
+        let endTime = {end_time};
+        let duration = endTime - startTime;
         
         // Инициализация карты
+        if (telemetry) telemetry.mark('map-init-start');
         const map = L.map('map').setView([gpsData[0].lat, gpsData[0].lon], 15);
         
-        L.tileLayer('https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{
+        const baseLayer = L.tileLayer({tile_url_json}, {{
             attribution: '© OpenStreetMap contributors'
         }}).addTo(map);
         
+        // Время до первой отрисовки карты (загружены первые тайлы)
+        if (telemetry) {{
+            baseLayer.once('load', () => {{
+                telemetry.mark('map-first-paint');
+                telemetry.measure('time-to-map-paint', undefined, 'map-first-paint');
+            }});
+        }}
+        
+        // Трек рисуется на одном canvas: обычный и раскрашенный по скорости
+        const trackRenderer = L.canvas({{padding: 0.5}});
+        
+        // Тайлы трека и событий, заранее построенные для большой поездки (null - рисуем в браузере)
+        const trackTiles = {track_tiles_json};
+        
         // Создание траектории
         const trajectory = L.polyline(
-            gpsData.map(point => [point.lat, point.lon]),
-            {{color: 'blue', weight: 3}}
-        ).addTo(map);
+            trackTiles ? [] : gpsData.map(point => [point.lat, point.lon]),
+            {{color: 'blue', weight: 3, renderer: trackRenderer}}
+        );
+        if (trackTiles) {{
+            L.tileLayer(trackTiles.url, {{
+                minNativeZoom: trackTiles.minZoom,
+                maxNativeZoom: trackTiles.maxZoom,
+                bounds: trackTiles.bounds
+            }}).addTo(map);
+            document.getElementById('trackModeBtn').style.display = 'none';
+        }} else {{
+            trajectory.addTo(map);
+        }}
+        
+        // Трек по скорости: участки одного интервала скорости (индексы gpsData) объединены
+        // в одну multi-polyline на интервал, так что слоев столько же, сколько интервалов
+        const speedTrack = {speed_track_json};
+        let speedLayer = null;
+        let speedLegend = null;
+        
+        function buildSpeedLayer() {{
+            const layers = speedTrack.map(speedBin => L.polyline(
+                speedBin.runs.map(([first, last]) => {{
+                    const latlngs = new Array(last - first + 1);
+                    for (let i = first; i <= last; i++) latlngs[i - first] = [gpsData[i].lat, gpsData[i].lon];
+                    return latlngs;
+                }}),
+                {{color: speedBin.color, weight: 4, renderer: trackRenderer, interactive: false}}
+            ));
+            speedLayer = L.layerGroup(layers);
+            
+            speedLegend = L.control({{position: 'bottomright'}});
+            speedLegend.onAdd = () => {{
+                const div = L.DomUtil.create('div', 'speed-legend');
+                div.innerHTML = speedTrack.map(speedBin => `<i style="background:${{speedBin.color}}"></i>${{speedBin.label}}`).join('<br>');
+                return div;
+            }};
+        }}
+        
+        // Переключение обычного трека и трека по скорости
+        function toggleSpeedTrack() {{
+            if (!speedTrack.length) return;
+            if (!speedLayer) buildSpeedLayer();
+            
+            const speedMode = !map.hasLayer(speedLayer);
+            if (speedMode) {{
+                map.removeLayer(trajectory);
+                speedLayer.addTo(map);
+                speedLegend.addTo(map);
+            }} else {{
+                map.removeLayer(speedLayer);
+                speedLegend.remove();
+                trajectory.addTo(map);
+            }}
+            document.getElementById('trackModeBtn').classList.toggle('active', speedMode);
+        }}
         
         // Функция для получения цвета события
         function getEventColor(eventType) {{
@@ -286,9 +747,20 @@ class HTMLGenerator:
             return colors[eventType] || colors['default'];
         }}
         
+        // Содержимое всплывающего окна события
+        function eventPopupHtml(event) {{
+            return `
+                <strong>${{event.event_type}}</strong><br>
+                Время: ${{formatTime(event.time)}}<br>
+                GPS: ${{event.lat.toFixed(6)}}, ${{event.lon.toFixed(6)}}<br>
+                ${{event.type === 'pothole' ? 'Уверенность: ' + (event.confidence * 100).toFixed(1) + '%' : ''}}
+                ${{event.hits ? '<br>Обнаружений: ' + event.hits : ''}}
+            `;
+        }}
+        
         // Добавление маркеров событий
         const eventMarkers = [];
-        events.forEach(event => {{
+        function addEventMarker(event) {{
             const eventColor = getEventColor(event.event_type);
             const marker = L.circleMarker([event.lat, event.lon], {{
                 radius: 8,
@@ -297,18 +769,41 @@ class HTMLGenerator:
                 fillOpacity: 0.7
             }}).addTo(map);
             
-            marker.bindPopup(`
-                <strong>${{event.event_type}}</strong><br>
-                Время: ${{formatTime(event.time)}}<br>
-                GPS: ${{event.lat.toFixed(6)}}, ${{event.lon.toFixed(6)}}<br>
-                ${{event.type === 'pothole' ? 'Уверенность: ' + (event.confidence * 100).toFixed(1) + '%' : ''}}
-            `);
+            marker.bindPopup(eventPopupHtml(event));
+            marker.on('click', () => jumpToTime(event.time, true));
             
             eventMarkers.push({{marker, time: event.time}});
-        }});
+        }}
+        
+        if (trackTiles) {{
+            // События нарисованы на тайлах: по щелчку показываем ближайшее в пределах маркера
+            map.on('click', e => {{
+                const clickPoint = map.latLngToContainerPoint(e.latlng);
+                let nearest = null;
+                let nearestDistance = 10;
+                for (const event of events) {{
+                    const distance = clickPoint.distanceTo(map.latLngToContainerPoint([event.lat, event.lon]));
+                    if (distance < nearestDistance) {{
+                        nearest = event;
+                        nearestDistance = distance;
+                    }}
+                }}
+                if (nearest) {{
+                    L.popup().setLatLng([nearest.lat, nearest.lon]).setContent(eventPopupHtml(nearest)).openOn(map);
+                    jumpToTime(nearest.time, true);
+                }}
+            }});
+        }} else {{
+            events.forEach(addEventMarker);
+        }}
         
         // Подгонка карты под траекторию
-        map.fitBounds(trajectory.getBounds());
+        map.fitBounds(trackTiles ? trackTiles.bounds : trajectory.getBounds());
+        
+        if (telemetry) {{
+            telemetry.mark('map-ready');
+            telemetry.measure('leaflet-init', 'map-init-start', 'map-ready');
+        }}
         
         // Получение видео элементов
         const video1 = document.getElementById('video1');
@@ -326,16 +821,134 @@ class HTMLGenerator:
         let isPlaying = false;
         let currentTime = 0;
         
-        // Синхронизация видео
-        function syncVideos() {{
-            if (currentVideo) {{
-                currentVideo.currentTime = currentTime;
+        // Поиск отрезка [i, i + 1] отсортированного массива, содержащего значение.
+        // Курсор запоминает последний отрезок: при воспроизведении время меняется
+        // монотонно и понемногу, поэтому поиск в среднем занимает O(1); при дальних
+        // переходах используется бинарный поиск.
+        function createSegmentCursor(lengthOf, valueAt) {{
+            let cursor = 0;
+            return function(value) {{
+                // Длина читается при каждом поиске: в живом режиме массивы растут
+                const length = lengthOf();
+                if (length < 2) return 0;
+                if (cursor > length - 2) cursor = length - 2;
+                
+                // Несколько шагов от текущего положения
+                for (let step = 0; step < 8; step++) {{
+                    if (value < valueAt(cursor)) {{
+                        if (cursor === 0) return 0;
+                        cursor--;
+                    }} else if (value > valueAt(cursor + 1)) {{
+                        if (cursor === length - 2) return cursor;
+                        cursor++;
+                    }} else {{
+                        return cursor;
+                    }}
+                }}
+                
+                // Бинарный поиск при дальнем переходе
+                let lo = 0;
+                let hi = length - 1;
+                while (hi - lo > 1) {{
+                    const mid = (lo + hi) >> 1;
+                    if (valueAt(mid) <= value) lo = mid; else hi = mid;
+                }}
+                cursor = lo;
+                return cursor;
+            }};
+        }}
+        
+        const findGpsSegment = createSegmentCursor(() => gpsData.length, i => gpsData[i].time);
+        const findFrameSegment = createSegmentCursor(() => frameTimes.length, i => frameTimes[i]);
+        
+        // Частота кадров видео: количество кадров в таблице на длительность файла
+        function getVideoFrameRate(video) {{
+            if (!video || !isFinite(video.duration) || video.duration <= 0 || frameTimes.length < 2) {{
+                return null;
             }}
+            return frameCount / video.duration;
+        }}
+        
+        // Время видео (mediaTime) -> время записи по таблице кадров.
+        // Кадры в файле идут подряд, а время записи учитывает переменную частоту и пропуски.
+        function mediaToTripTime(mediaTime, video) {{
+            const frameRate = getVideoFrameRate(video);
+            if (!frameRate) return mediaTime - timeOffset;
+            
+            const position = mediaTime * frameRate - frameOffset;
+            const index = Math.floor(position + 1e-6);
+            if (index <= 0) return frameTimes[0];
+            if (index >= frameTimes.length - 1) return frameTimes[frameTimes.length - 1];
+            return frameTimes[index] + (frameTimes[index + 1] - frameTimes[index]) * (position - index);
+        }}
+        
+        // Время записи -> время видео (обратное отображение через поиск кадра)
+        function tripToMediaTime(time, video) {{
+            const frameRate = getVideoFrameRate(video);
+            if (!frameRate) return time + timeOffset;
+            
+            const index = findFrameSegment(time);
+            const frameStart = frameTimes[index];
+            const frameEnd = frameTimes[Math.min(index + 1, frameTimes.length - 1)];
+            const fraction = frameEnd > frameStart ? Math.min(Math.max((time - frameStart) / (frameEnd - frameStart), 0), 1) : 0;
+            return (frameOffset + index + fraction) / frameRate;
+        }}
+        
+        // Синхронизация видео (primaryMediaTime - готовое время основного видео, например ключевой кадр)
+        function syncVideos(primaryMediaTime) {{
+            const target = video => video === currentVideo && primaryMediaTime !== undefined
+                ? primaryMediaTime : tripToMediaTime(currentTime, video);
+            if (dualView) {{
+                videos.forEach(video => {{
+                    video.currentTime = target(video);
+                }});
+            }} else if (currentVideo) {{
+                currentVideo.currentTime = target(currentVideo);
+            }}
+        }}
+        
+        // Индекс ключевых кадров видео (элементы video1, video2 соответствуют видео 1, 2)
+        function keyframesOf(video) {{
+            return video ? keyframeIndex[parseInt(video.id.slice(5)) - 1] || null : null;
+        }}
+        
+        // Номер последнего ключевого кадра не позже mediaTime (-1, если таких нет)
+        function findKeyframe(times, mediaTime) {{
+            let lo = -1;
+            let hi = times.length;
+            while (hi - lo > 1) {{
+                const mid = (lo + hi) >> 1;
+                if (times[mid] <= mediaTime) lo = mid; else hi = mid;
+            }}
+            return lo;
+        }}
+        
+        // Ближайший ключевой кадр (before - только не позже mediaTime) в пределах KEYFRAME_SNAP
+        function snapToKeyframe(video, mediaTime, before) {{
+            const index = keyframesOf(video);
+            if (!index || !index.times.length) return mediaTime;
+            const i = findKeyframe(index.times, mediaTime);
+            let best = i >= 0 ? index.times[i] : null;
+            if (!before && i + 1 < index.times.length &&
+                (best === null || index.times[i + 1] - mediaTime < mediaTime - best)) {{
+                best = index.times[i + 1];
+            }}
+            return best !== null && Math.abs(best - mediaTime) <= KEYFRAME_SNAP ? best : mediaTime;
         }}
         
         // Переключение видео
         function switchVideo(index) {{
-            if (videos[index]) {{
+            if (videos[index] && dualView) {{
+                // В режиме двух камер оба видео уже буферизованы: меняем только основное, без перемотки
+                currentVideoIndex = index;
+                currentVideo = videos[index];
+                videos.forEach(video => {{
+                    video.muted = video !== currentVideo;
+                    video.classList.toggle('primary', video === currentVideo);
+                    video.playbackRate = 1;
+                }});
+                updateSwitcherButtons();
+            }} else if (videos[index]) {{
                 // Скрываем все видео
                 videos.forEach(video => {{
                     if (video) video.style.display = 'none';
@@ -347,28 +960,111 @@ class HTMLGenerator:
                 currentVideo = videos[index];
                 
                 // Обновляем активную кнопку
-                document.querySelectorAll('.video-switch-btn').forEach((btn, i) => {{
-                    btn.classList.toggle('active', i === index);
-                }});
+                updateSwitcherButtons();
                 
                 // Синхронизируем время
-                if (currentVideo) {{
-                    currentVideo.currentTime = currentTime;
-                }}
+                syncVideos();
+            }}
+        }}
+        
+        function updateSwitcherButtons() {{
+            document.querySelectorAll('.video-switch-btn:not(.dual-view-btn)').forEach((btn, i) => {{
+                btn.classList.toggle('active', i === currentVideoIndex);
+            }});
+            const dualButton = document.getElementById('dualViewBtn');
+            if (dualButton) dualButton.classList.toggle('active', dualView);
+        }}
+        
+        // Режим двух камер: оба видео воспроизводятся рядом, второе подстраивается под основное
+        let dualView = false;
+        let driftTimer = null;
+        let measuredDrift = 0;
+        
+        // Параметры регулятора рассинхронизации
+        const driftTolerance = 0.02;   // с, меньше - не корректируем
+        const driftHardLimit = 1.0;    // с, больше - перематываем
+        const driftGain = 0.5;         // изменение скорости на секунду рассинхронизации
+        const driftMaxRateChange = 0.1;
+        
+        function toggleDualView() {{
+            if (videos.length < 2) return;
+            dualView = !dualView;
+            document.getElementById('videoStack').classList.toggle('dual', dualView);
+            
+            const secondary = videos.find(video => video !== currentVideo);
+            if (dualView) {{
+                videos.forEach(video => {{
+                    video.style.display = 'block';
+                    video.muted = video !== currentVideo;
+                    video.classList.toggle('primary', video === currentVideo);
+                }});
+                secondary.currentTime = tripToMediaTime(currentTime, secondary);
+                if (!currentVideo.paused) secondary.play();
+                driftTimer = setInterval(controlDrift, 250);
+            }} else {{
+                clearInterval(driftTimer);
+                driftTimer = null;
+                measuredDrift = 0;
+                videos.forEach(video => {{
+                    video.playbackRate = 1;
+                    video.muted = false;
+                    video.classList.remove('primary');
+                    if (video !== currentVideo) {{
+                        video.pause();
+                        video.style.display = 'none';
+                    }}
+                }});
+                document.getElementById('driftDisplay').textContent = '';
             }}
+            updateSwitcherButtons();
         }}
         
+        // Держит второе видео синхронно с основным, меняя playbackRate вместо перемоток
+        function controlDrift() {{
+            const primary = currentVideo;
+            const secondary = videos.find(video => video !== primary);
+            if (!dualView || !primary || !secondary) return;
+            
+            const target = tripToMediaTime(mediaToTripTime(primary.currentTime, primary), secondary);
+            const drift = secondary.currentTime - target;
+            measuredDrift = drift;
+            document.getElementById('driftDisplay').textContent = `Рассинхронизация: ${{(drift * 1000).toFixed(0)}} мс`;
+            if (telemetry) telemetry.record('videoDriftMs', Math.abs(drift * 1000));
+            
+            if (primary.paused) {{
+                if (!secondary.paused) secondary.pause();
+                secondary.playbackRate = 1;
+                if (Math.abs(drift) > driftTolerance) secondary.currentTime = target;
+                return;
+            }}
+            if (secondary.paused) secondary.play();
+            
+            if (Math.abs(drift) > driftHardLimit) {{
+                // Слишком большая рассинхронизация (например, после перемотки) - перематываем
+                secondary.currentTime = target;
+                secondary.playbackRate = primary.playbackRate;
+            }} else if (Math.abs(drift) > driftTolerance) {{
+                const correction = Math.max(-driftMaxRateChange, Math.min(driftMaxRateChange, drift * driftGain));
+                secondary.playbackRate = primary.playbackRate * (1 - correction);
+            }} else {{
+                secondary.playbackRate = primary.playbackRate;
+            }}
+        }}
+        
+        // Измеренная рассинхронизация камер в секундах (для диагностики)
+        window.getVideoDrift = () => measuredDrift;
+        
         // Интерполяция GPS координат
         function interpolateGPS(time) {{
             // Находим две ближайшие GPS точки
             let point1 = null;
             let point2 = null;
             
-            for (let i = 0; i < gpsData.length - 1; i++) {{
+            if (gpsData.length > 1) {{
+                const i = findGpsSegment(time);
                 if (gpsData[i].time <= time && gpsData[i + 1].time >= time) {{
                     point1 = gpsData[i];
                     point2 = gpsData[i + 1];
-                    break;
                 }}
             }}
             
@@ -423,15 +1119,14 @@ class HTMLGenerator:
             return (bearing + 360) % 360;
         }}
         
+        // Маркер текущего положения (создается один раз, затем только перемещается)
+        let currentMarker = null;
+        let currentDirection = null;
+        
         // Обновление маркера на карте
         function updateMapMarker(time) {{
             const [lat, lon, course] = interpolateGPS(time);
             
-            // Удаляем предыдущий маркер
-            if (window.currentMarker) {{
-                map.removeLayer(window.currentMarker);
-            }}
-            
             // Определяем направление движения
             let direction = course;
             if (direction === null || direction === undefined) {{
@@ -439,11 +1134,11 @@ class HTMLGenerator:
                 let point1 = null;
                 let point2 = null;
                 
-                for (let i = 0; i < gpsData.length - 1; i++) {{
+                if (gpsData.length > 1) {{
+                    const i = findGpsSegment(time);
                     if (gpsData[i].time <= time && gpsData[i + 1].time >= time) {{
                         point1 = gpsData[i];
                         point2 = gpsData[i + 1];
-                        break;
                     }}
                 }}
                 
@@ -460,18 +1155,33 @@ class HTMLGenerator:
                     direction = 0; // По умолчанию на север
                 }}
             }}
-            direction -= 90;
-            
-            // Создаем иконку стрелочки
-            const arrowIcon = L.divIcon({{
-                html: `<div style="transform: rotate(${{direction}}deg); font-size: 30px; color: #ff0000; text-align: center; line-height: 1;">➤</div>`,
-                iconSize: [30, 30],
-                iconAnchor: [15, 15],
-                className: 'arrow-marker'
-            }});
+            direction = Math.round(direction - 90);
+            
+            if (!currentMarker) {{
+                // Создаем иконку стрелочки
+                const arrowIcon = L.divIcon({{
+                    html: `<div style="transform: rotate(${{direction}}deg); font-size: 30px; color: #ff0000; text-align: center; line-height: 1;">➤</div>`,
+                    iconSize: [30, 30],
+                    iconAnchor: [15, 15],
+                    className: 'arrow-marker'
+                }});
+                
+                // Создаем маркер со стрелочкой
+                currentMarker = L.marker([lat, lon], {{icon: arrowIcon}}).addTo(map);
+                currentDirection = direction;
+                return;
+            }}
+            
+            currentMarker.setLatLng([lat, lon]);
             
-            // Создаем маркер со стрелочкой
-            window.currentMarker = L.marker([lat, lon], {{icon: arrowIcon}}).addTo(map);
+            // Поворачиваем стрелку, только если направление изменилось
+            if (direction !== currentDirection) {{
+                const element = currentMarker.getElement();
+                if (element && element.firstChild) {{
+                    element.firstChild.style.transform = `rotate(${{direction}}deg)`;
+                }}
+                currentDirection = direction;
+            }}
         }}
         
         // Обновление таймлайна
@@ -480,6 +1190,26 @@ class HTMLGenerator:
             timelineMarker.style.left = (progress * 100) + '%';
         }}
         
+        // Добавление события на таймлайн (положение считается в CSS от --t)
+        function addTimelineEvent(event) {{
+            const element = document.createElement('div');
+            element.className = 'timeline-event event-' + event.event_type;
+            element.title = event.event_type;
+            element.style.setProperty('--t', event.time - startTime);
+            timeline.appendChild(element);
+        }}
+        
+        // Увеличение длительности поездки (живой режим): события таймлайна
+        // пересчитываются браузером по --timeline-duration, без обхода всех элементов
+        function extendTimeline(time) {{
+            if (time <= endTime) return;
+            endTime = time;
+            duration = endTime - startTime;
+            timeline.style.setProperty('--timeline-duration', duration);
+            updateTimeline(currentTime);
+            updateTimeDisplay();
+        }}
+        
         // Форматирование времени
         function formatTime(seconds) {{
             const mins = Math.floor(seconds / 60);
@@ -498,29 +1228,155 @@ class HTMLGenerator:
         function togglePlayPause() {{
             if (isPlaying) {{
                 if (currentVideo) currentVideo.pause();
+                if (dualView) videos.forEach(video => video.pause());
                 playPauseBtn.textContent = '▶️ Воспроизведение';
                 isPlaying = false;
             }} else {{
                 if (currentVideo) currentVideo.play();
+                if (dualView) videos.forEach(video => video.play());
                 playPauseBtn.textContent = '⏸️ Пауза';
                 isPlaying = true;
             }}
         }}
         
-        // Переход к времени по клику на таймлайн
+        // Переход к времени по клику на таймлайн (клик по событию - переход к событию)
         function seekToTime(event) {{
+            // Клик, завершающий перетаскивание, уже обработан
+            if (timelineDragEnded) {{
+                timelineDragEnded = false;
+                return;
+            }}
+            const eventOffset = parseFloat(event.target.style.getPropertyValue('--t'));
+            if (event.target !== timeline && !isNaN(eventOffset)) {{
+                jumpToTime(startTime + eventOffset, true);
+                return;
+            }}
+            seekToPosition(event.clientX);
+        }}
+        
+        function seekToPosition(clientX) {{
             const rect = timeline.getBoundingClientRect();
-            const x = event.clientX - rect.left;
-            const progress = x / rect.width;
-            const time = startTime + progress * duration;
-            
+            const progress = Math.min(Math.max((clientX - rect.left) / rect.width, 0), 1);
+            jumpToTime(startTime + progress * duration, false);
+        }}
+        
+        // Грубый переход: основное видео ставится на ключевой кадр рядом с time
+        // (toEvent - на кадр не позже времени, чтобы событие не было пропущено)
+        function jumpToTime(time, toEvent) {{
             currentTime = time;
-            syncVideos();
-            updateMapMarker(time);
-            updateTimeline(time);
+            let mediaTime;
+            if (currentVideo) {{
+                mediaTime = snapToKeyframe(currentVideo, tripToMediaTime(time, currentVideo), toEvent);
+                currentTime = mediaToTripTime(mediaTime, currentVideo);
+            }}
+            syncVideos(mediaTime);
+            updateMapMarker(currentTime);
+            updateTimeline(currentTime);
             updateTimeDisplay();
         }}
         
+        // Перетаскивание по таймлайну: переходы не чаще одного на кадр отрисовки.
+        // Указатель захватывается только после начала перетаскивания: при захвате клик
+        // приходит таймлайну, и клик по событию не отличался бы от клика по шкале
+        const TIMELINE_DRAG_THRESHOLD = 4;
+        let timelineDrag = null;
+        let timelineDragEnded = false;
+        timeline.addEventListener('pointerdown', event => {{
+            timelineDrag = {{pointerId: event.pointerId, startX: event.clientX, started: false, pendingX: null}};
+            timelineDragEnded = false;
+        }});
+        timeline.addEventListener('pointermove', event => {{
+            if (!timelineDrag || event.pointerId !== timelineDrag.pointerId) return;
+            if (!timelineDrag.started) {{
+                if (Math.abs(event.clientX - timelineDrag.startX) < TIMELINE_DRAG_THRESHOLD) return;
+                timelineDrag.started = true;
+                timeline.setPointerCapture(event.pointerId);
+            }}
+            if (timelineDrag.pendingX === null) {{
+                requestAnimationFrame(() => {{
+                    if (timelineDrag && timelineDrag.pendingX !== null) seekToPosition(timelineDrag.pendingX);
+                    if (timelineDrag) timelineDrag.pendingX = null;
+                }});
+            }}
+            timelineDrag.pendingX = event.clientX;
+        }});
+        const endTimelineDrag = event => {{
+            if (timelineDrag && timelineDrag.started) {{
+                if (event.type === 'pointerup') {{
+                    // Последняя позиция перетаскивания; следующий клик не повторяет переход
+                    seekToPosition(event.clientX);
+                    timelineDragEnded = true;
+                }}
+            }}
+            timelineDrag = null;
+        }};
+        timeline.addEventListener('pointerup', endTimelineDrag);
+        timeline.addEventListener('pointercancel', endTimelineDrag);
+        
+        // Предзагрузка видео по ссылке около следующих событий: запрос Range от ключевого кадра
+        // перед событием до ключевого кадра после него кладет данные в HTTP кэш браузера,
+        // и переход к событию не ждет сети. Ошибки (например, без CORS) не мешают просмотру.
+        const preloadedRanges = new Set();
+        let preloadQueue = Promise.resolve();
+        function preloadAroundEvents() {{
+            videos.forEach(video => {{
+                const index = keyframesOf(video);
+                const url = (video.currentSrc || '').split('#')[0];
+                if (!index || !index.offsets || !url.startsWith('http') || !isFinite(video.duration)) return;
+                let first = 0;
+                while (first < events.length && events[first].time < currentTime) first++;
+                events.slice(first, first + PRELOAD_EVENTS).forEach(event => {{
+                    const mediaTime = tripToMediaTime(event.time, video);
+                    const from = Math.max(findKeyframe(index.times, mediaTime - PRELOAD_BEFORE), 0);
+                    const to = findKeyframe(index.times, mediaTime + PRELOAD_AFTER) + 1;
+                    const start = index.offsets[from];
+                    const end = to < index.offsets.length
+                        ? Math.min(index.offsets[to], start + PRELOAD_MAX_BYTES) - 1 : start + PRELOAD_MAX_BYTES - 1;
+                    const key = video.id + ':' + start;
+                    if (preloadedRanges.has(key)) return;
+                    preloadedRanges.add(key);
+                    preloadQueue = preloadQueue.then(() => fetch(url, {{
+                        headers: {{Range: 'bytes=' + start + '-' + end}},
+                        mode: 'cors',
+                        credentials: 'omit'
+                    }}).then(response => response.arrayBuffer())).catch(() => {{}});
+                }});
+            }});
+        }}
+        
+        // Обновление карты, таймлайна и времени по времени видео
+        function applyMediaTime(video, mediaTime) {{
+            const handlerStart = telemetry ? performance.now() : 0;
+            currentTime = mediaToTripTime(mediaTime, video);
+            updateMapMarker(currentTime);
+            if (telemetry) telemetry.record('updateMapMarker', performance.now() - handlerStart);
+            updateTimeline(currentTime);
+            updateTimeDisplay();
+            if (telemetry) telemetry.record('frameSync', performance.now() - handlerStart);
+        }}
+        
+        const supportsVideoFrameCallback = 'requestVideoFrameCallback' in HTMLVideoElement.prototype;
+        
+        // Запасной вариант без requestVideoFrameCallback: цикл requestAnimationFrame на время воспроизведения
+        let animationLoopActive = false;
+        function startAnimationLoop() {{
+            if (animationLoopActive) return;
+            animationLoopActive = true;
+            let lastMediaTime = null;
+            const step = () => {{
+                if (!currentVideo || currentVideo.paused || currentVideo.ended) {{
+                    animationLoopActive = false;
+                    return;
+                }}
+                if (currentVideo.currentTime !== lastMediaTime) {{
+                    lastMediaTime = currentVideo.currentTime;
+                    applyMediaTime(currentVideo, lastMediaTime);
+                }}
+                requestAnimationFrame(step);
+            }};
+            requestAnimationFrame(step);
+        }}
+        
         // Обработчики событий видео
         videos.forEach((video, index) => {{
             if (video) {{
@@ -529,19 +1385,37 @@ class HTMLGenerator:
                     video.style.display = 'none';
                 }}
                 
+                // Во время воспроизведения карта обновляется на каждый кадр (см. ниже),
+                // timeupdate нужен для перемоток на паузе
                 video.addEventListener('timeupdate', () => {{
-                    if (video === currentVideo) {{
-                        currentTime = video.currentTime;
-                        updateMapMarker(currentTime);
-                        updateTimeline(currentTime);
-                        updateTimeDisplay();
+                    if (video === currentVideo && video.paused) {{
+                        applyMediaTime(video, video.currentTime);
                     }}
                 }});
                 
+                if (supportsVideoFrameCallback) {{
+                    // Колбэк вызывается для каждого показанного кадра с его точным mediaTime
+                    const onVideoFrame = (now, metadata) => {{
+                        if (video === currentVideo) {{
+                            applyMediaTime(video, metadata.mediaTime);
+                        }}
+                        video.requestVideoFrameCallback(onVideoFrame);
+                    }};
+                    video.requestVideoFrameCallback(onVideoFrame);
+                }}
+                
+                // Для среза поездки ставим видео точно на начало среза, когда известна длительность файла
+                if (timeOffset > 0) {{
+                    video.addEventListener('loadedmetadata', () => {{
+                        video.currentTime = tripToMediaTime(currentTime, video);
+                    }});
+                }}
+                
                 video.addEventListener('play', () => {{
                     if (video === currentVideo) {{
                         isPlaying = true;
                         playPauseBtn.textContent = '⏸️ Пауза';
+                        if (!supportsVideoFrameCallback) startAnimationLoop();
                     }}
                 }});
                 
@@ -551,6 +1425,13 @@ class HTMLGenerator:
                         playPauseBtn.textContent = '▶️ Воспроизведение';
                     }}
                 }});
+                
+                // Видео простаивает - догружаем участки около следующих событий
+                ['loadedmetadata', 'seeked', 'pause'].forEach(type => {{
+                    video.addEventListener(type, () => {{
+                        if (video === currentVideo || dualView) preloadAroundEvents();
+                    }});
+                }});
             }}
         }});
         
@@ -601,66 +1482,230 @@ class HTMLGenerator:
             switchVideo(0);
         }}
     </script>
+    {live_html}
 </body>
 </html>"""
     
-    def generate_html(self, gps_data: List[Dict[str, Any]], events: List[Dict[str, Any]], 
+    def generate_html(self, gps_data: List[Dict[str, Any]], events: Union[List[Dict[str, Any]], EventStore], 
                      device_info: Dict[str, Any], video_files: List[str], output_file: str = None, 
-                     times_data: Dict[str, Any] = None) -> str:
+                     times_data: Dict[str, Any] = None, time_range: Tuple[float, float] = None,
+                     video_info: List[Optional[Dict[str, Any]]] = None) -> str:
         """
         Генерирует HTML страницу.
         
         Args:
             gps_data: GPS данные
-            events: События
+            events: События (список или EventStore)
             device_info: Информация об устройстве
             video_files: Список видео файлов
             output_file: Путь к выходному файлу
+            times_data: Данные о кадрах видео
+            time_range: Интервал (начало, конец) в секундах от начала записи; None - вся поездка.
+                Границы могут быть None (с начала / до конца записи)
+            video_info: Метаданные видео из заголовков MP4 (mp4_probe), по одному на видео
         """
-        # Сортируем события по времени
-        events.sort(key=lambda x: x['time'])
-        
-        # Находим временной диапазон
-        if times_data and times_data['duration'] > 0:
-            # Используем данные из times_full.json для точной продолжительности видео
-            start_time = 0
-            end_time = times_data['duration']
-        else:
-            # Fallback на GPS данные (теперь время уже нормализовано)
-            start_time = 0  # Начало записи всегда 0
-            end_time = max(gps_data[-1]['time'], events[-1]['time'] if events else gps_data[-1]['time'])
-        
-        # Генерируем HTML компоненты
-        device_info_html = self._generate_device_info_html(device_info)
-        video_switcher_html = self._generate_video_switcher_html(video_files)
-        video_html = self._generate_video_html(video_files)
-        timeline_events_html = self._generate_timeline_events_html(events, start_time, end_time)
-        
-        # Заполняем шаблон
-        frame_times_json = json.dumps(times_data.get('frame_times', []) if times_data else [])
-        
-        html_content = self.template.format(
-            device_info_html=device_info_html,
-            video_switcher_html=video_switcher_html,
-            video_html=video_html,
-            timeline_events_html=timeline_events_html,
-            gps_data_json=json.dumps(gps_data),
-            events_json=json.dumps(events),
-            device_info_json=json.dumps(device_info),
-            frame_times_json=frame_times_json,
-            start_time=start_time,
-            end_time=end_time
-        )
+        with METRICS.stage('generate_html') as record:
+            # Повторные обнаружения одной ямы на соседних кадрах заменяем одним событием
+            if self.deduplicator is not None:
+                events = self.deduplicator.deduplicate(events)
+            
+            # Упорядочиваем события по времени (один раз, в EventStore)
+            if not isinstance(events, EventStore):
+                events = EventStore.from_events(events)
+            
+            # Метаданные основного видео (None, если заголовок не прочитан)
+            probed_video = video_info[0] if video_info else None
+            
+            # Находим временной диапазон и смещения видео относительно среза (без среза - нулевые)
+            frame_count = len(times_data.get('frame_times', [])) if times_data else 0
+            time_offset = 0
+            frame_offset = 0
+            media_fragment = ''
+            
+            if time_range is not None:
+                trip_slice = slice_trip(gps_data, events, times_data, *time_range)
+                gps_data = trip_slice['gps_data']
+                events = trip_slice['events']
+                times_data = trip_slice['times_data']
+                time_offset = trip_slice['time_offset']
+                frame_offset = trip_slice['frame_offset']
+                frame_count = trip_slice['frame_count']
+                # Подсказка браузеру начать загрузку видео с начала среза (точная позиция ставится скриптом)
+                media_fragment = '#t={:.3f}'.format(time_offset)
+                start_time = 0
+                end_time = trip_slice['duration']
+            elif times_data and times_data['duration'] > 0:
+                # Используем данные из times_full.json для точной продолжительности видео
+                start_time = 0
+                end_time = times_data['duration']
+            elif probed_video and probed_video['duration'] > 0:
+                # Без times_full.json точная продолжительность берется из заголовка видео
+                start_time = 0
+                end_time = probed_video['duration']
+            else:
+                # Fallback на GPS данные (теперь время уже нормализовано)
+                start_time = 0  # Начало записи всегда 0
+                end_time = max(gps_data[-1]['time'], events.end_time if len(events) else gps_data[-1]['time'])
+            
+            # Статистика поездки (для среза - по фрагменту)
+            trip_stats = TripStats().compute(gps_data, events)
+            
+            # Большую поездку (или ее фрагмент) показываем тайлами вместо полилинии и маркеров
+            track_tiles = None
+            if self.tile_builder is not None and needs_tiles(len(gps_data), len(events), self.tile_threshold):
+                track_tiles = self._build_track_tiles(gps_data, events, output_file)
+            
+            # Локальные видео указываются относительно страницы (страницу можно перенести вместе с видео)
+            if output_file:
+                video_files = [video_file if video_file.startswith('http') else page_relative_url(video_file, output_file)
+                               for video_file in video_files]
+            
+            # Генерируем HTML компоненты
+            trip_stats_html = format_stats_html(trip_stats)
+            device_info_html = self._generate_device_info_html(device_info)
+            video_switcher_html = self._generate_video_switcher_html(video_files)
+            video_html = self._generate_video_html(video_files, media_fragment)
+            timeline_events_html = self._generate_timeline_events_html(events, start_time, end_time)
+            
+            # Заполняем шаблон
+            json_separators = (',', ':') if self.minify else None
+            # Для синхронизации нужно только время записи каждого кадра
+            frame_times = times_data.get('frame_times', []) if times_data else []
+            frame_times_json = json.dumps([round(frame['time'], 4) for frame in frame_times],
+                                          separators=(',', ':'))
+            
+            leaflet_css_html, leaflet_js_html = self.leaflet_tags
+            if self.leaflet_dir is not None:
+                leaflet_url = page_relative_url(self.leaflet_dir, output_file)
+                leaflet_css_html, leaflet_js_html = LeafletAssets.shared_tags(leaflet_url)
+            
+            html_content = self.template.format(
+                leaflet_css_html=leaflet_css_html,
+                leaflet_js_html=leaflet_js_html,
+                device_info_html=device_info_html,
+                trip_stats_html=trip_stats_html,
+                telemetry_html=self.telemetry_html,
+                video_switcher_html=video_switcher_html,
+                video_html=video_html,
+                timeline_events_html=timeline_events_html,
+                gps_data_json=json.dumps(gps_data, separators=json_separators),
+                events_json=json.dumps(events.to_compact(), separators=(',', ':')),
+                device_info_json=json.dumps(device_info, separators=json_separators),
+                frame_times_json=frame_times_json,
+                speed_track_json=json.dumps([] if track_tiles else self._generate_speed_track(gps_data),
+                                            separators=(',', ':'), ensure_ascii=False),
+                track_tiles_json=json.dumps(track_tiles),
+                keyframe_index_json=json.dumps(self._generate_keyframe_index(video_files, video_info),
+                                               separators=(',', ':')),
+                tile_url_json=json.dumps(self.tile_url),
+                time_offset=round(time_offset, 6),
+                frame_offset=frame_offset,
+                frame_count=frame_count,
+                start_time=start_time,
+                end_time=end_time,
+                timeline_duration=end_time - start_time,
+                live_html=self.live_html
+            )
+            record.bytes = len(html_content)
+            record.items = len(gps_data) + len(events)
         
         # Если указан файл, сохраняем в файл
         if output_file:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(html_content)
+            with METRICS.stage('write') as record:
+                with open(output_file, 'w', encoding='utf-8') as f:
+                    f.write(html_content)
+                record.bytes = len(html_content)
             print("HTML файл создан: {}".format(output_file))
         
         # Возвращаем HTML как строку
         return html_content
     
+    def _build_track_tiles(self, gps_data: List[Dict[str, Any]], events: EventStore,
+                           output_file: str = None) -> Dict[str, Any]:
+        """
+        Строит тайлы трека и событий в self.tiles_dir.
+        
+        Args:
+            gps_data: GPS данные
+            events: События
+            output_file: Путь к выходному файлу (адрес тайлов записывается относительно него)
+            
+        Returns:
+            Параметры слоя тайлов для страницы: шаблон адреса, уровни масштаба и границы
+        """
+        print(f"Поездка большая ({len(gps_data)} точек, {len(events)} событий), строятся тайлы...")
+        manifest = self.tile_builder.build([gps_data], events, self.tiles_dir)
+        return {
+            'url': page_relative_url(self.tiles_dir, output_file) + '/' + manifest['url'],
+            'minZoom': manifest['min_zoom'],
+            'maxZoom': manifest['max_zoom'],
+            'bounds': manifest['bounds']
+        }
+    
+    def _generate_speed_track(self, gps_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Разбивает трек на участки по интервалам скорости SPEED_BINS.
+        
+        Соседние точки одного интервала объединяются в участок [первая, последняя точка];
+        последняя точка участка - первая точка следующего, чтобы в треке не было разрывов.
+        Точки без скорости (отрицательное значение) продолжают текущий участок.
+        
+        Returns:
+            Непустые интервалы скорости: цвет, подпись и участки (индексы в gps_data)
+        """
+        runs = [[] for _ in SPEED_BINS]
+        current = None
+        run_start = 0
+        
+        for index, point in enumerate(gps_data):
+            speed = point.get('speed')
+            if speed is None or speed < 0:
+                continue
+            speed_bin = bisect_right(_SPEED_BIN_LIMITS, speed * 3.6)
+            if speed_bin == current:
+                continue
+            if current is not None:
+                runs[current].append([run_start, index])
+                run_start = index
+            current = speed_bin
+        
+        if current is not None and run_start < len(gps_data) - 1:
+            runs[current].append([run_start, len(gps_data) - 1])
+        
+        return [
+            {'color': color, 'label': label, 'runs': bin_runs}
+            for (_, color, label), bin_runs in zip(SPEED_BINS, runs) if bin_runs
+        ]
+    
+    def _generate_keyframe_index(self, video_files: List[str],
+                                 video_info: List[Optional[Dict[str, Any]]] = None) -> List[Optional[Dict[str, List[int]]]]:
+        """
+        Упаковывает индексы ключевых кадров видео для страницы: время (мс) и, для видео
+        по ссылке, смещения в файле в виде разностей соседних значений.
+        
+        Args:
+            video_files: Видео страницы
+            video_info: Метаданные видео из mp4_probe
+            
+        Returns:
+            Индекс для каждого видео (None - индекса нет или каждый кадр ключевой)
+        """
+        def deltas(values: List[int]) -> List[int]:
+            return [value - previous for previous, value in zip([0] + values[:-1], values)]
+        
+        index = []
+        for i, video_file in enumerate(video_files):
+            info = video_info[i] if video_info and i < len(video_info) else None
+            if not info or not info['keyframes'] or len(info['keyframes']) >= info['frame_count']:
+                index.append(None)
+                continue
+            packed = {'t': deltas([round(time * 1000) for time in info['keyframes']])}
+            # Смещения нужны только для предзагрузки по сети
+            if video_file.startswith('http') and len(info['keyframe_offsets']) == len(info['keyframes']):
+                packed['o'] = deltas(list(info['keyframe_offsets']))
+            index.append(packed)
+        return index
+    
     def _generate_device_info_html(self, device_info: Dict[str, Any]) -> str:
         """Генерирует HTML для информации об устройстве."""
         info_items = [
@@ -674,11 +1719,12 @@ class HTMLGenerator:
         
         return '\n'.join(info_items)
     
-    def _generate_video_html(self, video_files: List[str]) -> str:
-        """Генерирует HTML для видео плееров."""
+    def _generate_video_html(self, video_files: List[str], media_fragment: str = '') -> str:
+        """Генерирует HTML для видео плееров (media_fragment - фрагмент #t= для среза поездки)."""
         video_html = []
         
         for i, video_file in enumerate(video_files, 1):
+            video_file += media_fragment
             # Проверяем, является ли это URL или локальным путем
             if video_file.startswith('http'):
                 # Это прямая ссылка на видео
@@ -713,19 +1759,25 @@ class HTMLGenerator:
                 )
             )
         
+        # Режим двух камер рядом
+        switcher_html.append(
+            '<button class="video-switch-btn dual-view-btn" id="dualViewBtn" onclick="toggleDualView()">Обе камеры</button>'
+        )
+        switcher_html.append('<span class="drift-display" id="driftDisplay"></span>')
+        
         return '\n'.join(switcher_html)
     
-    def _generate_timeline_events_html(self, events: List[Dict[str, Any]], 
+    def _generate_timeline_events_html(self, events: EventStore, 
                                      start_time: float, end_time: float) -> str:
         """Генерирует HTML для событий на таймлайне."""
         timeline_events = []
         
-        for event in events:
-            left_percent = ((event['time'] - start_time) / (end_time - start_time)) * 100
+        for time, type_code in zip(events.times, events.event_type_codes):
+            event_type = events.strings[type_code]
             timeline_events.append(
                 '<div class="timeline-event event-{}" '
-                'style="left: {}%" title="{}"></div>'.format(
-                    event["event_type"], left_percent, event["event_type"]
+                'style="--t: {}" title="{}"></div>'.format(
+                    event_type, round(time - start_time, 3), event_type
                 )
             )
         
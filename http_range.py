@@ -0,0 +1,53 @@
+"""
+Модуль разбора заголовка HTTP Range.
+Общий для сервера страниц поездок и локальной замены API Яндекс.Диска,
+чтобы им не приходилось импортировать друг друга.
+"""
+
+from typing import Optional, Tuple
+
+
+class RangeNotSatisfiable(Exception):
+    """Диапазон задан корректно, но начинается за концом файла (ответ 416)."""
+
+
+def parse_range(range_header: Optional[str], file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Разбирает заголовок Range с одним диапазоном.
+
+    Неподдерживаемый или некорректный заголовок (несколько диапазонов, единицы
+    не bytes, ошибка в числах) игнорируется по RFC 7233: отдается весь файл.
+
+    Args:
+        range_header: Значение заголовка Range
+        file_size: Размер файла
+
+    Returns:
+        Кортеж (начало, конец включительно) или None, если диапазон не задан или не поддерживается
+
+    Raises:
+        RangeNotSatisfiable: Диапазон начинается за концом файла (или суффикс нулевой длины)
+    """
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+
+    start_text, _, end_text = range_header[6:].strip().partition('-')
+    if not (start_text or end_text).isdigit() or (end_text and not end_text.isdigit()):
+        return None
+    if start_text:
+        start = int(start_text)
+        if end_text and int(end_text) < start:
+            # Синтаксически неверный диапазон игнорируется
+            return None
+        if start >= file_size:
+            raise RangeNotSatisfiable(range_header)
+        end = int(end_text) if end_text else file_size - 1
+    else:
+        # Суффиксный диапазон: последние N байт
+        suffix = int(end_text)
+        if suffix == 0 or file_size == 0:
+            raise RangeNotSatisfiable(range_header)
+        start = max(file_size - suffix, 0)
+        end = file_size - 1
+
+    return start, min(end, file_size - 1)
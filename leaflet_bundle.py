@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Модуль подключения Leaflet к страницам поездок без обращения к CDN.
+
+По умолчанию страница загружает leaflet.css и leaflet.js с unpkg, и до их загрузки
+карта не рисуется. Сохраненную в папке vendor/leaflet копию Leaflet можно встроить
+в страницу (режим inline) или один раз записать общими файлами с хэшем содержимого
+в имени папки (режим shared), на которые ссылаются все страницы. Файлы читаются
+один раз на процесс и перечитываются только при изменении.
+"""
+
+import os
+import re
+import sys
+import base64
+import shutil
+import hashlib
+import argparse
+from typing import Dict, List, Tuple
+
+LEAFLET_VERSION = '1.9.4'
+CDN_URL = 'https://unpkg.com/leaflet@{version}/dist/{name}'
+
+# Папка сохраненной копии Leaflet (заполняется командой fetch)
+VENDOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vendor', 'leaflet')
+
+LEAFLET_FILES = ['leaflet.js', 'leaflet.css', 'images/layers.png', 'images/layers-2x.png',
+                 'images/marker-icon.png', 'images/marker-icon-2x.png', 'images/marker-shadow.png']
+
+# Закрепленные хэши файлов (в формате Subresource Integrity): загруженный файл
+# с другим содержимым не записывается. Хэши leaflet.js и leaflet.css совпадают
+# с опубликованными на странице загрузки Leaflet
+PINNED_DIGESTS = {
+    '1.9.4': {
+        'leaflet.js': 'sha256-20nQCchB9co0qIjJZRGuk2/Z9VM+kNiyxNV1lvTlZBo=',
+        'leaflet.css': 'sha256-p4NxAoJBhIIN+hmNHrzRCf9tD/miZyoHS5obTRR9BMY=',
+        'images/layers.png': 'sha256-Hbvp0CjikvNvy6j4s6KNXokydU/CIVuaxp5M3s9RB8Y=',
+        'images/layers-2x.png': 'sha256-Bm2sqFDY/77wB68AsG6sABVyje4nnFHzy2xxbffELt8=',
+        'images/marker-icon.png': 'sha256-V0w6XMqF9BFAhbaEFZbWLwDXyJLHsD8oy/owHesdxDc=',
+        'images/marker-icon-2x.png': 'sha256-ABecTB7oMNOhCEEq4NKU9Vd2z+sIXGASmjmqb8SuJSg=',
+        'images/marker-shadow.png': 'sha256-Jk9cZAM58ELdcpBiz8BMF/jqDymIK1OOOEjtjxDttNo='
+    }
+}
+
+# Режимы подключения: CDN, встраивание в страницу, общие файлы рядом со страницами
+BUNDLE_MODES = ['cdn', 'inline', 'shared']
+
+# Загруженные копии по пути папки: (подпись файлов, ресурсы)
+_loaded_assets: Dict[str, Tuple[Tuple, 'LeafletAssets']] = {}
+
+
+def cdn_tags(version: str = LEAFLET_VERSION) -> Tuple[str, str]:
+    """Теги подключения Leaflet с CDN (с проверкой целостности по PINNED_DIGESTS): (стили, скрипт)."""
+    digests = PINNED_DIGESTS.get(version, {})
+
+    def integrity(name: str) -> str:
+        return ' integrity="{}" crossorigin=""'.format(digests[name]) if name in digests else ''
+
+    return ('<link rel="stylesheet" href="{}"{} />'.format(CDN_URL.format(version=version, name='leaflet.css'),
+                                                           integrity('leaflet.css')),
+            '<script src="{}"{}></script>'.format(CDN_URL.format(version=version, name='leaflet.js'),
+                                                 integrity('leaflet.js')))
+
+
+def sri_digest(content: bytes) -> str:
+    """Хэш содержимого в формате Subresource Integrity (sha256-<base64>)."""
+    return 'sha256-' + base64.b64encode(hashlib.sha256(content).digest()).decode('ascii')
+
+
+def _signature(vendor_dir: str) -> Tuple:
+    """Размеры и время изменения файлов копии (по ним видно, что ее обновили)."""
+    signature = []
+    for name in LEAFLET_FILES:
+        try:
+            stat = os.stat(os.path.join(vendor_dir, name))
+        except FileNotFoundError:
+            continue
+        signature.append((name, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+class LeafletAssets:
+    """Содержимое сохраненной копии Leaflet."""
+
+    def __init__(self, vendor_dir: str):
+        """
+        Args:
+            vendor_dir: Папка с leaflet.js, leaflet.css и images/
+
+        Raises:
+            FileNotFoundError: В папке нет leaflet.js или leaflet.css
+        """
+        self.vendor_dir = vendor_dir
+        self.files: Dict[str, bytes] = {}
+        for name in LEAFLET_FILES:
+            path = os.path.join(vendor_dir, name)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    self.files[name] = f.read()
+        for name in ['leaflet.js', 'leaflet.css']:
+            if name not in self.files:
+                raise FileNotFoundError(f"Нет сохраненной копии Leaflet ({name} не найден в {vendor_dir}). "
+                                        f"Выполните один раз python leaflet_bundle.py fetch (нужен доступ к unpkg.com) "
+                                        f"или используйте --bundle cdn")
+        digest = hashlib.sha256()
+        for name in sorted(self.files):
+            digest.update(name.encode('utf-8') + b'\0' + self.files[name])
+        self.digest = digest.hexdigest()[:12]
+
+    @classmethod
+    def load(cls, vendor_dir: str = VENDOR_DIR) -> 'LeafletAssets':
+        """Возвращает копию Leaflet, прочитанную один раз на процесс (перечитывается после изменения файлов)."""
+        key = os.path.realpath(vendor_dir)
+        signature = _signature(key)
+        cached = _loaded_assets.get(key)
+        if cached is None or cached[0] != signature:
+            cached = _loaded_assets[key] = (signature, cls(key))
+        return cached[1]
+
+    @property
+    def js(self) -> str:
+        return self.files['leaflet.js'].decode('utf-8')
+
+    @property
+    def css(self) -> str:
+        return self.files['leaflet.css'].decode('utf-8')
+
+    def inline_css(self) -> str:
+        """Стили, в которых картинки заменены data: URI."""
+        def replace(match: re.Match) -> str:
+            content = self.files.get(match.group(1))
+            if content is None:
+                return match.group(0)
+            return 'url(data:image/png;base64,{})'.format(base64.b64encode(content).decode('ascii'))
+
+        return re.sub(r'url\((images/[\w.-]+\.png)\)', replace, self.css)
+
+    def inline_tags(self) -> Tuple[str, str]:
+        """Теги со встроенным Leaflet: (стили, скрипт)."""
+        # Закрывающий тег внутри кода завершил бы элемент раньше времени
+        js = self.js.replace('</script', '<\\/script')
+        css = self.inline_css().replace('</style', '<\\/style')
+        return '<style>\n{}\n</style>'.format(css), '<script>\n{}\n</script>'.format(js)
+
+    def write_shared(self, assets_dir: str) -> str:
+        """
+        Записывает копию в папку assets_dir/leaflet-<хэш>, если ее там еще нет.
+        Содержимое папки с данным хэшем не меняется, поэтому ее можно кэшировать навсегда.
+
+        Args:
+            assets_dir: Общая папка ресурсов страниц
+
+        Returns:
+            Путь к папке копии
+        """
+        target = os.path.join(assets_dir, 'leaflet-{}'.format(self.digest))
+        if os.path.isdir(target):
+            return target
+        # Запись во временную папку и переименование: параллельные генераторы не увидят неполную копию
+        temp_dir = '{}.{}.tmp'.format(target, os.getpid())
+        for name, content in self.files.items():
+            path = os.path.join(temp_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+        try:
+            os.rename(temp_dir, target)
+        except OSError:
+            # Папку успел записать другой процесс
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        return target
+
+    @staticmethod
+    def shared_tags(base_url: str) -> Tuple[str, str]:
+        """Теги подключения общей копии по адресу ее папки: (стили, скрипт)."""
+        return ('<link rel="stylesheet" href="{}/leaflet.css" />'.format(base_url),
+                '<script src="{}/leaflet.js"></script>'.format(base_url))
+
+
+def fetch_leaflet(vendor_dir: str = VENDOR_DIR, version: str = LEAFLET_VERSION) -> List[str]:
+    """
+    Загружает файлы Leaflet с CDN в папку копии, проверяя их по PINNED_DIGESTS.
+    Файлы записываются, только если все загруженные файлы совпали с закрепленными хэшами.
+
+    Args:
+        vendor_dir: Папка копии
+        version: Версия Leaflet (должна быть в PINNED_DIGESTS)
+
+    Returns:
+        Список записанных файлов
+
+    Raises:
+        ValueError: Для версии нет закрепленных хэшей или файл не совпал с хэшем
+    """
+    import requests
+
+    digests = PINNED_DIGESTS.get(version)
+    if digests is None:
+        raise ValueError(f"Нет закрепленных хэшей для Leaflet {version} (известные версии: "
+                         f"{', '.join(sorted(PINNED_DIGESTS))})")
+
+    downloaded = {}
+    for name in LEAFLET_FILES:
+        response = requests.get(CDN_URL.format(version=version, name=name), timeout=30)
+        response.raise_for_status()
+        digest = sri_digest(response.content)
+        if digest != digests[name]:
+            raise ValueError(f"{name}: хэш {digest} не совпадает с закрепленным {digests[name]}; файлы не записаны")
+        print(f"  {name}: {len(response.content)} байт, {digest}")
+        downloaded[name] = response.content
+
+    written = []
+    for name, content in downloaded.items():
+        path = os.path.join(vendor_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        written.append(path)
+    return written
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description='Сохраненная копия Leaflet для страниц без CDN')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    fetch_parser = subparsers.add_parser('fetch', help='Загрузить Leaflet с CDN в папку копии')
+    fetch_parser.add_argument('--vendor-dir', default=VENDOR_DIR, help='Папка копии')
+    fetch_parser.add_argument('--version', default=LEAFLET_VERSION, help='Версия Leaflet (с закрепленными хэшами в PINNED_DIGESTS)')
+
+    info_parser = subparsers.add_parser('info', help='Показать состав и хэш копии')
+    info_parser.add_argument('--vendor-dir', default=VENDOR_DIR, help='Папка копии')
+
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'fetch':
+            print(f"Загрузка Leaflet {args.version} в {args.vendor_dir}")
+            fetch_leaflet(args.vendor_dir, args.version)
+            return 0
+
+        assets = LeafletAssets.load(args.vendor_dir)
+    except Exception as e:
+        print(f"Ошибка: {e}")
+        return 1
+
+    print(f"Копия Leaflet: {args.vendor_dir}, хэш {assets.digest}")
+    digests = PINNED_DIGESTS.get(LEAFLET_VERSION, {})
+    for name, content in sorted(assets.files.items()):
+        status = 'совпадает с Leaflet {}'.format(LEAFLET_VERSION) if sri_digest(content) == digests.get(name) \
+            else 'не совпадает с закрепленным хэшем'
+        print(f"  {name}: {len(content)} байт, {status}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,340 @@
+"""
+Модуль живого режима: просмотр поездки, которая еще записывается.
+Новые строки gps.csv и новые события detections.json читаются по мере появления
+и отправляются открытым страницам потоком Server-Sent Events.
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+import urllib.parse as ul
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Optional, Tuple
+
+from data_parser import DataParser
+from html_generator import HTMLGenerator
+
+# Интервал отправки комментария-пинга, чтобы прокси не закрывали простаивающее соединение
+KEEPALIVE_INTERVAL = 15.0
+
+
+class GpsTail:
+    """
+    Чтение дописываемого gps.csv с последней прочитанной позиции.
+    Разбираются только полные строки (до последнего перевода строки), незаконченная
+    строка дочитывается при следующем опросе.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Путь к gps.csv
+        """
+        self.path = path
+        self.offset = 0
+        self.header = b''
+        self.start_time: Optional[float] = None
+
+    def poll(self) -> List[Dict[str, Any]]:
+        """
+        Читает новые полные строки файла.
+
+        Returns:
+            Новые GPS точки (время относительно первой точки записи)
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < self.offset:
+                    # Файл перезаписан - начинаем сначала
+                    print(f"Файл {self.path} стал короче, чтение начинается сначала")
+                    self.offset = 0
+                    self.header = b''
+                    self.start_time = None
+                if size == self.offset:
+                    return []
+                f.seek(self.offset)
+                chunk = f.read(size - self.offset)
+        except FileNotFoundError:
+            return []
+
+        end = chunk.rfind(b'\n')
+        if end < 0:
+            return []
+        chunk = chunk[:end + 1]
+        self.offset += len(chunk)
+
+        if not self.header:
+            header_end = chunk.find(b'\n')
+            self.header = chunk[:header_end + 1]
+            chunk = chunk[header_end + 1:]
+        if not chunk.strip():
+            return []
+
+        if self.start_time is not None:
+            return DataParser.parse_gps_data(self.header + chunk, self.start_time)
+
+        # Время начала записи - время первой точки, как при обычном разборе файла
+        points = DataParser.parse_gps_data(self.header + chunk, 0.0)
+        self.start_time = points[0]['time']
+        for point in points:
+            point['time'] -= self.start_time
+        return points
+
+
+class DetectionsTail:
+    """
+    Отслеживание detections.json. Файл перезаписывается целиком, поэтому он читается
+    заново при изменении размера или времени изменения, а наружу отдаются только
+    события, которых не было в прошлой версии.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Путь к detections.json
+        """
+        self.path = path
+        self.signature: Optional[Tuple[int, int]] = None
+        # Количество уже отданных элементов каждого массива файла
+        self.counts = {'manualEvents': 0, 'potholes': 0}
+
+    def poll(self) -> List[Dict[str, Any]]:
+        """
+        Перечитывает файл, если он изменился.
+
+        Returns:
+            Новые события
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if signature == self.signature:
+            return []
+
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            # Файл записывается прямо сейчас - прочитаем при следующем опросе
+            return []
+        self.signature = signature
+
+        new_data = {}
+        for key in self.counts:
+            items = data.get(key, [])
+            if len(items) < self.counts[key]:
+                # Массив стал короче (файл перезаписан) - новыми считаем элементы сверх прежнего числа
+                self.counts[key] = len(items)
+            new_data[key] = items[self.counts[key]:]
+            self.counts[key] = len(items)
+        return DataParser.detections_to_events(new_data)
+
+
+class LiveTrip:
+    """
+    Состояние записываемой поездки: все точки и события и журнал изменений
+    с порядковыми номерами, по которым клиенты получают пропущенные обновления.
+    """
+
+    def __init__(self, data_dir: str):
+        """
+        Args:
+            data_dir: Папка записываемой поездки
+        """
+        self.data_dir = data_dir
+        self.gps_tail = GpsTail(os.path.join(data_dir, 'gps.csv'))
+        self.detections_tail = DetectionsTail(os.path.join(data_dir, 'detections.json'))
+        self.gps_data: List[Dict[str, Any]] = []
+        self.events: List[Dict[str, Any]] = []
+        # Журнал изменений: (номер, тип сообщения, данные)
+        self.deltas: List[Tuple[int, str, List[Dict[str, Any]]]] = []
+        self.seq = 0
+        self.changed = threading.Condition()
+
+    def poll(self) -> int:
+        """
+        Читает новые данные из файлов и будит ожидающих клиентов.
+
+        Returns:
+            Количество новых точек и событий
+        """
+        points = self.gps_tail.poll()
+        events = self.detections_tail.poll()
+        if not points and not events:
+            return 0
+
+        with self.changed:
+            if points:
+                self.gps_data.extend(points)
+                self.seq += 1
+                self.deltas.append((self.seq, 'gps', points))
+            if events:
+                self.events.extend(events)
+                self.seq += 1
+                self.deltas.append((self.seq, 'events', events))
+            self.changed.notify_all()
+        return len(points) + len(events)
+
+    def snapshot(self) -> Tuple[int, List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Возвращает (номер последнего изменения, копии точек и событий) для генерации страницы."""
+        with self.changed:
+            return self.seq, list(self.gps_data), list(self.events)
+
+    def deltas_since(self, seq: int) -> List[Tuple[int, str, List[Dict[str, Any]]]]:
+        """Возвращает изменения с номером больше seq."""
+        with self.changed:
+            if seq >= self.seq:
+                return []
+            # Номера идут подряд с 1, поэтому позиция в журнале вычисляется напрямую
+            return self.deltas[seq:]
+
+    def wait(self, seq: int, timeout: float) -> bool:
+        """Ждет изменения с номером больше seq. Возвращает True, если оно появилось."""
+        with self.changed:
+            return self.changed.wait_for(lambda: self.seq > seq, timeout)
+
+
+class LiveServer(ThreadingHTTPServer):
+    """HTTP сервер живой страницы поездки с фоновым опросом файлов."""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], data_dir: str, interval: float = 1.0, quiet: bool = False):
+        super().__init__(address, LiveRequestHandler)
+        self.trip = LiveTrip(data_dir)
+        self.interval = interval
+        self.quiet = quiet
+        self.device_info = {}
+        device_path = os.path.join(data_dir, 'device.txt')
+        if os.path.exists(device_path):
+            with open(device_path, 'rb') as f:
+                self.device_info = DataParser.parse_device_info(f)
+        self._stop = threading.Event()
+        self._poller = threading.Thread(target=self._poll_loop, daemon=True)
+        self._poller.start()
+
+    def _poll_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.trip.poll()
+            except Exception as e:
+                print(f"Ошибка чтения данных поездки: {e}")
+            self._stop.wait(self.interval)
+
+    def render_page(self) -> Optional[str]:
+        """Генерирует страницу по текущим данным (None, если точек для трека еще мало)."""
+        seq, gps_data, events = self.trip.snapshot()
+        if len(gps_data) < 2:
+            return None
+        # Страница подписывается на изменения после тех, что уже вошли в нее
+        generator = HTMLGenerator(live_endpoint='/events?since={}'.format(seq))
+        return generator.generate_html(gps_data, events, self.device_info, [])
+
+    def server_close(self):
+        self._stop.set()
+        super().server_close()
+
+
+class LiveRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов LiveServer."""
+
+    server: LiveServer
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        parsed = ul.urlsplit(self.path)
+        query = ul.parse_qs(parsed.query)
+        if parsed.path == '/':
+            self.send_live_page()
+        elif parsed.path == '/events':
+            # При переподключении браузер сам передает номер последнего полученного изменения
+            last_id = self.headers.get('Last-Event-ID') or query.get('since', ['0'])[0]
+            try:
+                since = int(last_id)
+            except ValueError:
+                self.send_error(400, explain="Некорректный номер изменения")
+                return
+            self.send_event_stream(since)
+        else:
+            self.send_error(404)
+
+    def send_live_page(self):
+        page = self.server.render_page()
+        if page is None:
+            body = ('<!DOCTYPE html><html lang="ru"><head><meta charset="UTF-8">'
+                    '<meta http-equiv="refresh" content="2"><title>Ожидание данных</title></head>'
+                    '<body><p>Ожидание GPS данных...</p></body></html>').encode('utf-8')
+            status = 503
+        else:
+            body = page.encode('utf-8')
+            status = 200
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_event_stream(self, since: int):
+        """Отдает поток Server-Sent Events, пока клиент не отключится."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-store')
+        # Длина потока неизвестна, соединение закрывается по его окончании
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        trip = self.server.trip
+        try:
+            while True:
+                for seq, kind, items in trip.deltas_since(since):
+                    message = 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+                        seq, kind, json.dumps(items, separators=(',', ':')))
+                    self.wfile.write(message.encode('utf-8'))
+                    since = seq
+                self.wfile.flush()
+                if not trip.wait(since, KEEPALIVE_INTERVAL):
+                    self.wfile.write(b': ping\n\n')
+                    self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(prog='generate_html.py live',
+                                     description='Живой просмотр записываемой поездки')
+    parser.add_argument('data_dir', help='Папка поездки, в которую идет запись (gps.csv, detections.json)')
+    parser.add_argument('--host', default='127.0.0.1', help='Адрес для прослушивания')
+    parser.add_argument('--port', type=int, default=8001, help='Порт')
+    parser.add_argument('--interval', type=float, default=1.0, help='Интервал опроса файлов, с')
+    parser.add_argument('--quiet', action='store_true', help='Не выводить журнал запросов')
+
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.data_dir):
+        print(f"Папка не найдена: {args.data_dir}")
+        return 1
+
+    server = LiveServer((args.host, args.port), args.data_dir, args.interval, args.quiet)
+    print(f"Живой режим: http://{args.host}:{args.port}/ (папка {args.data_dir})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nСервер остановлен")
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Локальная замена публичного API Яндекс.Диска для тестов и нагрузочных замеров загрузчика.
+Отдает список файлов /v1/disk/public/resources (с постраничной выдачей) и сами файлы
+из локальной папки поездки с настраиваемыми задержкой, скоростью и ошибками.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+import urllib.parse as ul
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Optional, Tuple
+
+from http_range import RangeNotSatisfiable, parse_range
+
+# Размер блока при отдаче файлов
+CHUNK_SIZE = 64 * 1024
+
+
+class MockYandexServer(ThreadingHTTPServer):
+    """HTTP сервер, имитирующий публичное API Яндекс.Диска поверх локальной папки."""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], root: str, latency: float = 0.0, bandwidth: float = None,
+                 error_rate: float = 0.0, error_status: int = 503, strip_video_extension: bool = True,
+                 seed: int = None, quiet: bool = False):
+        """
+        Args:
+            address: Адрес и порт
+            root: Папка, содержимое которой отдается как публичная папка
+            latency: Задержка перед каждым ответом в секундах
+            bandwidth: Ограничение скорости отдачи файлов в байтах в секунду (None - без ограничения)
+            error_rate: Вероятность ответа ошибкой
+            error_status: HTTP статус внедряемой ошибки
+            strip_video_extension: Отдавать video.mp4/video_2.mp4 как video/video_2, как на Яндекс.Диске
+            seed: Начальное значение генератора случайных чисел для ошибок
+            quiet: Не выводить журнал запросов
+        """
+        super().__init__(address, MockYandexRequestHandler)
+        self.root = os.path.realpath(root)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.strip_video_extension = strip_video_extension
+        self.quiet = quiet
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._md5_cache: Dict[Tuple[str, float], str] = {}
+        self.counters = {'listings': 0, 'downloads': 0, 'bytes_sent': 0, 'errors_injected': 0}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def should_fail(self) -> bool:
+        """Решает, отвечать ли ошибкой на текущий запрос."""
+        with self._lock:
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.counters['errors_injected'] += 1
+        return fail
+
+    def public_name(self, filename: str) -> str:
+        """Имя файла в выдаче API."""
+        if self.strip_video_extension and filename in ('video.mp4', 'video_2.mp4'):
+            return filename[:-len('.mp4')]
+        return filename
+
+    def local_path(self, relative_path: str) -> Optional[str]:
+        """Находит локальный файл по пути из выдачи API (или None, если он вне корня)."""
+        path = os.path.realpath(os.path.join(self.root, relative_path.lstrip('/')))
+        if os.path.commonpath([path, self.root]) != self.root:
+            return None
+        if not os.path.exists(path) and self.strip_video_extension and os.path.exists(path + '.mp4'):
+            path += '.mp4'
+        return path
+
+    def md5(self, path: str) -> str:
+        """MD5 файла (кэшируется по времени изменения)."""
+        key = (path, os.path.getmtime(path))
+        if key not in self._md5_cache:
+            digest = hashlib.md5()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            self._md5_cache[key] = digest.hexdigest()
+        return self._md5_cache[key]
+
+    def list_items(self, folder_path: str, host_url: str) -> Optional[List[Dict[str, Any]]]:
+        """Формирует элементы _embedded.items для папки."""
+        folder = self.local_path(folder_path)
+        if folder is None or not os.path.isdir(folder):
+            return None
+
+        items = []
+        for filename in sorted(os.listdir(folder)):
+            path = os.path.join(folder, filename)
+            name = self.public_name(filename)
+            item_path = '/' + '/'.join(part for part in [folder_path.strip('/'), name] if part)
+            if os.path.isdir(path):
+                items.append({'name': name, 'path': item_path, 'type': 'dir'})
+            else:
+                items.append({
+                    'name': name,
+                    'path': item_path,
+                    'type': 'file',
+                    'size': os.path.getsize(path),
+                    'md5': self.md5(path),
+                    'mime_type': 'video/mp4' if filename.endswith('.mp4') else 'application/octet-stream',
+                    'file': host_url + '/download' + ul.quote(item_path)
+                })
+        return items
+
+
+class MockYandexRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов MockYandexServer."""
+
+    server: MockYandexServer
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if self.server.should_fail():
+            self.send_json(self.server.error_status, {'error': 'InjectedError', 'description': 'Внедренная ошибка'})
+            return
+
+        parsed = ul.urlsplit(self.path)
+        if parsed.path == '/v1/disk/public/resources':
+            self.send_listing(ul.parse_qs(parsed.query))
+        elif parsed.path.startswith('/download/'):
+            self.send_download(ul.unquote(parsed.path[len('/download'):]))
+        elif parsed.path == '/stats':
+            self.send_json(200, self.server.counters)
+        else:
+            self.send_json(404, {'error': 'NotFound'})
+
+    def send_listing(self, query: Dict[str, List[str]]):
+        """Отдает список файлов папки с постраничной выдачей, как /v1/disk/public/resources."""
+        self.server.count('listings')
+        folder_path = query.get('path', [''])[0]
+        limit = int(query.get('limit', ['20'])[0])
+        offset = int(query.get('offset', ['0'])[0])
+
+        host_url = 'http://' + (self.headers.get('Host') or self.server.base_url[len('http://'):])
+        items = self.server.list_items(folder_path, host_url)
+        if items is None:
+            self.send_json(404, {'error': 'DiskNotFoundError', 'description': 'Resource not found.'})
+            return
+
+        self.send_json(200, {
+            'name': os.path.basename(folder_path.rstrip('/')) or 'disk',
+            'path': folder_path or '/',
+            'type': 'dir',
+            'public_key': query.get('public_key', [''])[0],
+            '_embedded': {
+                'items': items[offset:offset + limit],
+                'limit': limit,
+                'offset': offset,
+                'total': len(items),
+                'path': folder_path or '/'
+            }
+        })
+
+    def send_download(self, item_path: str):
+        """Отдает файл с поддержкой Range и ограничением скорости."""
+        path = self.server.local_path(item_path)
+        if path is None or not os.path.isfile(path):
+            self.send_json(404, {'error': 'NotFound'})
+            return
+
+        self.server.count('downloads')
+        file_size = os.path.getsize(path)
+        range_header = self.headers.get('Range')
+        try:
+            byte_range = parse_range(range_header, file_size)
+        except RangeNotSatisfiable:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{}'.format(file_size))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start, end = byte_range if byte_range else (0, file_size - 1)
+        length = end - start + 1
+
+        self.send_response(206 if byte_range else 200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        if byte_range:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, file_size))
+        self.end_headers()
+
+        started = time.monotonic()
+        sent = 0
+        with open(path, 'rb') as f:
+            f.seek(start)
+            while sent < length:
+                chunk = f.read(min(CHUNK_SIZE, length - sent))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                # Ограничение скорости: ждем, пока средняя скорость не опустится до лимита
+                if self.server.bandwidth:
+                    delay = sent / self.server.bandwidth - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+        self.server.count('bytes_sent', sent)
+
+    def send_json(self, status: int, data: Any):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальная замена публичного API Яндекс.Диска')
+    parser.add_argument('root', help='Папка, отдаваемая как публичная папка (например, папка поездки)')
+    parser.add_argument('--host', default='127.0.0.1', help='Адрес для прослушивания')
+    parser.add_argument('--port', type=int, default=8900, help='Порт')
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка перед каждым ответом, с')
+    parser.add_argument('--bandwidth', type=float, default=None, help='Ограничение скорости отдачи файлов, байт/с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Вероятность ответа ошибкой (0-1)')
+    parser.add_argument('--error-status', type=int, default=503, help='HTTP статус внедряемой ошибки')
+    parser.add_argument('--seed', type=int, default=None, help='Начальное значение генератора ошибок')
+    parser.add_argument('--quiet', action='store_true', help='Не выводить журнал запросов')
+
+    args = parser.parse_args()
+
+    server = MockYandexServer((args.host, args.port), args.root, args.latency, args.bandwidth,
+                              args.error_rate, args.error_status, seed=args.seed, quiet=args.quiet)
+    print(f"Мок API Яндекс.Диска: {server.base_url}")
+    print(f"Использование: YANDEX_API_BASE_URL={server.base_url} python generate_html.py https://disk.yandex.ru/d/mock")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nСервер остановлен")
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
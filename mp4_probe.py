@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+Модуль чтения метаданных MP4 без загрузки видео.
+
+Читается только атом moov: длительность и шкала времени видеодорожки, количество
+кадров, частота кадров и индекс ключевых кадров (время и смещение в файле).
+Локальные файлы читаются с позиционированием, удаленные - небольшими запросами
+с заголовком Range. Результаты кэшируются по md5 (Яндекс.Диск) или по пути,
+размеру и времени изменения локального файла.
+"""
+
+import os
+import sys
+import json
+import struct
+import argparse
+import threading
+from array import array
+from typing import Dict, Any, List, Optional, Tuple, Iterator
+
+from pipeline_metrics import METRICS
+
+# Сколько байт читать за один запрос Range (заголовки атомов и moov с faststart попадают в первый запрос)
+READ_AHEAD = 64 * 1024
+
+# Версия записей кэша: меняется, когда меняется разбор (старые записи перечитываются)
+CACHE_VERSION = 2
+
+# Предел размера moov: у многочасовой записи таблицы кадров занимают единицы мегабайт
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+
+
+class Mp4ProbeError(Exception):
+    """Файл не MP4, в нем нет видеодорожки или сервер не поддерживает Range."""
+
+
+class FileReader:
+    """Чтение локального файла по смещению."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self.requests = 0
+        self.bytes_read = 0
+
+    def read(self, offset: int, length: int) -> bytes:
+        self._file.seek(offset)
+        data = self._file.read(length)
+        self.requests += 1
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+class HttpRangeReader:
+    """
+    Чтение удаленного файла запросами Range с упреждением: каждый запрос
+    читает не меньше READ_AHEAD байт, последний блок хранится в памяти.
+    """
+
+    def __init__(self, url: str, session=None, read_ahead: int = READ_AHEAD, timeout: float = 30.0):
+        """
+        Args:
+            url: Прямая ссылка на файл
+            session: Сессия requests (по умолчанию создается новая)
+            read_ahead: Минимальный размер запроса
+            timeout: Таймаут запроса, с
+        """
+        import requests
+
+        self.url = url
+        # Переданную сессию (например, общую сессию загрузчика) закрывает ее владелец
+        self._owns_session = session is None
+        self.session = session or requests.Session()
+        self.read_ahead = read_ahead
+        self.timeout = timeout
+        self.requests = 0
+        self.bytes_read = 0
+        self._block_offset = 0
+        self._block = b''
+        self.size = None
+        # Первый запрос заодно сообщает размер файла (Content-Range)
+        self._fetch(0, read_ahead)
+
+    def _fetch(self, offset: int, length: int):
+        end = offset + length - 1
+        if self.size is not None:
+            end = min(end, self.size - 1)
+        response = self.session.get(self.url, headers={'Range': 'bytes={}-{}'.format(offset, end)},
+                                    stream=True, timeout=self.timeout)
+        try:
+            if response.status_code != 206:
+                # Сервер отдает файл целиком - видео не загружаем
+                raise Mp4ProbeError(f"Сервер не поддерживает Range (ответ {response.status_code}): {self.url}")
+            content_range = response.headers.get('Content-Range', '')
+            total = content_range.rpartition('/')[2]
+            if self.size is None:
+                if not total.isdigit():
+                    raise Mp4ProbeError(f"Нет размера файла в Content-Range: {content_range!r}")
+                self.size = int(total)
+            self._block = response.content
+            self._block_offset = offset
+        finally:
+            response.close()
+        self.requests += 1
+        self.bytes_read += len(self._block)
+
+    def read(self, offset: int, length: int) -> bytes:
+        length = max(min(length, self.size - offset), 0)
+        block_end = self._block_offset + len(self._block)
+        if not (self._block_offset <= offset and offset + length <= block_end):
+            self._fetch(offset, max(length, self.read_ahead))
+        start = offset - self._block_offset
+        return self._block[start:start + length]
+
+    def close(self):
+        if self._owns_session:
+            self.session.close()
+
+
+def _boxes(data: bytes, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """Атомы внутри data[start:end]: (тип, начало содержимого, конец атома)."""
+    position = start
+    while position + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, position)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, position + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header or position + size > end:
+            raise Mp4ProbeError(f"Поврежденный атом {kind!r} по смещению {position}")
+        yield kind, position + header, position + size
+        position += size
+
+
+def _find(data: bytes, start: int, end: int, kind: bytes) -> Optional[Tuple[int, int]]:
+    for box_kind, box_start, box_end in _boxes(data, start, end):
+        if box_kind == kind:
+            return box_start, box_end
+    return None
+
+
+def _uint_array(data: bytes, offset: int, count: int, wide: bool = False) -> array:
+    """Массив целых big-endian из таблицы атома."""
+    values = array('Q' if wide else 'I')
+    values.frombytes(data[offset:offset + count * values.itemsize])
+    if len(values) != count:
+        raise Mp4ProbeError("Таблица атома обрезана")
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+def _signed(value: int) -> int:
+    """Знаковое 32-битное значение из беззнакового."""
+    return value - (1 << 32) if value >= 1 << 31 else value
+
+
+def _timing(data: bytes, start: int) -> Tuple[int, int]:
+    """Шкала и длительность из mvhd/mdhd: (единиц в секунде, длительность в единицах)."""
+    if data[start] == 1:
+        return struct.unpack_from('>IQ', data, start + 20)
+    return struct.unpack_from('>II', data, start + 12)
+
+
+def _track_size(data: bytes, start: int) -> Tuple[int, int]:
+    """Ширина и высота из tkhd (числа 16.16)."""
+    offset = start + (88 if data[start] == 1 else 76)
+    width, height = struct.unpack_from('>II', data, offset)
+    return width >> 16, height >> 16
+
+
+def _edit_shift(data: bytes, start: int, end: int, timescale: int, movie_timescale: int) -> Optional[int]:
+    """
+    Сдвиг времени показа кадров по списку монтажа edts/elst в единицах шкалы дорожки:
+    пустые правки в начале сдвигают дорожку вперед, media_time первой непустой правки -
+    назад (так браузер убирает начальное смещение ctts у видео с B-кадрами).
+    None, если списка монтажа нет.
+    """
+    edts = _find(data, start, end, b'edts')
+    elst = _find(data, *edts, b'elst') if edts else None
+    if elst is None:
+        return None
+    version = data[elst[0]]
+    entry_count = struct.unpack_from('>I', data, elst[0] + 4)[0]
+    entry_format, entry_size = ('>Qq', 20) if version == 1 else ('>Ii', 12)
+    shift = 0
+    for i in range(entry_count):
+        offset = elst[0] + 8 + i * entry_size
+        if offset + entry_size > elst[1]:
+            raise Mp4ProbeError("Таблица атома обрезана")
+        segment_duration, media_time = struct.unpack_from(entry_format, data, offset)
+        if media_time == -1:
+            # Пустая правка: длительность в шкале фильма
+            if movie_timescale:
+                shift += segment_duration * timescale // movie_timescale
+            continue
+        return shift - media_time
+    return shift
+
+
+def _parse_video_track(data: bytes, start: int, end: int, movie_timescale: int = 0) -> Optional[Dict[str, Any]]:
+    """Разбирает trak; None, если это не видеодорожка."""
+    mdia = _find(data, start, end, b'mdia')
+    if mdia is None:
+        return None
+    hdlr = _find(data, *mdia, b'hdlr')
+    if hdlr is None or data[hdlr[0] + 8:hdlr[0] + 12] != b'vide':
+        return None
+    mdhd = _find(data, *mdia, b'mdhd')
+    minf = _find(data, *mdia, b'minf')
+    stbl = _find(data, *minf, b'stbl') if minf else None
+    if mdhd is None or stbl is None:
+        raise Mp4ProbeError("В видеодорожке нет mdhd или stbl")
+
+    timescale, duration = _timing(data, mdhd[0])
+    width = height = 0
+    tkhd = _find(data, start, end, b'tkhd')
+    if tkhd is not None:
+        width, height = _track_size(data, tkhd[0])
+
+    tables = {kind: (box_start, box_end) for kind, box_start, box_end in _boxes(data, *stbl)}
+
+    if b'stts' not in tables:
+        raise Mp4ProbeError("В видеодорожке нет таблицы stts")
+
+    # Время декодирования: серии (количество кадров, длительность кадра)
+    stts_start = tables[b'stts'][0]
+    stts = _uint_array(data, stts_start + 8, 2 * struct.unpack_from('>I', data, stts_start + 4)[0])
+    frame_count = sum(stts[0::2])
+
+    # Ключевые кадры (номера с 1); без stss ключевой каждый кадр
+    if b'stss' in tables:
+        stss_start = tables[b'stss'][0]
+        keyframes = [number - 1 for number in
+                     _uint_array(data, stss_start + 8, struct.unpack_from('>I', data, stss_start + 4)[0])]
+    else:
+        keyframes = list(range(frame_count))
+
+    # Время показа ключевых кадров: время декодирования плюс смещение из ctts
+    decode_times = []
+    run_index = run_first = run_time = 0
+    for sample in keyframes:
+        while run_index < len(stts) and sample >= run_first + stts[run_index]:
+            run_first += stts[run_index]
+            run_time += stts[run_index] * stts[run_index + 1]
+            run_index += 2
+        delta = stts[run_index + 1] if run_index < len(stts) else 0
+        decode_times.append(run_time + (sample - run_first) * delta)
+    shift = _edit_shift(data, start, end, timescale, movie_timescale)
+    if b'ctts' in tables:
+        ctts_start = tables[b'ctts'][0]
+        signed = data[ctts_start] == 1
+        ctts = _uint_array(data, ctts_start + 8, 2 * struct.unpack_from('>I', data, ctts_start + 4)[0])
+        if shift is None and ctts:
+            # Без списка монтажа первый кадр показывается в момент 0
+            shift = -_signed(ctts[1]) if signed else -ctts[1]
+        run_index = run_first = 0
+        for i, sample in enumerate(keyframes):
+            while run_index < len(ctts) and sample >= run_first + ctts[run_index]:
+                run_first += ctts[run_index]
+                run_index += 2
+            if run_index < len(ctts):
+                offset = ctts[run_index + 1]
+                decode_times[i] += _signed(offset) if signed else offset
+    if shift:
+        decode_times = [max(time + shift, 0) for time in decode_times]
+
+    return {
+        'timescale': timescale,
+        'duration': duration / timescale if timescale else 0.0,
+        'frame_count': frame_count,
+        'width': width,
+        'height': height,
+        'keyframes': [round(time / timescale, 4) for time in decode_times] if timescale else [],
+        'keyframe_offsets': _sample_offsets(data, tables, keyframes)
+    }
+
+
+def _sample_offsets(data: bytes, tables: Dict[bytes, Tuple[int, int]], samples: List[int]) -> List[int]:
+    """Смещения кадров в файле по таблицам stsc, stco/co64 и stsz (номера кадров по возрастанию)."""
+    if b'stsc' not in tables or b'stsz' not in tables or not (b'stco' in tables or b'co64' in tables):
+        return []
+    stsc_start = tables[b'stsc'][0]
+    stsc = _uint_array(data, stsc_start + 8, 3 * struct.unpack_from('>I', data, stsc_start + 4)[0])
+    wide = b'co64' in tables
+    chunk_start = tables[b'co64' if wide else b'stco'][0]
+    chunk_offsets = _uint_array(data, chunk_start + 8, struct.unpack_from('>I', data, chunk_start + 4)[0], wide)
+    stsz_start = tables[b'stsz'][0]
+    sample_size, sample_count = struct.unpack_from('>II', data, stsz_start + 4)
+    sizes = _uint_array(data, stsz_start + 12, sample_count) if sample_size == 0 else None
+
+    offsets = []
+    # Серии stsc: (первый блок с 1, кадров в блоке); серия длится до первого блока следующей
+    run = 0
+    run_first_sample = 0
+    runs = len(stsc) // 3
+    for sample in samples:
+        while run + 1 < runs:
+            chunks = stsc[(run + 1) * 3] - stsc[run * 3]
+            run_samples = chunks * stsc[run * 3 + 1]
+            if sample < run_first_sample + run_samples:
+                break
+            run_first_sample += run_samples
+            run += 1
+        if run >= runs or not stsc[run * 3 + 1]:
+            break
+        per_chunk = stsc[run * 3 + 1]
+        chunk = stsc[run * 3] - 1 + (sample - run_first_sample) // per_chunk
+        if chunk >= len(chunk_offsets):
+            break
+        first_in_chunk = sample - (sample - run_first_sample) % per_chunk
+        if sizes is None:
+            offsets.append(chunk_offsets[chunk] + (sample - first_in_chunk) * sample_size)
+        else:
+            offsets.append(chunk_offsets[chunk] + sum(sizes[first_in_chunk:sample]))
+    return offsets
+
+
+def probe(reader) -> Dict[str, Any]:
+    """
+    Находит атом moov среди атомов верхнего уровня (читая только их заголовки) и разбирает его.
+
+    Args:
+        reader: FileReader или HttpRangeReader
+
+    Returns:
+        Метаданные первой видеодорожки: duration (с), timescale, frame_count, fps,
+        width, height, keyframes (время ключевых кадров, с), keyframe_offsets,
+        moov_offset, faststart (moov перед данными кадров)
+    """
+    position = 0
+    moov = None
+    seen_mdat = False
+    while position + 8 <= reader.size:
+        header = reader.read(position, 16)
+        size, kind = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = reader.size - position
+        if size < header_size:
+            raise Mp4ProbeError(f"Поврежденный атом {kind!r} по смещению {position}")
+        if position == 0 and kind != b'ftyp':
+            raise Mp4ProbeError(f"Файл не похож на MP4 (первый атом {kind!r})")
+        if kind == b'moov':
+            if size > MAX_MOOV_SIZE:
+                raise Mp4ProbeError(f"Слишком большой moov: {size} байт")
+            moov = (position, reader.read(position, size))
+            break
+        seen_mdat = seen_mdat or kind == b'mdat'
+        position += size
+    if moov is None:
+        raise Mp4ProbeError("В файле нет атома moov")
+
+    moov_offset, data = moov
+    start, end = 8, len(data)
+    if struct.unpack_from('>I', data)[0] == 1:
+        start = 16
+    mvhd = _find(data, start, end, b'mvhd')
+    movie_timescale, movie_duration = _timing(data, mvhd[0]) if mvhd else (0, 0)
+
+    for kind, box_start, box_end in _boxes(data, start, end):
+        if kind != b'trak':
+            continue
+        track = _parse_video_track(data, box_start, box_end, movie_timescale)
+        if track is None:
+            continue
+        if not track['duration'] and movie_timescale:
+            track['duration'] = movie_duration / movie_timescale
+        track['fps'] = round(track['frame_count'] / track['duration'], 3) if track['duration'] else 0.0
+        track['moov_offset'] = moov_offset
+        track['faststart'] = not seen_mdat
+        return track
+    raise Mp4ProbeError("В файле нет видеодорожки")
+
+
+class Mp4Prober:
+    """Чтение метаданных MP4 с кэшем в памяти и (опционально) в JSON файле."""
+
+    def __init__(self, cache_path: str = None):
+        """
+        Args:
+            cache_path: JSON файл кэша (None - только в памяти процесса)
+        """
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    self._cache = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Кэш метаданных видео не прочитан ({cache_path}): {e}")
+
+    def _cached(self, key: str, reader_factory, name: str) -> Dict[str, Any]:
+        with self._lock:
+            info = self._cache.get(key)
+        if info is not None:
+            return info
+
+        with METRICS.stage('probe_video', name) as record:
+            reader = reader_factory()
+            try:
+                info = probe(reader)
+            finally:
+                reader.close()
+            record.bytes = reader.bytes_read
+            record.items = reader.requests
+
+        with self._lock:
+            self._cache[key] = info
+            if self.cache_path:
+                temp_path = '{}.{}.tmp'.format(self.cache_path, os.getpid())
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self._cache, f, separators=(',', ':'))
+                os.replace(temp_path, self.cache_path)
+        return info
+
+    def probe_file(self, path: str) -> Dict[str, Any]:
+        """Метаданные локального файла (кэш по пути, размеру и времени изменения)."""
+        stat = os.stat(path)
+        key = 'v{}:file:{}:{}:{}'.format(CACHE_VERSION, os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+        return self._cached(key, lambda: FileReader(path), os.path.basename(path))
+
+    def probe_url(self, url: str, md5: str = None, session=None) -> Dict[str, Any]:
+        """
+        Метаданные удаленного файла запросами Range.
+
+        Args:
+            url: Прямая ссылка на файл
+            md5: Хэш содержимого для кэша (ссылки Яндекс.Диска временные, поэтому ключ - md5)
+            session: Сессия requests
+        """
+        key = 'v{}:{}'.format(CACHE_VERSION, 'md5:{}'.format(md5) if md5 else 'url:{}'.format(url))
+        return self._cached(key, lambda: HttpRangeReader(url, session), url.rsplit('/', 1)[-1][:40])
+
+    def probe(self, location: str) -> Dict[str, Any]:
+        """Метаданные локального файла или файла по ссылке."""
+        if location.startswith(('http://', 'https://')):
+            return self.probe_url(location)
+        return self.probe_file(location)
+
+
+# Общий экземпляр процесса; файл кэша задается переменной окружения
+PROBER = Mp4Prober(os.environ.get('MP4_PROBE_CACHE'))
+
+
+def probe_videos(locations: List[str], prober: Mp4Prober = None) -> List[Optional[Dict[str, Any]]]:
+    """
+    Метаданные списка видео; для файлов, которые не удалось разобрать, - None.
+
+    Args:
+        locations: Пути или ссылки на видео
+        prober: Экземпляр с кэшем (по умолчанию PROBER)
+    """
+    prober = prober or PROBER
+    result = []
+    for location in locations:
+        try:
+            result.append(prober.probe(location))
+        except Exception as e:
+            print(f"Метаданные видео не прочитаны ({location}): {e}")
+            result.append(None)
+    return result
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description='Метаданные MP4 (длительность, кадры, ключевые кадры) без загрузки видео')
+    parser.add_argument('videos', nargs='+', help='Пути к файлам или ссылки (читаются запросами Range)')
+    parser.add_argument('--cache', metavar='JSON', help='Файл кэша метаданных')
+    parser.add_argument('--keyframes', action='store_true', help='Вывести время ключевых кадров')
+
+    args = parser.parse_args(argv)
+
+    prober = Mp4Prober(args.cache)
+    status = 0
+    for location in args.videos:
+        try:
+            info = prober.probe(location)
+        except Exception as e:
+            print(f"{location}: ошибка: {e}")
+            status = 1
+            continue
+        print(f"{location}: {info['duration']:.3f} с, {info['frame_count']} кадров, {info['fps']} к/с, "
+              f"{info['width']}x{info['height']}, ключевых кадров: {len(info['keyframes'])}, "
+              f"moov {'в начале' if info['faststart'] else 'в конце'}")
+        if args.keyframes:
+            print('  ' + ' '.join(format(time, '.3f') for time in info['keyframes']))
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
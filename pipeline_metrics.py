@@ -0,0 +1,248 @@
+"""
+Модуль метрик этапов конвейера (получение списка, загрузка, парсинг, генерация, запись).
+Собирает длительность, байты и количество элементов по этапам, опционально
+профилирует этапы через cProfile/tracemalloc и отдает счетчики в формате Prometheus.
+"""
+
+import os
+import json
+import time
+import cProfile
+import threading
+import functools
+import itertools
+import tracemalloc
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class StageRecord:
+    """Запись об одном выполнении этапа; байты и количество элементов заполняет вызывающий код."""
+
+    def __init__(self, stage: str, file: str = ''):
+        self.stage = stage
+        self.file = file
+        self.duration = 0.0
+        self.bytes = 0
+        self.items = 0
+        self.memory_peak = None
+        self.profile_path = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = {'stage': self.stage, 'duration': self.duration, 'bytes': self.bytes, 'items': self.items}
+        if self.file:
+            record['file'] = self.file
+        if self.memory_peak is not None:
+            record['memory_peak'] = self.memory_peak
+        if self.profile_path:
+            record['profile'] = self.profile_path
+        return record
+
+
+class PipelineMetrics:
+    """Счетчики этапов конвейера (общие для процесса)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (этап, файл) -> суммарные счетчики
+        self._totals: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self._records: List[StageRecord] = []
+        self.cprofile_dir: Optional[str] = None
+        self.trace_memory = False
+        self.keep_records = False
+        self._profile_numbers = itertools.count()
+        # Глубина вложенности этапов в потоке: профилируется только внешний этап
+        self._local = threading.local()
+
+    def configure(self, keep_records: bool = None, cprofile_dir: str = None, trace_memory: bool = None):
+        """
+        Настраивает сбор метрик.
+
+        Args:
+            keep_records: Сохранять отдельные записи этапов (для выгрузки в JSON)
+            cprofile_dir: Папка для файлов cProfile по этапам (None - без профилирования)
+            trace_memory: Замерять пик выделенной памяти этапов через tracemalloc
+        """
+        if keep_records is not None:
+            self.keep_records = keep_records
+        if cprofile_dir is not None:
+            os.makedirs(cprofile_dir, exist_ok=True)
+            self.cprofile_dir = cprofile_dir
+        if trace_memory is not None:
+            self.trace_memory = trace_memory
+            if trace_memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    @contextmanager
+    def stage(self, stage: str, file: str = '') -> Iterator[StageRecord]:
+        """
+        Замеряет выполнение этапа.
+
+        cProfile и пик памяти tracemalloc замеряются только для внешнего этапа потока:
+        вложенный этап (например, trip_stats внутри generate_html) записывает только
+        длительность и счетчики, не сбрасывая профиль и пик памяти внешнего.
+
+        Args:
+            stage: Название этапа (listing, download, parse, generate_html, write)
+            file: Файл, к которому относится этап (опционально)
+
+        Yields:
+            Запись этапа для заполнения bytes и items
+        """
+        record = StageRecord(stage, file)
+        depth = getattr(self._local, 'depth', 0)
+        outermost = depth == 0
+        self._local.depth = depth + 1
+        profiler = None
+        if outermost and self.cprofile_dir:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Python 3.12+: профилировщик уже включен (этап другого потока)
+                profiler = None
+        if outermost and self.trace_memory:
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.duration = time.perf_counter() - start
+            self._local.depth = depth
+            if outermost and self.trace_memory:
+                record.memory_peak = tracemalloc.get_traced_memory()[1]
+            if profiler is not None:
+                profiler.disable()
+                name = '{}_{}_{}.prof'.format(stage, file or 'all', next(self._profile_numbers)).replace('/', '_')
+                record.profile_path = os.path.join(self.cprofile_dir, name)
+                profiler.dump_stats(record.profile_path)
+            self._add(record)
+
+    def _add(self, record: StageRecord):
+        with self._lock:
+            totals = self._totals.setdefault((record.stage, record.file),
+                                             {'calls': 0, 'duration': 0.0, 'bytes': 0, 'items': 0})
+            totals['calls'] += 1
+            totals['duration'] += record.duration
+            totals['bytes'] += record.bytes
+            totals['items'] += record.items
+            if self.keep_records:
+                self._records.append(record)
+
+    def timed(self, stage: str, file: str = '', measure: Callable[[tuple, Any], Tuple[int, int]] = None):
+        """
+        Декоратор для замера функции как этапа.
+
+        Args:
+            stage: Название этапа
+            file: Файл, к которому относится этап
+            measure: Функция (аргументы, результат) -> (байты, элементы)
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage, file) as record:
+                    result = func(*args, **kwargs)
+                    if measure is not None:
+                        record.bytes, record.items = measure(args, result)
+                    return result
+            return wrapper
+        return decorator
+
+    def export(self) -> Dict[str, Any]:
+        """Возвращает суммарные счетчики (и записи этапов, если они сохраняются)."""
+        with self._lock:
+            totals = [dict(stage=stage, file=file, **values) for (stage, file), values in self._totals.items()]
+            records = [record.to_dict() for record in self._records]
+        return {'stages': totals, 'records': records}
+
+    def merge(self, exported: Dict[str, Any]):
+        """Добавляет счетчики, собранные в другом процессе (например, в пуле генерации)."""
+        with self._lock:
+            for values in exported.get('stages', []):
+                totals = self._totals.setdefault((values['stage'], values['file']),
+                                                 {'calls': 0, 'duration': 0.0, 'bytes': 0, 'items': 0})
+                for key in totals:
+                    totals[key] += values[key]
+
+    def reset(self):
+        """Сбрасывает все счетчики и записи."""
+        with self._lock:
+            self._totals.clear()
+            self._records.clear()
+
+    def dump_json(self, path: str):
+        """Сохраняет счетчики и записи этапов в JSON файл."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.export(), f, indent=2, ensure_ascii=False)
+
+    def to_prometheus(self, extra: Dict[str, float] = None, prefix: str = 'trip') -> str:
+        """
+        Форматирует счетчики в текстовом формате Prometheus.
+
+        Args:
+            extra: Дополнительные счетчики (например, кэша) {имя: значение}
+            prefix: Префикс имен метрик
+
+        Returns:
+            Текст для эндпоинта /metrics
+        """
+        metrics = [
+            ('stage_calls_total', 'calls', 'Количество выполнений этапа'),
+            ('stage_duration_seconds_total', 'duration', 'Суммарная длительность этапа'),
+            ('stage_bytes_total', 'bytes', 'Обработано байт'),
+            ('stage_items_total', 'items', 'Обработано элементов')
+        ]
+        with self._lock:
+            totals = sorted(self._totals.items())
+
+        lines = []
+        for name, key, description in metrics:
+            lines.append(f'# HELP {prefix}_{name} {description}')
+            lines.append(f'# TYPE {prefix}_{name} counter')
+            for (stage, file), values in totals:
+                lines.append(f'{prefix}_{name}{{stage="{stage}",file="{file}"}} {values[key]}')
+
+        for name, value in (extra or {}).items():
+            lines.append(f'{prefix}_{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+# Общие метрики процесса
+METRICS = PipelineMetrics()
+
+
+def start_metrics_server(port: int, host: str = '127.0.0.1', extra: Callable[[], Dict[str, float]] = None) -> ThreadingHTTPServer:
+    """
+    Запускает в фоновом потоке HTTP сервер с эндпоинтом /metrics.
+
+    Args:
+        port: Порт
+        host: Адрес для прослушивания
+        extra: Функция, возвращающая дополнительные счетчики
+
+    Returns:
+        Запущенный сервер
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = METRICS.to_prometheus(extra() if extra else None).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Модуль объединения повторных обнаружений ям.
+
+Одна яма попадает в детекции на многих кадрах подряд и во многих поездках.
+Обнаружения кластеризуются по расстоянию и, внутри поездки, по времени:
+DBSCAN с min_samples=1 на сетке - точки раскладываются по ячейкам, и расстояние
+проверяется только с точками соседних ячеек, так что кластеризация занимает
+O(n log n) вместо попарного сравнения. Кластер заменяется обнаружением с
+максимальной уверенностью и количеством обнаружений (hits).
+"""
+
+import sys
+import json
+import math
+import argparse
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+from data_parser import DataParser
+from pipeline_metrics import METRICS
+from trip_source import open_trip_source
+from trip_stats import EARTH_RADIUS
+
+# Типы событий, которые объединяются (ручные события не дублируются)
+DEDUP_EVENT_TYPES = ('pothole',)
+
+
+class Run:
+    """Серия обнаружений одной ячейки сетки без разрывов по времени (один кластер)."""
+
+    __slots__ = ('members', 'times', 'min_lat', 'max_lat', 'min_lon', 'max_lon')
+
+    def __init__(self, members: List[int], events: List[Dict[str, Any]], lats: List[float], lons: List[float]):
+        self.members = members
+        self.times = [events[i]['time'] for i in members]
+        self.min_lat = min(lats[i] for i in members)
+        self.max_lat = max(lats[i] for i in members)
+        self.min_lon = min(lons[i] for i in members)
+        self.max_lon = max(lons[i] for i in members)
+
+    def point_distance_squared(self, lat: float, lon: float, cosine: float) -> float:
+        """Квадрат расстояния (в радианах) от точки до прямоугольника серии."""
+        dlat = max(self.min_lat - lat, 0.0, lat - self.max_lat)
+        dlon = max(self.min_lon - lon, 0.0, lon - self.max_lon) * cosine
+        return dlat * dlat + dlon * dlon
+
+    def box_distance_squared(self, other: 'Run', cosine: float) -> float:
+        """Квадрат расстояния (в радианах) между прямоугольниками двух серий."""
+        dlat = max(self.min_lat - other.max_lat, 0.0, other.min_lat - self.max_lat)
+        dlon = max(self.min_lon - other.max_lon, 0.0, other.min_lon - self.max_lon) * cosine
+        return dlat * dlat + dlon * dlon
+
+
+class PotholeDeduplicator:
+    """Объединение повторных обнаружений событий по расстоянию и времени."""
+
+    def __init__(self, radius: float = 3.0, max_time_gap: Optional[float] = 5.0,
+                 event_types: Iterable[str] = DEDUP_EVENT_TYPES):
+        """
+        Args:
+            radius: Расстояние (м), на котором обнаружения считаются одной ямой
+            max_time_gap: Максимальный интервал (с) между соседними обнаружениями кластера;
+                None - время не учитывается (между поездками время несопоставимо)
+            event_types: Типы событий (event_type), которые объединяются
+        """
+        self.radius = radius
+        self.max_time_gap = max_time_gap
+        self.event_types = set(event_types)
+
+    def cluster(self, events: List[Dict[str, Any]]) -> List[int]:
+        """
+        Кластеризует события.
+
+        Сторона ячейки сетки не больше radius / sqrt(2): любые две точки одной ячейки
+        ближе radius, поэтому внутри ячейки достаточно сравнить время соседних
+        по времени точек, а расстояние проверяется только с соседними ячейками. Серии точек, уже попавшие в один кластер, между собой не
+        сравниваются, так что плотные скопления обнаружений не дают квадратичной
+        сложности.
+
+        Args:
+            events: События (ключи lat, lon, time)
+
+        Returns:
+            Номер кластера для каждого события (номер - позиция одного из событий кластера)
+        """
+        count = len(events)
+        parent = list(range(count))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        def union(i: int, j: int):
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+        if count == 0:
+            return parent
+
+        # Координаты в радианах; на расстояниях в несколько метров гаверсинус совпадает
+        # с равнопромежуточной проекцией, поэтому пары сравниваются по квадрату расстояния
+        lats = [math.radians(event['lat']) for event in events]
+        lons = [math.radians(event['lon']) for event in events]
+        cosines = [math.cos(lat) for lat in lats]
+        radius = self.radius / EARTH_RADIUS
+        # Для отсечения пар по границам берется наименьший косинус - расстояние не завышается
+        min_cos = min(cosines)
+
+        # Шаг сетки; по долготе - на самой низкой широте, чтобы ячейка нигде не была шире заданного размера
+        lat_step = radius / math.sqrt(2)
+        max_cos = max(cosines)
+        lon_step = lat_step / max_cos
+        # На высоких широтах ячейки уже, и соседей по долготе нужно брать больше
+        lon_range = math.ceil(math.sqrt(2) * max_cos / max(min_cos, 1e-6))
+
+        # Ячейки заполняются в порядке времени, поэтому внутри ячейки время отсортировано
+        order = sorted(range(count), key=lambda i: events[i]['time'])
+        cells: Dict[Tuple[int, int], List[int]] = {}
+        for i in order:
+            cells.setdefault((math.floor(lats[i] / lat_step), math.floor(lons[i] / lon_step)), []).append(i)
+
+        gap = self.max_time_gap
+        # Соседние ячейки на расстоянии до radius, только в одну сторону (каждая пара проверяется один раз)
+        offsets = [(dy, dx) for dy in range(-2, 3) for dx in range(-lon_range, lon_range + 1) if (dy, dx) > (0, 0)]
+
+        # Внутри ячейки все точки ближе radius: соседние по времени точки без разрыва
+        # больше gap связываются, и ячейка делится на серии - каждая целиком один кластер
+        runs: Dict[Tuple[int, int], List[Run]] = {}
+        for key, members in cells.items():
+            start = 0
+            cell_runs = []
+            for k in range(1, len(members) + 1):
+                if k < len(members) and (gap is None or
+                                         events[members[k]]['time'] - events[members[k - 1]]['time'] <= gap):
+                    union(members[k - 1], members[k])
+                    continue
+                cell_runs.append(Run(members[start:k], events, lats, lons))
+                start = k
+            runs[key] = cell_runs
+        run_starts = {key: [run.times[0] for run in cell_runs] for key, cell_runs in runs.items()}
+        run_ends = {key: [run.times[-1] for run in cell_runs] for key, cell_runs in runs.items()}
+
+        radius_squared = radius * radius
+        for (cy, cx), cell_runs in runs.items():
+            for dy, dx in offsets:
+                other = (cy + dy, cx + dx)
+                other_runs = runs.get(other)
+                if other_runs is None:
+                    continue
+                for run in cell_runs:
+                    # Серии соседней ячейки, пересекающиеся по времени с серией (с запасом gap)
+                    if gap is None:
+                        candidates = other_runs
+                    else:
+                        candidates = other_runs[bisect_left(run_ends[other], run.times[0] - gap):
+                                                bisect_right(run_starts[other], run.times[-1] + gap)]
+                    for other_run in candidates:
+                        # Серии - целые кластеры: если они уже объединены, сравнивать точки незачем
+                        if find(run.members[0]) == find(other_run.members[0]):
+                            continue
+                        if run.box_distance_squared(other_run, min_cos) > radius_squared:
+                            continue
+                        pair = self._closest_pair(run, other_run, lats, lons, cosines, min_cos, radius_squared)
+                        if pair is not None:
+                            union(*pair)
+
+        return [find(i) for i in range(count)]
+
+    def _closest_pair(self, run: 'Run', other_run: 'Run', lats: List[float], lons: List[float],
+                      cosines: List[float], min_cos: float, radius_squared: float) -> Optional[Tuple[int, int]]:
+        """
+        Ищет пару точек двух серий ближе radius и не дальше gap по времени.
+        Сравниваются только точки, лежащие не дальше radius от прямоугольника другой серии.
+        """
+        gap = self.max_time_gap
+        near = [(i, time) for i, time in zip(run.members, run.times)
+                if other_run.point_distance_squared(lats[i], lons[i], min_cos) <= radius_squared]
+        if not near:
+            return None
+        other_near = [(j, time) for j, time in zip(other_run.members, other_run.times)
+                      if run.point_distance_squared(lats[j], lons[j], min_cos) <= radius_squared]
+        other_times = [time for _, time in other_near]
+
+        for i, time in near:
+            if gap is None:
+                window = other_near
+            else:
+                window = other_near[bisect_left(other_times, time - gap):bisect_right(other_times, time + gap)]
+            lat, lon, cosine = lats[i], lons[i], cosines[i]
+            for j, _ in window:
+                dlat = lat - lats[j]
+                dlon = (lon - lons[j]) * cosine
+                if dlat * dlat + dlon * dlon <= radius_squared:
+                    return i, j
+        return None
+
+    def deduplicate(self, events: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Заменяет кластеры повторных обнаружений одним событием.
+
+        Args:
+            events: События в формате DataParser
+
+        Returns:
+            События, где каждый кластер представлен обнаружением с максимальной
+            уверенностью и полем hits (количество обнаружений); события других типов
+            не меняются
+        """
+        with METRICS.stage('dedup') as record:
+            events = list(events)
+            candidates = [event for event in events if event['event_type'] in self.event_types]
+            result = [event for event in events if event['event_type'] not in self.event_types]
+
+            representatives: Dict[int, Dict[str, Any]] = {}
+            hits: Dict[int, int] = {}
+            for event, label in zip(candidates, self.cluster(candidates)):
+                hits[label] = hits.get(label, 0) + event.get('hits', 1)
+                best = representatives.get(label)
+                if best is None or (event.get('confidence') or 0) > (best.get('confidence') or 0):
+                    representatives[label] = event
+
+            for label, event in representatives.items():
+                result.append(dict(event, hits=hits[label]))
+            result.sort(key=lambda event: event['time'])
+            record.items = len(events)
+        return result
+
+    def deduplicate_trips(self, trips_events: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Объединяет обнаружения из многих поездок (время не учитывается).
+
+        Args:
+            trips_events: События каждой поездки
+
+        Returns:
+            Ямы с полями hits (обнаружений) и trips (в скольких поездках обнаружена),
+            по убыванию количества поездок
+        """
+        with METRICS.stage('dedup_trips') as record:
+            candidates = [
+                dict(event, trip=trip)
+                for trip, events in enumerate(trips_events)
+                for event in events if event['event_type'] in self.event_types
+            ]
+            clusters: Dict[int, List[Dict[str, Any]]] = {}
+            for event, label in zip(candidates, PotholeDeduplicator(self.radius, None, self.event_types)
+                                    .cluster(candidates)):
+                clusters.setdefault(label, []).append(event)
+
+            result = []
+            for members in clusters.values():
+                best = max(members, key=lambda event: event.get('confidence') or 0)
+                representative = dict(best, hits=sum(event.get('hits', 1) for event in members),
+                                      trips=len({event['trip'] for event in members}))
+                del representative['trip']
+                result.append(representative)
+            result.sort(key=lambda event: (-event['trips'], -event['hits']))
+            record.items = len(candidates)
+        return result
+
+
+def load_trip_events(location: str) -> List[Dict[str, Any]]:
+    """Читает события поездки (только detections.json)."""
+    with open_trip_source(location) as source:
+        if not source.exists('detections.json'):
+            return []
+        with source.open('detections.json') as f:
+            return DataParser.parse_detections_data(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Объединение повторных обнаружений ям в поездках и между поездками')
+    parser.add_argument('trips', nargs='+', help='Папки поездок, архивы или URL Яндекс.Диска')
+    parser.add_argument('-o', '--output', help='JSON файл со списком ям (по умолчанию вывод в консоль)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Количество процессов чтения поездок')
+    parser.add_argument('--radius', type=float, default=3.0, help='Расстояние объединения обнаружений, м')
+    parser.add_argument('--time-gap', type=float, default=5.0,
+                        help='Интервал объединения обнаружений внутри поездки, с')
+
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(args.jobs) as executor:
+        trips_events = list(executor.map(load_trip_events, args.trips))
+
+    deduplicator = PotholeDeduplicator(args.radius, args.time_gap)
+    # Сначала повторы на соседних кадрах внутри каждой поездки, затем одна яма в разных поездках
+    per_trip = [deduplicator.deduplicate(events) for events in trips_events]
+    potholes = deduplicator.deduplicate_trips(per_trip)
+
+    detections = sum(len(events) for events in trips_events)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(potholes, f, indent=2, ensure_ascii=False)
+        print(f"Поездок: {len(args.trips)}, событий: {detections}, ям после объединения: {len(potholes)}. "
+              f"Результат: {args.output}")
+    else:
+        json.dump(potholes, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
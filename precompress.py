@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Скрипт для создания предварительно сжатых копий (.gz, .br) HTML страниц
+для раздачи статическим сервером без сжатия на каждый запрос.
+"""
+
+import os
+import sys
+import gzip
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def precompress_file(path: str, gzip_level: int = 9, brotli_quality: int = 11) -> Dict[str, Any]:
+    """
+    Записывает рядом с файлом сжатые копии .gz и .br (если доступен brotli).
+
+    Args:
+        path: Путь к файлу
+        gzip_level: Уровень сжатия gzip (1-9)
+        brotli_quality: Качество сжатия brotli (0-11)
+
+    Returns:
+        Словарь с размерами исходного и сжатых файлов в байтах
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    sizes = {'path': path, 'original': len(data)}
+
+    # mtime=0 делает результат воспроизводимым для одинакового содержимого
+    compressed = gzip.compress(data, compresslevel=gzip_level, mtime=0)
+    with open(path + '.gz', 'wb') as f:
+        f.write(compressed)
+    sizes['gzip'] = len(compressed)
+
+    if brotli is not None:
+        compressed = brotli.compress(data, quality=brotli_quality)
+        with open(path + '.br', 'wb') as f:
+            f.write(compressed)
+        sizes['br'] = len(compressed)
+
+    return sizes
+
+
+def precompress_files(paths: List[str], gzip_level: int = 9, brotli_quality: int = 11,
+                      workers: int = None) -> List[Dict[str, Any]]:
+    """
+    Параллельно сжимает пакет файлов (zlib и brotli отпускают GIL, поэтому достаточно потоков).
+
+    Args:
+        paths: Пути к файлам
+        gzip_level: Уровень сжатия gzip (1-9)
+        brotli_quality: Качество сжатия brotli (0-11)
+        workers: Количество потоков (по умолчанию по числу процессоров)
+
+    Returns:
+        Размеры для каждого файла в порядке paths
+    """
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        return list(executor.map(lambda path: precompress_file(path, gzip_level, brotli_quality), paths))
+
+
+def print_sizes(sizes: Dict[str, Any]):
+    """Выводит размеры сжатых копий файла."""
+    parts = [f"{sizes['path']}: {sizes['original']} байт"]
+    for encoding in ['gzip', 'br']:
+        if encoding in sizes:
+            ratio = sizes[encoding] / sizes['original'] * 100 if sizes['original'] else 0
+            parts.append(f"{encoding} {sizes[encoding]} байт ({ratio:.1f}%)")
+    print(', '.join(parts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Создание сжатых копий (.gz, .br) HTML файлов')
+    parser.add_argument('files', nargs='+', help='HTML файлы')
+    parser.add_argument('--compress-level', type=int, default=9, help='Уровень сжатия gzip (1-9)')
+    parser.add_argument('--brotli-quality', type=int, default=11, help='Качество сжатия brotli (0-11)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Количество потоков')
+
+    args = parser.parse_args()
+
+    if brotli is None:
+        print("Модуль brotli не установлен, файлы .br не создаются")
+
+    for sizes in precompress_files(args.files, args.compress_level, args.brotli_quality, args.jobs):
+        print_sizes(sizes)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,52 @@
+import os
 import streamlit as st
-from generate_html import generate_html_from_yandex
+from trip_cache import TRIP_CACHE
+from pipeline_metrics import start_metrics_server
+
+
+@st.cache_resource
+def start_metrics_endpoint(port: int):
+    """Запускает эндпоинт /metrics один раз на процесс."""
+    return start_metrics_server(port, extra=lambda: {'cache_' + name: value for name, value in TRIP_CACHE.stats().items()})
+
+
+# Эндпоинт метрик в формате Prometheus включается переменной окружения TRIP_METRICS_PORT
+if os.environ.get('TRIP_METRICS_PORT'):
+    start_metrics_endpoint(int(os.environ['TRIP_METRICS_PORT']))
 
 st.set_page_config(page_title="Road Events Visualizer", layout="wide")
 
 st.title("🚗 Road Events Visualizer")
 
 url = st.text_input("URL папки на Яндекс.Диске :", placeholder="https://disk.yandex.ru/d/...")
+progressive = st.checkbox("Показывать карту по мере загрузки", value=True)
+
+# Подписи этапов прогрессивной загрузки
+STAGE_LABELS = {
+    'listing': "Получен список файлов, загружаем GPS трек...",
+    'gps': "Траектория готова, загружаем события...",
+    'events': "События готовы, загружаем видео и временные метки...",
+    'complete': "Поездка загружена"
+}
 
 if url:
     try:
-        html_content = generate_html_from_yandex(url)
+        # Одновременные запросы одной поездки из разных сессий объединяются в общем кэше
+        if not progressive:
+            html_content = TRIP_CACHE.get_page(url)
+        else:
+            viewer = st.empty()
+
+            def show_stage(stage, html_content):
+                status.update(label=STAGE_LABELS[stage])
+                if html_content is not None:
+                    with viewer.container():
+                        st.components.v1.html(html_content, height=800, scrolling=True)
+
+            with st.status("Загрузка поездки...", expanded=False) as status:
+                html_content = TRIP_CACHE.get_page_progressive(url, show_stage)
+                status.update(label=STAGE_LABELS['complete'], state="complete")
+            viewer.empty()
         st.components.v1.html(html_content, height=800, scrolling=True)
     except Exception as e:
-        st.error(f"Ошибка: {str(e)}")
\ No newline at end of file
+        st.error(f"Ошибка: {str(e)}")
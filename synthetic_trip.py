@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Скрипт для генерации синтетической поездки (gps.csv, detections.json, device.txt,
+times_full.json) заданной длительности для тестов и бенчмарков.
+"""
+
+import os
+import sys
+import json
+import math
+import random
+import argparse
+from typing import Dict, Any
+
+# Типы событий, добавляемых вручную
+MANUAL_EVENT_TYPES = ['erased_markings', 'garbage_on_road', 'damaged_sign']
+
+# Метры в одном градусе широты
+METERS_PER_DEGREE = 111320.0
+
+
+class SyntheticTripGenerator:
+    """Класс для генерации реалистичных данных синтетической поездки."""
+
+    def __init__(self, duration: float = 600, gps_rate: float = 1.0, fps: float = 30.0,
+                 events_per_minute: float = 2.0, manual_share: float = 0.1, seed: int = 0,
+                 start_lat: float = 55.7558, start_lon: float = 37.6173, start_time: float = 1729000000.0):
+        """
+        Args:
+            duration: Длительность поездки в секундах
+            gps_rate: Частота GPS точек в герцах
+            fps: Частота кадров видео
+            events_per_minute: Среднее количество событий в минуту
+            manual_share: Доля ручных событий среди всех событий
+            seed: Начальное значение генератора случайных чисел
+            start_lat: Широта начала поездки
+            start_lon: Долгота начала поездки
+            start_time: Время начала записи (unix timestamp)
+        """
+        self.duration = duration
+        self.gps_rate = gps_rate
+        self.fps = fps
+        self.events_per_minute = events_per_minute
+        self.manual_share = manual_share
+        self.start_lat = start_lat
+        self.start_lon = start_lon
+        self.start_time = start_time
+        self.random = random.Random(seed)
+        self._track = None
+
+    def _generate_track(self):
+        """Генерирует трек: скорость с остановками и плавно меняющийся курс."""
+        random_ = self.random
+        count = int(self.duration * self.gps_rate) + 1
+        step = 1.0 / self.gps_rate
+
+        lat, lon = self.start_lat, self.start_lon
+        course = random_.uniform(0, 360)
+        speed = 0.0
+        target_speed = random_.uniform(8, 16)
+        stop_left = 0.0
+
+        track = []
+        for i in range(count):
+            t = i * step
+
+            # Периодические остановки (светофоры, пробки)
+            if stop_left > 0:
+                stop_left -= step
+                target = 0.0
+            else:
+                if random_.random() < step / 120:
+                    stop_left = random_.uniform(10, 90)
+                if random_.random() < step / 60:
+                    target_speed = random_.uniform(5, 20)
+                target = target_speed
+
+            # Плавное изменение скорости (ускорение до 2 м/с^2)
+            speed += max(-2 * step, min(2 * step, target - speed))
+            speed = max(speed, 0.0)
+
+            if speed > 0.5:
+                course = (course + random_.gauss(0, 3) * step) % 360
+
+            track.append({
+                'time': self.start_time + t,
+                'lat': lat + random_.gauss(0, 0.000005),
+                'lon': lon + random_.gauss(0, 0.000005),
+                'accuracy': round(random_.uniform(3, 10), 1),
+                'altitude': round(150 + 5 * math.sin(t / 300), 1),
+                'speed': round(speed, 2),
+                'course': round(course, 1)
+            })
+
+            distance = speed * step
+            lat += distance * math.cos(math.radians(course)) / METERS_PER_DEGREE
+            lon += distance * math.sin(math.radians(course)) / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+
+        return track
+
+    @property
+    def track(self):
+        if self._track is None:
+            self._track = self._generate_track()
+        return self._track
+
+    def _position_at(self, time: float):
+        """Возвращает координаты трека в момент времени от начала поездки."""
+        index = min(int(time * self.gps_rate), len(self.track) - 1)
+        point = self.track[index]
+        return point['lat'], point['lon']
+
+    def generate_detections(self) -> Dict[str, Any]:
+        """Генерирует события: ручные события и ямы (время в секундах от начала)."""
+        random_ = self.random
+        count = int(self.duration / 60 * self.events_per_minute)
+
+        manual_events = []
+        potholes = []
+        for _ in range(count):
+            time = random_.uniform(0, self.duration)
+            lat, lon = self._position_at(time)
+            if random_.random() < self.manual_share:
+                event_type = random_.choice(MANUAL_EVENT_TYPES)
+                manual_events.append({
+                    'event': {'type': event_type, 'customName': event_type.replace('_', ' ')},
+                    'time': round(time, 3),
+                    'coordinate': {'latitude': lat, 'longitude': lon}
+                })
+            else:
+                potholes.append({
+                    'timestamp': round(time, 3),
+                    'coord': {'latitude': lat, 'longitude': lon},
+                    'conf': round(random_.uniform(0.3, 1.0), 3)
+                })
+
+        manual_events.sort(key=lambda event: event['time'])
+        potholes.sort(key=lambda pothole: pothole['timestamp'])
+        return {'manualEvents': manual_events, 'potholes': potholes}
+
+    def generate_frame_times(self):
+        """Генерирует временные метки кадров с дрожанием и пропущенными кадрами."""
+        random_ = self.random
+        frame_step = 1.0 / self.fps
+        frames = []
+        time = 0.0
+        while time <= self.duration:
+            jitter = random_.gauss(0, frame_step * 0.05)
+            frames.append({
+                'time': round(self.start_time + time + jitter, 6),
+                'system_time': round(self.start_time + time + jitter + 0.01, 6)
+            })
+            # Примерно 0.5% кадров пропускаются
+            time += frame_step * (2 if random_.random() < 0.005 else 1)
+        return frames
+
+    def generate_device_info(self) -> Dict[str, Any]:
+        """Генерирует информацию об устройстве."""
+        return {
+            'device': 'Synthetic Device',
+            'os': 'SyntheticOS 1.0',
+            'app_version': '1.0.0',
+            'video_resolution': '1920x1080',
+            'fps': self.fps,
+            'record_mode': 'synthetic'
+        }
+
+    def write(self, output_dir: str) -> Dict[str, int]:
+        """
+        Записывает файлы поездки в папку.
+
+        Args:
+            output_dir: Папка для файлов поездки
+
+        Returns:
+            Словарь {имя файла: размер в байтах}
+        """
+        os.makedirs(output_dir, exist_ok=True)
+
+        with open(os.path.join(output_dir, 'gps.csv'), 'w', encoding='utf-8') as f:
+            f.write('time,lat,lon,accuracy,altitude,speed,course\n')
+            for point in self.track:
+                f.write('{time:.3f},{lat:.7f},{lon:.7f},{accuracy},{altitude},{speed},{course}\n'.format(**point))
+
+        with open(os.path.join(output_dir, 'detections.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.generate_detections(), f, indent=2)
+
+        with open(os.path.join(output_dir, 'device.txt'), 'w', encoding='utf-8') as f:
+            json.dump(self.generate_device_info(), f, indent=2)
+
+        with open(os.path.join(output_dir, 'times_full.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.generate_frame_times(), f, indent=1)
+
+        return {
+            filename: os.path.getsize(os.path.join(output_dir, filename))
+            for filename in ['gps.csv', 'detections.json', 'device.txt', 'times_full.json']
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Генерация синтетической поездки')
+    parser.add_argument('output', help='Папка для файлов поездки')
+    parser.add_argument('--duration', type=float, default=600, help='Длительность в секундах')
+    parser.add_argument('--gps-rate', type=float, default=1.0, help='Частота GPS точек, Гц')
+    parser.add_argument('--fps', type=float, default=30.0, help='Частота кадров видео')
+    parser.add_argument('--events-per-minute', type=float, default=2.0, help='Среднее количество событий в минуту')
+    parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора случайных чисел')
+
+    args = parser.parse_args()
+
+    generator = SyntheticTripGenerator(args.duration, args.gps_rate, args.fps, args.events_per_minute, seed=args.seed)
+    sizes = generator.write(args.output)
+    for filename, size in sizes.items():
+        print(f"{filename}: {size} байт")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
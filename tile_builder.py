@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Модуль построения растровых тайлов трека и событий.
+
+Для больших поездок (и наборов поездок) Leaflet не справляется с полилинией из
+сотен тысяч точек и тысячами маркеров, поэтому трек и события заранее рисуются
+в PNG тайлы {z}/{x}/{y}.png, которые отдаются как статические файлы и
+подключаются на странице слоем тайлов. PNG с палитрой кодируется средствами
+стандартной библиотеки (zlib), тайлы разных частей карты рисуются в пуле процессов.
+"""
+
+import os
+import sys
+import json
+import math
+import zlib
+import struct
+import shutil
+import argparse
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Tuple, Iterable
+
+from data_parser import DataParser
+from pipeline_metrics import METRICS
+from trip_source import open_trip_source
+
+TILE_SIZE = 256
+
+# Уровни масштаба тайлов: выше MAX_ZOOM Leaflet увеличивает тайлы последнего уровня
+DEFAULT_MIN_ZOOM = 5
+DEFAULT_MAX_ZOOM = 17
+
+# Количество точек и событий, начиная с которого страница использует тайлы
+TILE_THRESHOLD = 50000
+
+# Цвета трека и событий (как на странице поездки)
+TRACK_COLOR = (0, 0, 255)
+EVENT_COLORS = {
+    'pothole': (0xe7, 0x4c, 0x3c),
+    'erased_markings': (0xf3, 0x9c, 0x12),
+    'garbage_on_road': (0x27, 0xae, 0x60),
+    'damaged_sign': (0x9b, 0x59, 0xb6),
+    'manual': (0x34, 0x98, 0xdb)
+}
+DEFAULT_EVENT_COLOR = (0x95, 0xa5, 0xa6)
+
+# Индекс цвета трека в палитре тайла (0 - прозрачный фон)
+TRACK_INDEX = 1
+
+# Тайлов в одной задаче пула (меньше - ровнее загрузка, больше - меньше накладных расходов)
+TILES_PER_TASK = 64
+
+# Данные процесса пула, передаются один раз при запуске процесса
+_worker: Dict[str, Any] = {}
+
+
+def world_xy(lat: float, lon: float) -> Tuple[float, float]:
+    """Координаты точки в проекции Web Mercator, нормированные на [0, 1)."""
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = (lon + 180.0) / 360.0
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0
+    return x, y
+
+
+def encode_png(pixels: bytearray, palette: List[Tuple[int, int, int, int]],
+               width: int = TILE_SIZE, height: int = TILE_SIZE) -> bytes:
+    """
+    Кодирует изображение с палитрой в PNG (байт на пиксель, прозрачность через tRNS).
+
+    Args:
+        pixels: Индексы цветов палитры построчно
+        palette: Цвета палитры (R, G, B, A)
+        width: Ширина
+        height: Высота
+
+    Returns:
+        Содержимое PNG файла
+    """
+    # Каждая строка начинается с байта фильтра (0 - без фильтра)
+    raw = b''.join(b'\x00' + pixels[row * width:(row + 1) * width] for row in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0))
+            + chunk(b'PLTE', b''.join(bytes(color[:3]) for color in palette))
+            + chunk(b'tRNS', bytes(color[3] for color in palette))
+            + chunk(b'IDAT', zlib.compress(raw, 6))
+            + chunk(b'IEND', b''))
+
+
+def _disc_spans(radius: int) -> List[Tuple[int, int]]:
+    """Строки круга заданного радиуса: (смещение строки, полуширина)."""
+    return [(dy, int(math.sqrt(radius * radius - dy * dy))) for dy in range(-radius, radius + 1)]
+
+
+def _init_worker(state: Dict[str, Any]):
+    _worker.update(state)
+
+
+def _render_tiles(zoom: int, tiles: List[Tuple[int, int, array, array]]) -> Tuple[int, int]:
+    """
+    Рисует и записывает тайлы одного уровня (выполняется в процессе пула).
+
+    Args:
+        zoom: Уровень масштаба
+        tiles: Список (x, y, пары индексов концов отрезков трека, индексы событий)
+
+    Returns:
+        (количество тайлов, байт записано)
+    """
+    xs, ys = _worker['xs'], _worker['ys']
+    event_xs, event_ys, event_colors = _worker['event_xs'], _worker['event_ys'], _worker['event_colors']
+    palette = _worker['palette']
+    half_width = _worker['track_width'] // 2
+    border_spans = _disc_spans(_worker['event_radius'])
+    fill_spans = _disc_spans(_worker['event_radius'] - 1)
+    # Заготовки строк каждого цвета: отрезок строки заполняется одним присваиванием среза
+    runs = [bytes([index]) * TILE_SIZE for index in range(len(palette))]
+    scale = TILE_SIZE * (1 << zoom)
+    written = 0
+
+    for tile_x, tile_y, segments, events in tiles:
+        pixels = bytearray(TILE_SIZE * TILE_SIZE)
+        origin_x, origin_y = tile_x * TILE_SIZE, tile_y * TILE_SIZE
+
+        def span(y: int, x0: int, x1: int, run: bytes):
+            if 0 <= y < TILE_SIZE:
+                x0, x1 = max(x0, 0), min(x1, TILE_SIZE - 1)
+                if x0 <= x1:
+                    pixels[y * TILE_SIZE + x0:y * TILE_SIZE + x1 + 1] = run[:x1 - x0 + 1]
+
+        track_run = runs[TRACK_INDEX]
+        for k in range(0, len(segments), 2):
+            i, j = segments[k], segments[k + 1]
+            x0, y0 = xs[i] * scale - origin_x, ys[i] * scale - origin_y
+            x1, y1 = xs[j] * scale - origin_x, ys[j] * scale - origin_y
+            if y0 > y1:
+                x0, y0, x1, y1 = x1, y1, x0, y0
+            dx, dy = x1 - x0, y1 - y0
+            # Одна горизонтальная полоса на строку: часть отрезка, попадающая в полосу
+            # толщины линии вокруг строки, расширенная на полуширину пера
+            for row in range(max(int(y0) - half_width, 0), min(int(y1) + half_width, TILE_SIZE - 1) + 1):
+                if dy > 0:
+                    xa = x0 + dx * (max(row - half_width, y0) - y0) / dy
+                    xb = x0 + dx * (min(row + half_width + 1, y1) - y0) / dy
+                else:
+                    xa, xb = x0, x1
+                if xa > xb:
+                    xa, xb = xb, xa
+                span(row, int(xa) - half_width, int(xb) + half_width, track_run)
+
+        for i in events:
+            px, py = int(event_xs[i] * scale - origin_x), int(event_ys[i] * scale - origin_y)
+            # Непрозрачная граница и полупрозрачная заливка, как у маркеров страницы
+            border_run, fill_run = runs[event_colors[i]], runs[event_colors[i] + 1]
+            for dy, half in border_spans:
+                span(py + dy, px - half, px + half, border_run)
+            for dy, half in fill_spans:
+                span(py + dy, px - half, px + half, fill_run)
+
+        path = os.path.join(_worker['output_dir'], str(zoom), str(tile_x), '{}.png'.format(tile_y))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        content = encode_png(pixels, palette)
+        with open(path, 'wb') as f:
+            f.write(content)
+        written += len(content)
+
+    return len(tiles), written
+
+
+def _replace_dir(source: str, target: str):
+    """Заменяет папку target папкой source; старая папка удаляется после переименования."""
+    old_dir = None
+    if os.path.exists(target):
+        old_dir = '{}.{}.old'.format(target, os.getpid())
+        shutil.rmtree(old_dir, ignore_errors=True)
+        os.rename(target, old_dir)
+    os.rename(source, target)
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+class TileBuilder:
+    """Построение PNG тайлов трека и событий для статической раздачи."""
+
+    def __init__(self, min_zoom: int = DEFAULT_MIN_ZOOM, max_zoom: int = DEFAULT_MAX_ZOOM, jobs: int = None,
+                 track_width: int = 3, event_radius: int = 6):
+        """
+        Args:
+            min_zoom: Минимальный уровень масштаба
+            max_zoom: Максимальный уровень масштаба
+            jobs: Количество процессов (по умолчанию - по числу ядер)
+            track_width: Толщина трека в пикселях
+            event_radius: Радиус маркера события в пикселях
+        """
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.jobs = jobs
+        self.track_width = track_width
+        self.event_radius = event_radius
+
+    def build(self, tracks: Iterable[List[Dict[str, Any]]], events: Iterable[Dict[str, Any]],
+              output_dir: str) -> Dict[str, Any]:
+        """
+        Рисует тайлы и записывает их в output_dir/{z}/{x}/{y}.png вместе с описанием tiles.json.
+        Создаются только тайлы, через которые проходит трек или на которых есть события.
+        Тайлы пишутся в новую папку, которая после построения заменяет output_dir целиком,
+        поэтому тайлы прошлого построения в папке не остаются.
+
+        Args:
+            tracks: GPS точки каждой поездки (треки разных поездок не соединяются)
+            events: События (ключи lat, lon, event_type)
+            output_dir: Папка для тайлов
+
+        Returns:
+            Описание тайлов: уровни масштаба, границы, количество и размер тайлов
+        """
+        with METRICS.stage('build_tiles') as record:
+            state = self._project(tracks, events)
+            if not state['xs'] and not state['event_xs']:
+                raise ValueError("Нет точек для построения тайлов")
+
+            output_dir = os.path.abspath(output_dir)
+            build_dir = state['output_dir'] = '{}.{}.tmp'.format(output_dir, os.getpid())
+            shutil.rmtree(build_dir, ignore_errors=True)
+            os.makedirs(build_dir)
+            try:
+                tile_count = 0
+                tile_bytes = 0
+                with ProcessPoolExecutor(self.jobs, initializer=_init_worker, initargs=(state,)) as executor:
+                    futures = []
+                    for zoom in range(self.min_zoom, self.max_zoom + 1):
+                        tiles = self._bucket(state, zoom)
+                        for start in range(0, len(tiles), TILES_PER_TASK):
+                            futures.append(executor.submit(_render_tiles, zoom, tiles[start:start + TILES_PER_TASK]))
+                    for future in futures:
+                        count, written = future.result()
+                        tile_count += count
+                        tile_bytes += written
+
+                manifest = {
+                    'url': '{z}/{x}/{y}.png',
+                    'min_zoom': self.min_zoom,
+                    'max_zoom': self.max_zoom,
+                    'bounds': state['bounds'],
+                    'tiles': tile_count,
+                    'bytes': tile_bytes
+                }
+                with open(os.path.join(build_dir, 'tiles.json'), 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f, indent=2)
+                _replace_dir(build_dir, output_dir)
+            except BaseException:
+                shutil.rmtree(build_dir, ignore_errors=True)
+                raise
+            record.items = tile_count
+            record.bytes = tile_bytes
+        print(f"Тайлы: {tile_count} шт., {tile_bytes / 1024 / 1024:.1f} МБ в {output_dir}")
+        return manifest
+
+    def _project(self, tracks: Iterable[List[Dict[str, Any]]], events: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """Переводит точки в нормированные координаты и собирает отрезки трека."""
+        xs, ys = array('d'), array('d')
+        # Индексы начальных точек отрезков (последняя точка трека отрезка не начинает)
+        segments = array('I')
+        # Последние точки треков: на них отрезок рисуется, даже если он короче пикселя
+        track_ends = set()
+        min_lat = min_lon = math.inf
+        max_lat = max_lon = -math.inf
+        for track in tracks:
+            first = len(xs)
+            for point in track:
+                x, y = world_xy(point['lat'], point['lon'])
+                xs.append(x)
+                ys.append(y)
+                min_lat, max_lat = min(min_lat, point['lat']), max(max_lat, point['lat'])
+                min_lon, max_lon = min(min_lon, point['lon']), max(max_lon, point['lon'])
+            segments.extend(range(first, len(xs) - 1))
+            if len(xs) > first + 1:
+                track_ends.add(len(xs) - 1)
+
+        event_xs, event_ys, event_colors = array('d'), array('d'), array('B')
+        # Палитра тайлов: прозрачный фон, трек и пары (граница, заливка) для цветов событий
+        palette = [(0, 0, 0, 0), TRACK_COLOR + (255,)]
+        palette_index = {}
+        for event in events:
+            x, y = world_xy(event['lat'], event['lon'])
+            event_xs.append(x)
+            event_ys.append(y)
+            color = EVENT_COLORS.get(event['event_type'], DEFAULT_EVENT_COLOR)
+            if color not in palette_index:
+                palette_index[color] = len(palette)
+                palette.extend([color + (255,), color + (0xb3,)])
+            event_colors.append(palette_index[color])
+            min_lat, max_lat = min(min_lat, event['lat']), max(max_lat, event['lat'])
+            min_lon, max_lon = min(min_lon, event['lon']), max(max_lon, event['lon'])
+
+        return {
+            'xs': xs, 'ys': ys, 'segments': segments, 'track_ends': track_ends,
+            'event_xs': event_xs, 'event_ys': event_ys, 'event_colors': event_colors, 'palette': palette,
+            'track_width': self.track_width, 'event_radius': self.event_radius,
+            'bounds': [[min_lat, min_lon], [max_lat, max_lon]]
+        }
+
+    def _bucket(self, state: Dict[str, Any], zoom: int) -> List[Tuple[int, int, array, array]]:
+        """Раскладывает отрезки и события по тайлам уровня (с запасом на толщину линии и радиус маркера)."""
+        scale = TILE_SIZE * (1 << zoom)
+        last_tile = (1 << zoom) - 1
+        tiles: Dict[Tuple[int, int], Tuple[array, array]] = {}
+
+        def add(min_x: float, min_y: float, max_x: float, max_y: float, kind: int, *indices: int):
+            for tile_x in range(max(int(min_x // TILE_SIZE), 0), min(int(max_x // TILE_SIZE), last_tile) + 1):
+                for tile_y in range(max(int(min_y // TILE_SIZE), 0), min(int(max_y // TILE_SIZE), last_tile) + 1):
+                    bucket = tiles.get((tile_x, tile_y))
+                    if bucket is None:
+                        bucket = tiles[tile_x, tile_y] = (array('I'), array('I'))
+                    bucket[kind].extend(indices)
+
+        xs, ys = state['xs'], state['ys']
+        margin = self.track_width
+        # Точки, не выходящие из пикселя предыдущей нарисованной точки, пропускаются:
+        # на мелких масштабах от сотен тысяч отрезков остаются сотни
+        start = previous = None
+        for i in state['segments']:
+            if i != previous:
+                # Начало трека очередной поездки
+                start = i
+                x0, y0 = xs[i] * scale, ys[i] * scale
+            previous = i + 1
+            x1, y1 = xs[i + 1] * scale, ys[i + 1] * scale
+            if int(x1) == int(x0) and int(y1) == int(y0) and i + 1 not in state['track_ends']:
+                continue
+            add(min(x0, x1) - margin, min(y0, y1) - margin, max(x0, x1) + margin, max(y0, y1) + margin,
+                0, start, i + 1)
+            start, x0, y0 = i + 1, x1, y1
+
+        margin = self.event_radius + 1
+        for i, (x, y) in enumerate(zip(state['event_xs'], state['event_ys'])):
+            add(x * scale - margin, y * scale - margin, x * scale + margin, y * scale + margin, 1, i)
+
+        return [(tile_x, tile_y, segments, events) for (tile_x, tile_y), (segments, events) in tiles.items()]
+
+
+def needs_tiles(gps_points: int, events: int, threshold: int = TILE_THRESHOLD) -> bool:
+    """Проверяет, достаточно ли велика поездка, чтобы показывать ее тайлами."""
+    return threshold is not None and gps_points + events > threshold
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Построение PNG тайлов трека и событий одной или многих поездок')
+    parser.add_argument('trips', nargs='+', help='Папки поездок, архивы или URL Яндекс.Диска')
+    parser.add_argument('-o', '--output', default='tiles', help='Папка для тайлов ({z}/{x}/{y}.png)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Количество процессов')
+    parser.add_argument('--min-zoom', type=int, default=DEFAULT_MIN_ZOOM, help='Минимальный уровень масштаба')
+    parser.add_argument('--max-zoom', type=int, default=DEFAULT_MAX_ZOOM, help='Максимальный уровень масштаба')
+    parser.add_argument('--no-events', action='store_true', help='Рисовать только треки')
+
+    args = parser.parse_args()
+
+    tracks = []
+    events = []
+    for location in args.trips:
+        with open_trip_source(location) as source:
+            with source.open('gps.csv') as f:
+                tracks.append(DataParser.parse_gps_data(f))
+            if not args.no_events and source.exists('detections.json'):
+                with source.open('detections.json') as f:
+                    events.extend(DataParser.parse_detections_data(f))
+
+    TileBuilder(args.min_zoom, args.max_zoom, args.jobs).build(tracks, events, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Модуль кэширующего прокси тайлов подложки карты.
+
+Страницы поездок по умолчанию загружают тайлы OpenStreetMap напрямую, и каждый
+просмотр заново тянет одни и те же тайлы через медленный канал. Прокси отдает
+тайлы /{z}/{x}/{y}.png из дискового кэша с вытеснением давно не запрашиваемых
+тайлов по лимиту размера, а при промахе загружает тайл с настраиваемого источника
+(OpenStreetMap или локальной замены). Тайлы вокруг поездок можно загрузить заранее.
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import threading
+import urllib.parse as ul
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Optional, Tuple
+
+import requests
+
+from data_parser import DataParser
+from trip_cache import SingleFlight
+from trip_index import tile_xy
+from trip_source import open_trip_source
+
+DEFAULT_UPSTREAM = 'https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png'
+DEFAULT_SUBDOMAINS = 'abc'
+
+# Правила OpenStreetMap требуют представляться в User-Agent
+USER_AGENT = 'road-events-visualizer-tile-proxy/1.0'
+
+# Тайлы не меняются часто: браузер может не перезапрашивать их сутки
+BROWSER_MAX_AGE = 86400
+
+# Ограничение количества тайлов предзагрузки, чтобы не нагружать публичный сервер тайлов
+DEFAULT_PREWARM_LIMIT = 20000
+
+
+class TileNotFound(Exception):
+    """Источник ответил, что тайла нет (404)."""
+
+
+class DiskTileCache:
+    """
+    Дисковый кэш тайлов {z}/{x}/{y}.png с вытеснением самых давно запрошенных
+    тайлов при превышении лимита размера. Порядок использования хранится в памяти
+    и при запуске восстанавливается по времени изменения файлов (при попадании
+    время изменения файла обновляется).
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        Args:
+            cache_dir: Папка кэша
+            max_bytes: Лимит суммарного размера тайлов в байтах
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # Ключ (z, x, y) -> размер файла, от давно запрошенных к недавним
+        self._items: 'OrderedDict[Tuple[int, int, int], int]' = OrderedDict()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """Находит тайлы, оставшиеся от прошлых запусков."""
+        found = []
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            relative = os.path.relpath(dirpath, self.cache_dir).split(os.sep)
+            if len(relative) != 2:
+                continue
+            for filename in filenames:
+                if not filename.endswith('.png'):
+                    continue
+                try:
+                    key = (int(relative[0]), int(relative[1]), int(filename[:-4]))
+                    stat = os.stat(os.path.join(dirpath, filename))
+                except (ValueError, OSError):
+                    continue
+                found.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(found):
+            self._items[key] = size
+            self.current_bytes += size
+        with self._lock:
+            self._evict()
+
+    def path(self, key: Tuple[int, int, int]) -> str:
+        z, x, y = key
+        return os.path.join(self.cache_dir, str(z), str(x), '{}.png'.format(y))
+
+    def get(self, key: Tuple[int, int, int]) -> Optional[bytes]:
+        """Возвращает тайл из кэша или None."""
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # Файл удален снаружи или вытеснен параллельной записью между проверкой и чтением
+            with self._lock:
+                self._remove(key)
+            return None
+        return content
+
+    def put(self, key: Tuple[int, int, int], content: bytes):
+        """Сохраняет тайл, вытесняя самые давно запрошенные при превышении лимита."""
+        if len(content) > self.max_bytes:
+            return
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Запись через временный файл: читатели не увидят недописанный тайл
+        temp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+        with self._lock:
+            if key in self._items:
+                self.current_bytes -= self._items.pop(key)
+            self._items[key] = len(content)
+            self.current_bytes += len(content)
+            self._evict()
+
+    def __contains__(self, key: Tuple[int, int, int]) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _evict(self):
+        """Вытесняет тайлы сверх лимита (вызывается под блокировкой)."""
+        while self.current_bytes > self.max_bytes:
+            oldest = next(iter(self._items))
+            self._remove(oldest)
+            try:
+                os.remove(self.path(oldest))
+            except FileNotFoundError:
+                pass
+            self.evictions += 1
+
+    def _remove(self, key: Tuple[int, int, int]):
+        """Удаляет запись, если она еще есть (вызывается под блокировкой)."""
+        size = self._items.pop(key, None)
+        if size is not None:
+            self.current_bytes -= size
+
+
+class TileProxy:
+    """Получение тайлов: из дискового кэша, при промахе - с источника с сохранением в кэш."""
+
+    def __init__(self, cache: DiskTileCache, upstream: str = DEFAULT_UPSTREAM,
+                 subdomains: str = DEFAULT_SUBDOMAINS, timeout: float = 10.0):
+        """
+        Args:
+            cache: Дисковый кэш
+            upstream: Шаблон адреса источника с {z}, {x}, {y} и необязательным {s}
+            subdomains: Поддомены для {s}
+            timeout: Таймаут запроса к источнику, с
+        """
+        self.cache = cache
+        self.upstream = upstream
+        self.subdomains = subdomains
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        self._flight = SingleFlight()
+        self._stats_lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'not_found': 0,
+                         'errors': 0, 'upstream_bytes': 0}
+
+    def count(self, name: str, value: int = 1):
+        with self._stats_lock:
+            self.counters[name] += value
+
+    def get(self, z: int, x: int, y: int) -> bytes:
+        """
+        Возвращает PNG тайла.
+
+        Raises:
+            TileNotFound: Источник ответил 404
+            requests.RequestException: Ошибка запроса к источнику
+        """
+        key = (z, x, y)
+        content = self.cache.get(key)
+        if content is not None:
+            self.count('hits')
+            return content
+
+        self.count('misses')
+        # Одновременные запросы одного тайла загружают его с источника один раз
+        content, shared = self._flight.do(key, lambda: self._fetch(key))
+        if shared:
+            self.count('coalesced')
+        return content
+
+    def _fetch(self, key: Tuple[int, int, int]) -> bytes:
+        z, x, y = key
+        url = self.upstream.format(s=random.choice(self.subdomains or 'a'), z=z, x=x, y=y)
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException:
+            self.count('errors')
+            raise
+        if response.status_code == 404:
+            self.count('not_found')
+            raise TileNotFound(url)
+        if response.status_code != 200:
+            self.count('errors')
+            raise requests.HTTPError(f"Источник тайлов ответил {response.status_code}: {url}")
+        content = response.content
+        self.count('upstream_bytes', len(content))
+        self.cache.put(key, content)
+        return content
+
+    def prewarm(self, bounds: List[List[float]], min_zoom: int, max_zoom: int, jobs: int = 4,
+                limit: int = DEFAULT_PREWARM_LIMIT) -> Dict[str, int]:
+        """
+        Загружает в кэш тайлы прямоугольника на уровнях min_zoom..max_zoom.
+
+        Args:
+            bounds: Границы [[мин. широта, мин. долгота], [макс. широта, макс. долгота]]
+            min_zoom: Минимальный уровень масштаба
+            max_zoom: Максимальный уровень масштаба
+            jobs: Количество одновременных запросов
+            limit: Максимальное количество тайлов
+
+        Returns:
+            Количество тайлов: всего, уже в кэше, загружено, отсутствующих у источника, ошибок
+        """
+        (min_lat, min_lon), (max_lat, max_lon) = bounds
+        keys = []
+        for zoom in range(min_zoom, max_zoom + 1):
+            # Ось y тайлов направлена на юг
+            x0, y0 = tile_xy(max_lat, min_lon, zoom)
+            x1, y1 = tile_xy(min_lat, max_lon, zoom)
+            keys.extend((zoom, x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+        if len(keys) > limit:
+            raise ValueError(f"Слишком много тайлов для предзагрузки: {len(keys)} (лимит {limit}), "
+                             f"уменьшите максимальный масштаб")
+
+        result = {'tiles': len(keys), 'cached': 0, 'fetched': 0, 'not_found': 0, 'failed': 0}
+        missing = [key for key in keys if key not in self.cache]
+        result['cached'] = len(keys) - len(missing)
+
+        def fetch(key: Tuple[int, int, int]) -> str:
+            try:
+                self.get(*key)
+                return 'fetched'
+            except TileNotFound:
+                return 'not_found'
+            except requests.RequestException:
+                return 'failed'
+
+        with ThreadPoolExecutor(jobs) as executor:
+            for outcome in executor.map(fetch, missing):
+                result[outcome] += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики запросов, доля попаданий в кэш и размер кэша."""
+        with self._stats_lock:
+            stats = dict(self.counters)
+        requests_total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / requests_total, 4) if requests_total else 0.0
+        stats['cached_tiles'] = len(self.cache)
+        stats['cached_bytes'] = self.cache.current_bytes
+        stats['max_bytes'] = self.cache.max_bytes
+        stats['evictions'] = self.cache.evictions
+        return stats
+
+
+def trip_bounds(locations: List[str], margin: float = 0.01) -> List[List[float]]:
+    """
+    Границы треков поездок с запасом.
+
+    Args:
+        locations: Папки поездок, архивы или URL Яндекс.Диска
+        margin: Запас в градусах с каждой стороны
+
+    Returns:
+        [[мин. широта, мин. долгота], [макс. широта, макс. долгота]]
+    """
+    lats, lons = [], []
+    for location in locations:
+        with open_trip_source(location) as source:
+            with source.open('gps.csv') as f:
+                points = DataParser.parse_gps_data(f)
+        lats.extend(point['lat'] for point in points)
+        lons.extend(point['lon'] for point in points)
+    if not lats:
+        raise ValueError("Нет GPS точек для определения границ")
+    return [[min(lats) - margin, min(lons) - margin], [max(lats) + margin, max(lons) + margin]]
+
+
+class TileProxyServer(ThreadingHTTPServer):
+    """HTTP сервер кэширующего прокси тайлов."""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], proxy: TileProxy, quiet: bool = False):
+        super().__init__(address, TileProxyRequestHandler)
+        self.proxy = proxy
+        self.quiet = quiet
+
+
+class TileProxyRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов TileProxyServer: /{z}/{x}/{y}.png и /stats."""
+
+    server: TileProxyServer
+
+    def do_GET(self):
+        path = ul.urlsplit(self.path).path
+        if path == '/stats':
+            body = json.dumps(self.server.proxy.stats(), indent=2).encode('utf-8')
+            self.send_bytes(200, body, 'application/json')
+            return
+
+        parts = path.strip('/').split('/')
+        if len(parts) != 3 or not parts[2].endswith('.png'):
+            self.send_error(404)
+            return
+        try:
+            z, x, y = int(parts[0]), int(parts[1]), int(parts[2][:-4])
+        except ValueError:
+            self.send_error(404)
+            return
+        if not (0 <= z <= 22 and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+            self.send_error(404)
+            return
+
+        try:
+            content = self.server.proxy.get(z, x, y)
+        except TileNotFound:
+            self.send_error(404)
+            return
+        except requests.RequestException as e:
+            self.send_error(502, explain=str(e))
+            return
+        self.send_bytes(200, content, 'image/png', {'Cache-Control': f'public, max-age={BROWSER_MAX_AGE}'})
+
+    def send_bytes(self, status: int, body: bytes, content_type: str, headers: Dict[str, str] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        # Страницы поездок открываются с других адресов (file:// или сервер страниц)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description='Кэширующий прокси тайлов подложки карты')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_cache_arguments(subparser: argparse.ArgumentParser):
+        subparser.add_argument('cache_dir', help='Папка дискового кэша тайлов')
+        subparser.add_argument('--upstream', default=DEFAULT_UPSTREAM,
+                               help='Шаблон адреса источника тайлов ({s}, {z}, {x}, {y})')
+        subparser.add_argument('--subdomains', default=DEFAULT_SUBDOMAINS, help='Поддомены источника для {s}')
+        subparser.add_argument('--max-mb', type=int, default=1024, help='Лимит размера кэша, МБ')
+
+    serve_parser = subparsers.add_parser('serve', help='Запустить прокси')
+    add_cache_arguments(serve_parser)
+    serve_parser.add_argument('--host', default='127.0.0.1', help='Адрес для прослушивания')
+    serve_parser.add_argument('--port', type=int, default=8003, help='Порт')
+    serve_parser.add_argument('--quiet', action='store_true', help='Не выводить журнал запросов')
+
+    prewarm_parser = subparsers.add_parser('prewarm', help='Загрузить в кэш тайлы вокруг поездок')
+    add_cache_arguments(prewarm_parser)
+    prewarm_parser.add_argument('trips', nargs='+', help='Папки поездок, архивы или URL Яндекс.Диска')
+    prewarm_parser.add_argument('--min-zoom', type=int, default=10, help='Минимальный уровень масштаба')
+    prewarm_parser.add_argument('--max-zoom', type=int, default=16, help='Максимальный уровень масштаба')
+    prewarm_parser.add_argument('-j', '--jobs', type=int, default=4, help='Количество одновременных запросов')
+    prewarm_parser.add_argument('--limit', type=int, default=DEFAULT_PREWARM_LIMIT, help='Максимум тайлов')
+
+    args = parser.parse_args(argv)
+
+    cache = DiskTileCache(args.cache_dir, args.max_mb * 1024 * 1024)
+    proxy = TileProxy(cache, args.upstream, args.subdomains)
+    print(f"Кэш тайлов: {len(cache)} шт., {cache.current_bytes / 1024 / 1024:.1f} МБ в {args.cache_dir}")
+
+    if args.command == 'prewarm':
+        try:
+            bounds = trip_bounds(args.trips)
+            result = proxy.prewarm(bounds, args.min_zoom, args.max_zoom, args.jobs, args.limit)
+        except Exception as e:
+            print(f"Ошибка: {e}")
+            return 1
+        print(f"Тайлов: {result['tiles']}, уже в кэше: {result['cached']}, "
+              f"загружено: {result['fetched']}, нет у источника: {result['not_found']}, ошибок: {result['failed']}")
+        return 0 if not result['failed'] else 1
+
+    server = TileProxyServer((args.host, args.port), proxy, args.quiet)
+    print(f"Прокси тайлов: http://{args.host}:{args.port}/{{z}}/{{x}}/{{y}}.png (статистика: /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nСервер остановлен")
+    finally:
+        server.server_close()
+        print(json.dumps(proxy.stats(), ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
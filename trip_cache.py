@@ -0,0 +1,314 @@
+"""
+Модуль процессного кэша поездок.
+Объединяет одновременные запросы одной поездки (single-flight) и хранит
+разобранные поездки и готовые страницы в LRU с ограничением по памяти.
+"""
+
+import sys
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from generate_html import load_trip_from_yandex, iter_trip_from_yandex, render_trip
+from yandex_downloader import YandexDownloader
+from html_generator import HTMLGenerator
+from event_store import EventStore
+
+
+class SingleFlight:
+    """Выполняет не более одного вычисления на ключ; остальные вызовы ждут его результат."""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Any, 'SingleFlight._Call'] = {}
+
+    def do(self, key: Any, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Выполняет fn для ключа или присоединяется к уже идущему вычислению.
+
+        Args:
+            key: Ключ вычисления
+            fn: Функция без аргументов
+
+        Returns:
+            Кортеж (результат, был ли результат получен от чужого вычисления)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                shared = True
+            else:
+                call = self._calls[key] = self._Call()
+                shared = False
+
+        if shared:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result, shared
+
+
+class MemoryLRU:
+    """LRU словарь с ограничением по суммарному размеру значений в байтах."""
+
+    def __init__(self, max_bytes: int, ttl: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.current_bytes = 0
+        self.evictions = 0
+        self._items: 'OrderedDict[Any, Tuple[Any, int, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Optional[Any]:
+        """Возвращает значение по ключу или None, если его нет или оно устарело."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, size, stored_at = item
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                self._remove(key)
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Any, value: Any, size: int):
+        """Сохраняет значение, вытесняя самые старые записи при превышении лимита."""
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._items[key] = (value, size, time.monotonic())
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                oldest = next(iter(self._items))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: Any):
+        """Удаляет запись (вызывается под блокировкой)."""
+        _, size, _ = self._items.pop(key)
+        self.current_bytes -= size
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+def estimate_trip_size(trip: Dict[str, Any]) -> int:
+    """
+    Приблизительно оценивает объем памяти разобранной поездки.
+
+    Args:
+        trip: Данные поездки из load_trip_from_yandex
+
+    Returns:
+        Оценка размера в байтах
+    """
+    size = 0
+
+    # Точка GPS: словарь + 7 float значений
+    gps_data = trip.get('gps_data') or []
+    if gps_data:
+        size += len(gps_data) * (sys.getsizeof(gps_data[0]) + 7 * sys.getsizeof(0.0))
+
+    events = trip.get('events')
+    if isinstance(events, EventStore):
+        columns = [events.times, events.lats, events.lons, events.confidences,
+                   events.type_codes, events.event_type_codes, events.name_codes, events.hits]
+        size += sum(column.buffer_info()[1] * column.itemsize for column in columns)
+        size += sum(sys.getsizeof(string) for string in events.strings)
+    elif events:
+        size += len(events) * (sys.getsizeof(events[0]) + 6 * sys.getsizeof(0.0))
+
+    times_data = trip.get('times_data')
+    if times_data:
+        frame_times = times_data.get('frame_times', [])
+        if frame_times:
+            size += len(frame_times) * (sys.getsizeof(frame_times[0]) + 2 * sys.getsizeof(0.0))
+
+    # Метаданные видео: списки времени и смещений ключевых кадров
+    for info in trip.get('video_info') or []:
+        if info:
+            size += (len(info['keyframes']) + len(info['keyframe_offsets'])) * (8 + sys.getsizeof(0.0))
+
+    return size
+
+
+class TripCache:
+    """Процессный кэш поездок с Яндекс.Диска для всех сессий приложения."""
+
+    def __init__(self, max_trip_bytes: int = 512 * 1024 * 1024, max_page_bytes: int = 256 * 1024 * 1024,
+                 ttl: Optional[float] = 3600):
+        """
+        Args:
+            max_trip_bytes: Лимит памяти для разобранных поездок
+            max_page_bytes: Лимит памяти для готовых HTML страниц
+            ttl: Время жизни записей в секундах (ссылки Яндекс.Диска на видео временные)
+        """
+        self.trips = MemoryLRU(max_trip_bytes, ttl)
+        self.pages = MemoryLRU(max_page_bytes, ttl)
+        self.yandex_downloader = YandexDownloader()
+        self.html_generator = HTMLGenerator()
+        self._flight = SingleFlight()
+        self._metrics_lock = threading.Lock()
+        self._counters = {
+            'page_hits': 0,
+            'page_misses': 0,
+            'trip_hits': 0,
+            'trip_misses': 0,
+            'coalesced': 0
+        }
+
+    def _count(self, name: str):
+        with self._metrics_lock:
+            self._counters[name] += 1
+
+    def get_trip(self, url: str) -> Dict[str, Any]:
+        """
+        Возвращает разобранную поездку, загружая ее не более одного раза одновременно.
+
+        Args:
+            url: URL папки на Яндекс.Диске
+
+        Returns:
+            Данные поездки
+        """
+        trip = self.trips.get(url)
+        if trip is not None:
+            self._count('trip_hits')
+            return trip
+
+        self._count('trip_misses')
+
+        def load():
+            trip = load_trip_from_yandex(url, self.yandex_downloader)
+            self.trips.put(url, trip, estimate_trip_size(trip))
+            return trip
+
+        trip, shared = self._flight.do(('trip', url), load)
+        if shared:
+            self._count('coalesced')
+        return trip
+
+    def get_page(self, url: str) -> str:
+        """
+        Возвращает HTML страницу поездки, генерируя ее не более одного раза одновременно.
+
+        Args:
+            url: URL папки на Яндекс.Диске
+
+        Returns:
+            HTML содержимое как строка
+        """
+        html_content = self.pages.get(url)
+        if html_content is not None:
+            self._count('page_hits')
+            return html_content
+
+        self._count('page_misses')
+
+        def render():
+            html_content = render_trip(self.get_trip(url), self.html_generator)
+            self.pages.put(url, html_content, len(html_content))
+            return html_content
+
+        html_content, shared = self._flight.do(('page', url), render)
+        if shared:
+            self._count('coalesced')
+        return html_content
+
+    def get_page_progressive(self, url: str, on_stage: Callable[[str, Optional[str]], None]) -> str:
+        """
+        Возвращает HTML страницу поездки, при загрузке показывая промежуточные страницы по этапам.
+
+        Загрузка идет под тем же ключом single-flight, что и в get_trip: одновременные
+        запросы поездки ждут ее и получают результат из кэша, а поездка, оставшаяся
+        в кэше после вытеснения страницы, повторно не загружается.
+
+        Args:
+            url: URL папки на Яндекс.Диске
+            on_stage: Вызывается для каждого этапа загрузки с названием этапа и страницей
+                (None для этапа 'listing'); вызывается только в запросе, который загружает поездку
+
+        Returns:
+            HTML содержимое как строка
+        """
+        if self.pages.get(url) is not None or self.trips.get(url) is not None:
+            return self.get_page(url)
+
+        self._count('trip_misses')
+
+        def load():
+            for stage, trip in iter_trip_from_yandex(url, self.yandex_downloader):
+                html_content = None
+                if stage != 'listing':
+                    # Перерисовываем страницу, как только появились новые данные
+                    html_content = render_trip(trip, self.html_generator)
+                on_stage(stage, html_content)
+            self.put_trip(url, trip, html_content)
+            return trip
+
+        trip, shared = self._flight.do(('trip', url), load)
+        if shared:
+            self._count('coalesced')
+        html_content = self.pages.get(url)
+        if html_content is None:
+            # Страница не поместилась в кэш: строим ее по уже загруженной поездке
+            html_content = render_trip(trip, self.html_generator)
+        return html_content
+
+    def peek_page(self, url: str) -> Optional[str]:
+        """Возвращает готовую страницу из кэша, не запуская загрузку."""
+        html_content = self.pages.get(url)
+        if html_content is not None:
+            self._count('page_hits')
+        return html_content
+
+    def put_trip(self, url: str, trip: Dict[str, Any], html_content: str = None):
+        """
+        Сохраняет поездку (и страницу), загруженную в обход get_trip, например по этапам.
+
+        Args:
+            url: URL папки на Яндекс.Диске
+            trip: Данные поездки
+            html_content: Готовая HTML страница (опционально)
+        """
+        self.trips.put(url, trip, estimate_trip_size(trip))
+        if html_content is not None:
+            self.pages.put(url, html_content, len(html_content))
+
+    def stats(self) -> Dict[str, int]:
+        """Возвращает счетчики кэша."""
+        with self._metrics_lock:
+            stats = dict(self._counters)
+        stats.update({
+            'trip_entries': len(self.trips),
+            'trip_bytes': self.trips.current_bytes,
+            'trip_evictions': self.trips.evictions,
+            'page_entries': len(self.pages),
+            'page_bytes': self.pages.current_bytes,
+            'page_evictions': self.pages.evictions
+        })
+        return stats
+
+
+# Общий кэш процесса (все сессии Streamlit работают в одном процессе)
+TRIP_CACHE = TripCache()
@@ -0,0 +1,683 @@
+#!/usr/bin/env python3
+"""
+Модуль пространственного индекса многих поездок.
+
+События и треки поездок раскладываются по тайлам веб-карты (схема OSM z/x/y)
+и хранятся в SQLite. Для каждого уровня масштаба заранее посчитано количество
+событий каждого типа и покрытие треками, поэтому обзорная карта запрашивает
+только тайлы в области просмотра и не перебирает события. Индекс дополняется
+поездками по мере их появления: уже добавленные поездки без изменений пропускаются,
+измененные - пересчитываются.
+"""
+
+import os
+import sys
+import json
+import math
+import html
+import time
+import hashlib
+import sqlite3
+import argparse
+import urllib.parse as ul
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Tuple
+
+from data_parser import DataParser
+from pipeline_metrics import METRICS
+from trip_source import open_trip_source
+
+# Максимальный уровень масштаба индекса (тайл z18 - около 150 м на широте Москвы)
+MAX_ZOOM = 18
+
+# Тайл обзорной карты делится на 2^CELL_BITS x 2^CELL_BITS ячеек со счетчиками
+CELL_BITS = 3
+
+# Начиная с этого масштаба карта показывает отдельные события, а не счетчики
+DETAIL_ZOOM = MAX_ZOOM - CELL_BITS + 1
+
+# Максимум отдельных событий в одном тайле
+DETAIL_LIMIT = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trips (
+    id INTEGER PRIMARY KEY,
+    location TEXT NOT NULL UNIQUE,
+    fingerprint TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    events INTEGER NOT NULL,
+    min_lat REAL, min_lon REAL, max_lat REAL, max_lon REAL,
+    ingested_at REAL NOT NULL
+);
+-- События поездок с координатами тайла на MAX_ZOOM (для детального масштаба и пересчета)
+CREATE TABLE IF NOT EXISTS events (
+    trip_id INTEGER NOT NULL,
+    tx INTEGER NOT NULL,
+    ty INTEGER NOT NULL,
+    time REAL NOT NULL,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    event_type TEXT NOT NULL,
+    confidence REAL
+);
+CREATE INDEX IF NOT EXISTS events_tile ON events (tx, ty);
+CREATE INDEX IF NOT EXISTS events_trip ON events (trip_id);
+-- Количество GPS точек поездки в тайлах MAX_ZOOM (для пересчета покрытия)
+CREATE TABLE IF NOT EXISTS trip_track (
+    trip_id INTEGER NOT NULL,
+    tx INTEGER NOT NULL,
+    ty INTEGER NOT NULL,
+    points INTEGER NOT NULL,
+    PRIMARY KEY (trip_id, tx, ty)
+) WITHOUT ROWID;
+-- Заранее посчитанные счетчики событий по типам на всех уровнях масштаба
+CREATE TABLE IF NOT EXISTS tile_counts (
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    event_type TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (z, x, y, event_type)
+) WITHOUT ROWID;
+-- Покрытие треками: количество точек и поездок в тайле на всех уровнях масштаба
+CREATE TABLE IF NOT EXISTS track_counts (
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    points INTEGER NOT NULL,
+    trips INTEGER NOT NULL,
+    PRIMARY KEY (z, x, y)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def tile_xy(lat: float, lon: float, zoom: int = MAX_ZOOM) -> Tuple[int, int]:
+    """Номер тайла веб-карты (проекция Web Mercator), содержащего точку."""
+    n = 1 << zoom
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def summarize_trip(location: str, known_fingerprint: str = None) -> Dict[str, Any]:
+    """
+    Читает поездку и раскладывает ее точки и события по тайлам MAX_ZOOM
+    (выполняется в пуле процессов, в индекс пишет главный процесс).
+
+    Args:
+        location: Папка поездки, архив или URL Яндекс.Диска
+        known_fingerprint: Отпечаток версии поездки, уже лежащей в индексе
+
+    Returns:
+        Словарь с отпечатком, событиями и треком по тайлам; unchanged=True, если
+        поездка не изменилась, или error с описанием ошибки
+    """
+    try:
+        with open_trip_source(location) as source:
+            gps_content = source.read('gps.csv')
+            detections_content = source.read('detections.json') if source.exists('detections.json') else b''
+            digest = hashlib.sha1(gps_content)
+            digest.update(detections_content)
+            fingerprint = digest.hexdigest()
+            if fingerprint == known_fingerprint:
+                return {'location': location, 'unchanged': True}
+            gps_data = DataParser.parse_gps_data(gps_content)
+            events = DataParser.parse_detections_data(detections_content) if detections_content else []
+    except Exception as e:
+        return {'location': location, 'error': str(e)}
+
+    track = Counter(tile_xy(point['lat'], point['lon']) for point in gps_data)
+    event_rows = [
+        tile_xy(event['lat'], event['lon']) + (event['time'], event['lat'], event['lon'],
+                                               event['event_type'], event.get('confidence'))
+        for event in events
+    ]
+    lats = [point['lat'] for point in gps_data]
+    lons = [point['lon'] for point in gps_data]
+    return {
+        'location': location,
+        'fingerprint': fingerprint,
+        'points': len(gps_data),
+        'bounds': (min(lats), min(lons), max(lats), max(lons)) if gps_data else (None, None, None, None),
+        'events': event_rows,
+        'track': [(tx, ty, points) for (tx, ty), points in track.items()]
+    }
+
+
+class TripIndex:
+    """Пространственный индекс поездок в файле SQLite."""
+
+    def __init__(self, path: str, readonly: bool = False):
+        """
+        Args:
+            path: Путь к файлу индекса
+            readonly: Открыть только для чтения (сервер)
+        """
+        self.path = path
+        if readonly:
+            self.conn = sqlite3.connect('file:{}?mode=ro'.format(ul.quote(os.path.abspath(path))), uri=True,
+                                        check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(path)
+            # WAL позволяет серверу читать индекс во время добавления поездок
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self) -> 'TripIndex':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def generation(self) -> int:
+        """Номер версии индекса (увеличивается при каждом изменении, используется для кэширования тайлов)."""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    def fingerprints(self) -> Dict[str, str]:
+        """Отпечатки поездок в индексе {расположение: отпечаток}."""
+        return dict(self.conn.execute('SELECT location, fingerprint FROM trips'))
+
+    def add_trip(self, summary: Dict[str, Any]):
+        """
+        Добавляет поездку из summarize_trip в индекс (прежняя версия поездки удаляется).
+
+        Args:
+            summary: Результат summarize_trip
+        """
+        with METRICS.stage('index_trip') as record, self.conn:
+            row = self.conn.execute('SELECT id FROM trips WHERE location = ?', (summary['location'],)).fetchone()
+            if row is not None:
+                self._remove(row[0])
+            min_lat, min_lon, max_lat, max_lon = summary['bounds']
+            trip_id = self.conn.execute(
+                'INSERT INTO trips (location, fingerprint, points, events, min_lat, min_lon, max_lat, max_lon, '
+                'ingested_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (summary['location'], summary['fingerprint'], summary['points'], len(summary['events']),
+                 min_lat, min_lon, max_lat, max_lon, time.time())
+            ).lastrowid
+            self.conn.executemany(
+                'INSERT INTO events (trip_id, tx, ty, time, lat, lon, event_type, confidence) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                ((trip_id,) + event for event in summary['events'])
+            )
+            self.conn.executemany('INSERT INTO trip_track (trip_id, tx, ty, points) VALUES (?, ?, ?, ?)',
+                                  ((trip_id,) + cell for cell in summary['track']))
+            self._apply([(tx, ty, event_type) for tx, ty, _, _, _, event_type, _ in summary['events']],
+                        summary['track'], 1)
+            self._bump_generation()
+            record.items = len(summary['events'])
+
+    def remove_trip(self, location: str) -> bool:
+        """Удаляет поездку из индекса. Возвращает False, если ее там не было."""
+        with self.conn:
+            row = self.conn.execute('SELECT id FROM trips WHERE location = ?', (location,)).fetchone()
+            if row is None:
+                return False
+            self._remove(row[0])
+            self._bump_generation()
+        return True
+
+    def _remove(self, trip_id: int):
+        """Вычитает вклад поездки из счетчиков и удаляет ее строки."""
+        events = self.conn.execute('SELECT tx, ty, event_type FROM events WHERE trip_id = ?', (trip_id,)).fetchall()
+        track = self.conn.execute('SELECT tx, ty, points FROM trip_track WHERE trip_id = ?', (trip_id,)).fetchall()
+        self._apply(events, track, -1)
+        self.conn.execute('DELETE FROM tile_counts WHERE count <= 0')
+        self.conn.execute('DELETE FROM track_counts WHERE trips <= 0')
+        self.conn.execute('DELETE FROM events WHERE trip_id = ?', (trip_id,))
+        self.conn.execute('DELETE FROM trip_track WHERE trip_id = ?', (trip_id,))
+        self.conn.execute('DELETE FROM trips WHERE id = ?', (trip_id,))
+
+    def _apply(self, events: List[Tuple[int, int, str]], track: List[Tuple[int, int, int]], sign: int):
+        """
+        Прибавляет (sign=1) или вычитает (sign=-1) вклад одной поездки в счетчики всех уровней.
+        Тайл уровня z получается из тайла MAX_ZOOM сдвигом координат, поэтому
+        исходные точки для этого не нужны.
+        """
+        for zoom in range(MAX_ZOOM + 1):
+            shift = MAX_ZOOM - zoom
+            event_counts = Counter((tx >> shift, ty >> shift, event_type) for tx, ty, event_type in events)
+            self.conn.executemany(
+                'INSERT INTO tile_counts (z, x, y, event_type, count) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (z, x, y, event_type) DO UPDATE SET count = count + excluded.count',
+                ((zoom, x, y, event_type, sign * count) for (x, y, event_type), count in event_counts.items())
+            )
+            track_counts = Counter()
+            for tx, ty, points in track:
+                track_counts[tx >> shift, ty >> shift] += points
+            # Поездка добавляет в каждый тайл одну поездку, сколько бы точек в нем ни было
+            self.conn.executemany(
+                'INSERT INTO track_counts (z, x, y, points, trips) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (z, x, y) DO UPDATE SET points = points + excluded.points, '
+                'trips = trips + excluded.trips',
+                ((zoom, x, y, sign * points, sign) for (x, y), points in track_counts.items())
+            )
+
+    def _bump_generation(self):
+        self.conn.execute("INSERT INTO meta (key, value) VALUES ('generation', '1') "
+                          "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+
+    def summary(self) -> Dict[str, Any]:
+        """Сводка индекса: поездки, события по типам и границы покрытия."""
+        trips, points, min_lat, min_lon, max_lat, max_lon = self.conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(points), 0), MIN(min_lat), MIN(min_lon), MAX(max_lat), MAX(max_lon) '
+            'FROM trips'
+        ).fetchone()
+        # Счетчики нулевого уровня - это итоги по всему индексу
+        event_types = dict(self.conn.execute(
+            'SELECT event_type, SUM(count) FROM tile_counts WHERE z = 0 GROUP BY event_type ORDER BY 2 DESC'
+        ))
+        return {
+            'trips': trips,
+            'points': points,
+            'events': sum(event_types.values()),
+            'event_types': event_types,
+            'bounds': [[min_lat, min_lon], [max_lat, max_lon]] if trips else None,
+            'generation': self.generation
+        }
+
+    def tile(self, z: int, x: int, y: int) -> Dict[str, Any]:
+        """
+        Данные тайла обзорной карты.
+
+        На масштабе меньше DETAIL_ZOOM тайл делится на ячейки уровня z + CELL_BITS со
+        счетчиками событий по типам и покрытием треками; на детальном масштабе
+        возвращаются отдельные события тайла.
+
+        Args:
+            z, x, y: Номер тайла
+
+        Returns:
+            Словарь с cell_zoom, track ([dx, dy, точки, поездки]) и cells ([dx, dy, {тип: количество}])
+            или events ([lat, lon, тип, уверенность])
+        """
+        with METRICS.stage('index_tile') as record:
+            cell_zoom = min(z + CELL_BITS, MAX_ZOOM)
+            bits = cell_zoom - z
+            x0, y0 = x << bits, y << bits
+            # Равенство по x через IN позволяет SQLite искать по первичному ключу, а не сканировать столбец тайлов
+            xs = list(range(x0, x0 + (1 << bits)))
+            where = 'z = ? AND x IN ({}) AND y BETWEEN ? AND ?'.format(','.join('?' * len(xs)))
+            params = [cell_zoom] + xs + [y0, y0 + (1 << bits) - 1]
+
+            track = [[cx - x0, cy - y0, points, trips] for cx, cy, points, trips in self.conn.execute(
+                'SELECT x, y, points, trips FROM track_counts WHERE ' + where, params)]
+            result = {'cell_zoom': cell_zoom, 'track': track}
+
+            if z >= DETAIL_ZOOM:
+                shift = MAX_ZOOM - z
+                tx0, ty0 = x << shift, y << shift
+                txs = list(range(tx0, tx0 + (1 << shift)))
+                result['events'] = [list(row) for row in self.conn.execute(
+                    'SELECT lat, lon, event_type, confidence FROM events WHERE tx IN ({}) AND ty BETWEEN ? AND ? '
+                    'LIMIT ?'.format(','.join('?' * len(txs))), txs + [ty0, ty0 + (1 << shift) - 1, DETAIL_LIMIT])]
+                record.items = len(result['events'])
+            else:
+                cells = {}
+                for cx, cy, event_type, count in self.conn.execute(
+                        'SELECT x, y, event_type, count FROM tile_counts WHERE ' + where, params):
+                    cells.setdefault((cx - x0, cy - y0), {})[event_type] = count
+                result['cells'] = [[dx, dy, counts] for (dx, dy), counts in cells.items()]
+                record.items = len(cells)
+        return result
+
+
+def build_index(index_path: str, locations: List[str], jobs: int = None) -> Dict[str, int]:
+    """
+    Добавляет поездки в индекс (создается, если его нет). Поездки читаются в пуле
+    процессов, неизмененные поездки пропускаются.
+
+    Args:
+        index_path: Путь к файлу индекса
+        locations: Папки поездок, архивы или URL Яндекс.Диска
+        jobs: Количество процессов
+
+    Returns:
+        Счетчики added, updated, unchanged, failed
+    """
+    counters = {'added': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+    with TripIndex(index_path) as index:
+        known = index.fingerprints()
+        keys = [os.path.realpath(location) if os.path.exists(location) else location for location in locations]
+        with ProcessPoolExecutor(jobs) as executor:
+            summaries = executor.map(summarize_trip, keys, [known.get(key) for key in keys])
+            for summary in summaries:
+                location = summary['location']
+                if 'error' in summary:
+                    counters['failed'] += 1
+                    print(f"Ошибка {location}: {summary['error']}", file=sys.stderr)
+                elif summary.get('unchanged'):
+                    counters['unchanged'] += 1
+                else:
+                    counters['updated' if location in known else 'added'] += 1
+                    index.add_trip(summary)
+                    print(f"Добавлена поездка {location}: {summary['points']} точек, {len(summary['events'])} событий")
+    return counters
+
+
+# Страница обзорной карты: тайлы со счетчиками запрашиваются у сервера индекса
+OVERVIEW_TEMPLATE = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Обзор поездок</title>
+    <link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css" />
+    <style>
+        * { margin: 0; padding: 0; box-sizing: border-box; }
+        body { font-family: Arial, sans-serif; height: 100vh; display: flex; flex-direction: column; }
+        .header { padding: 10px 15px; background: #2c3e50; color: white; font-size: 14px; }
+        .header h1 { font-size: 18px; margin-bottom: 5px; }
+        .legend-item { display: inline-block; margin-right: 12px; }
+        .legend-color { display: inline-block; width: 10px; height: 10px; border-radius: 50%%; margin-right: 4px; }
+        #map { flex: 1; }
+    </style>
+</head>
+<body>
+    <div class="header">
+        <h1>Обзор поездок</h1>
+        <div>%(summary_html)s</div>
+    </div>
+    <div id="map"></div>
+    <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+    <script>
+        const summary = %(summary_json)s;
+        const CELL_BITS = %(cell_bits)d;
+        const DETAIL_ZOOM = %(detail_zoom)d;
+        const MAX_ZOOM = %(max_zoom)d;
+
+        function getEventColor(eventType) {
+            const colors = {
+                'pothole': '#e74c3c',
+                'erased_markings': '#f39c12',
+                'garbage_on_road': '#27ae60',
+                'damaged_sign': '#9b59b6',
+                'manual': '#3498db',
+                'default': '#95a5a6'
+            };
+            return colors[eventType] || colors['default'];
+        }
+
+        document.querySelectorAll('.legend-color').forEach(element => {
+            element.style.background = getEventColor(element.dataset.eventType);
+        });
+
+        const map = L.map('map');
+        L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+            attribution: '© OpenStreetMap contributors',
+            maxZoom: 19
+        }).addTo(map);
+
+        // Данные загруженных тайлов (для всплывающих подсказок), удаляются вместе с тайлами
+        const tileData = new Map();
+        const tileKey = coords => `${coords.z}/${coords.x}/${coords.y}`;
+
+        function drawTile(canvas, coords, data) {
+            const ctx = canvas.getContext('2d');
+            const cellSize = 256 / (1 << (data.cell_zoom - coords.z));
+
+            // Покрытие треками: чем больше поездок, тем плотнее заливка
+            for (const [dx, dy, points, trips] of data.track) {
+                ctx.fillStyle = `rgba(52, 152, 219, ${Math.min(0.15 + 0.1 * Math.log2(trips), 0.6)})`;
+                ctx.fillRect(dx * cellSize, dy * cellSize, cellSize, cellSize);
+            }
+
+            if (data.events) {
+                const origin = coords.scaleBy(L.point(256, 256));
+                for (const [lat, lon, eventType] of data.events) {
+                    const point = map.project([lat, lon], coords.z).subtract(origin);
+                    ctx.fillStyle = getEventColor(eventType);
+                    ctx.beginPath();
+                    ctx.arc(point.x, point.y, 5, 0, 2 * Math.PI);
+                    ctx.fill();
+                }
+                return;
+            }
+
+            ctx.font = 'bold 10px Arial';
+            ctx.textAlign = 'center';
+            ctx.textBaseline = 'middle';
+            for (const [dx, dy, counts] of data.cells) {
+                let total = 0, topType = null;
+                for (const eventType in counts) {
+                    total += counts[eventType];
+                    if (topType === null || counts[eventType] > counts[topType]) topType = eventType;
+                }
+                const radius = Math.min(4 + 3 * Math.log2(total), cellSize / 2);
+                const cx = (dx + 0.5) * cellSize, cy = (dy + 0.5) * cellSize;
+                ctx.globalAlpha = 0.8;
+                ctx.fillStyle = getEventColor(topType);
+                ctx.beginPath();
+                ctx.arc(cx, cy, radius, 0, 2 * Math.PI);
+                ctx.fill();
+                ctx.globalAlpha = 1;
+                if (radius >= 8) {
+                    ctx.fillStyle = 'white';
+                    ctx.fillText(total, cx, cy);
+                }
+            }
+        }
+
+        // Слой счетчиков: Leaflet сам запрашивает только тайлы в области просмотра
+        const IndexLayer = L.GridLayer.extend({
+            createTile(coords, done) {
+                const canvas = L.DomUtil.create('canvas', 'index-tile');
+                canvas.width = canvas.height = 256;
+                fetch(`tiles/${tileKey(coords)}.json?v=${summary.generation}`)
+                    .then(response => response.json())
+                    .then(data => {
+                        tileData.set(tileKey(coords), data);
+                        drawTile(canvas, coords, data);
+                        done(null, canvas);
+                    })
+                    .catch(error => done(error, canvas));
+                return canvas;
+            }
+        });
+        const indexLayer = new IndexLayer({maxNativeZoom: MAX_ZOOM, maxZoom: 19});
+        indexLayer.on('tileunload', e => tileData.delete(tileKey(e.coords)));
+        indexLayer.addTo(map);
+
+        // Подсказка со счетчиками ячейки или описанием ближайшего события
+        map.on('click', e => {
+            const z = Math.min(Math.round(map.getZoom()), MAX_ZOOM);
+            const pixel = map.project(e.latlng, z);
+            const coords = L.point(Math.floor(pixel.x / 256), Math.floor(pixel.y / 256));
+            coords.z = z;
+            const data = tileData.get(tileKey(coords));
+            if (!data) return;
+
+            const cellSize = 256 / (1 << (data.cell_zoom - z));
+            const dx = Math.floor((pixel.x - coords.x * 256) / cellSize);
+            const dy = Math.floor((pixel.y - coords.y * 256) / cellSize);
+            const lines = [];
+
+            if (data.events) {
+                let nearest = null, nearestDistance = 10;
+                for (const event of data.events) {
+                    const distance = map.project([event[0], event[1]], z).distanceTo(pixel);
+                    if (distance < nearestDistance) {
+                        nearest = event;
+                        nearestDistance = distance;
+                    }
+                }
+                if (nearest) {
+                    lines.push(`<strong>${nearest[2]}</strong>`);
+                    if (nearest[3] !== null) lines.push(`Уверенность: ${(nearest[3] * 100).toFixed(1)}%%`);
+                }
+            } else {
+                const cell = data.cells.find(c => c[0] === dx && c[1] === dy);
+                if (cell) {
+                    for (const eventType in cell[2]) lines.push(`${eventType}: ${cell[2][eventType]}`);
+                }
+            }
+            const track = data.track.find(c => c[0] === dx && c[1] === dy);
+            if (track) lines.push(`Поездок: ${track[3]}, GPS точек: ${track[2]}`);
+            if (lines.length) L.popup().setLatLng(e.latlng).setContent(lines.join('<br>')).openOn(map);
+        });
+
+        if (summary.bounds) {
+            map.fitBounds(summary.bounds);
+        } else {
+            map.setView([55.75, 37.62], 10);
+        }
+    </script>
+</body>
+</html>
+"""
+
+
+def render_overview(summary: Dict[str, Any]) -> str:
+    """Генерирует страницу обзорной карты по сводке индекса."""
+    items = ['<span class="legend-item"><strong>Поездок:</strong> {}</span>'.format(summary['trips']),
+             '<span class="legend-item"><strong>Событий:</strong> {}</span>'.format(summary['events'])]
+    for event_type, count in summary['event_types'].items():
+        items.append(
+            '<span class="legend-item"><span class="legend-color" data-event-type="{0}"></span>{0}: {1}</span>'.format(
+                html.escape(event_type), count)
+        )
+    return OVERVIEW_TEMPLATE % {
+        'summary_html': '\n'.join(items),
+        'summary_json': json.dumps(summary, ensure_ascii=False),
+        'cell_bits': CELL_BITS,
+        'detail_zoom': DETAIL_ZOOM,
+        'max_zoom': MAX_ZOOM
+    }
+
+
+class IndexServer(ThreadingHTTPServer):
+    """HTTP сервер обзорной карты и тайлов индекса."""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], index_path: str, quiet: bool = False):
+        super().__init__(address, IndexRequestHandler)
+        self.index_path = index_path
+        self.quiet = quiet
+
+    def open_index(self) -> TripIndex:
+        # Соединение на запрос: SQLite открывает файл за микросекунды, а запись в индекс
+        # (WAL) не блокирует читателей
+        return TripIndex(self.index_path, readonly=True)
+
+
+class IndexRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов IndexServer."""
+
+    server: IndexServer
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        parsed = ul.urlsplit(self.path)
+        parts = parsed.path.strip('/').split('/')
+        try:
+            with self.server.open_index() as index:
+                if parsed.path == '/':
+                    body = render_overview(index.summary()).encode('utf-8')
+                    self.send_bytes(200, body, 'text/html; charset=utf-8', 'no-cache')
+                elif parsed.path == '/summary':
+                    self.send_json(index.summary(), 'no-cache')
+                elif len(parts) == 4 and parts[0] == 'tiles' and parts[3].endswith('.json'):
+                    z, x, y = int(parts[1]), int(parts[2]), int(parts[3][:-len('.json')])
+                    if not 0 <= z <= MAX_ZOOM or not 0 <= x < (1 << z) or not 0 <= y < (1 << z):
+                        self.send_error(404)
+                        return
+                    # Ссылка с текущей версией индекса неизменна и кэшируется браузером
+                    version = ul.parse_qs(parsed.query).get('v', [''])[0]
+                    cache = 'public, max-age=86400' if version == str(index.generation) else 'no-cache'
+                    self.send_json(index.tile(z, x, y), cache)
+                else:
+                    self.send_error(404)
+        except ValueError:
+            self.send_error(400)
+
+    def send_json(self, data: Any, cache_control: str):
+        body = json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        self.send_bytes(200, body, 'application/json', cache_control)
+
+    def send_bytes(self, status: int, body: bytes, content_type: str, cache_control: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', cache_control)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description='Пространственный индекс событий и треков многих поездок')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='Добавить поездки в индекс (неизмененные пропускаются)')
+    build.add_argument('index', help='Файл индекса SQLite')
+    build.add_argument('trips', nargs='+', help='Папки поездок, архивы или URL Яндекс.Диска')
+    build.add_argument('-j', '--jobs', type=int, default=None, help='Количество процессов чтения поездок')
+
+    remove = commands.add_parser('remove', help='Удалить поездки из индекса')
+    remove.add_argument('index', help='Файл индекса SQLite')
+    remove.add_argument('trips', nargs='+', help='Поездки в том виде, в котором они добавлялись')
+
+    info = commands.add_parser('info', help='Сводка индекса')
+    info.add_argument('index', help='Файл индекса SQLite')
+
+    serve = commands.add_parser('serve', help='HTTP сервер обзорной карты')
+    serve.add_argument('index', help='Файл индекса SQLite')
+    serve.add_argument('--host', default='127.0.0.1', help='Адрес для прослушивания')
+    serve.add_argument('--port', type=int, default=8002, help='Порт')
+    serve.add_argument('--quiet', action='store_true', help='Не выводить журнал запросов')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        counters = build_index(args.index, args.trips, args.jobs)
+        print("Добавлено: {added}, обновлено: {updated}, без изменений: {unchanged}, с ошибками: {failed}".format(
+            **counters))
+        return 1 if counters['failed'] else 0
+
+    if not os.path.exists(args.index):
+        print(f"Индекс не найден: {args.index}")
+        return 1
+
+    if args.command == 'remove':
+        with TripIndex(args.index) as index:
+            for location in args.trips:
+                key = os.path.realpath(location) if os.path.exists(location) else location
+                if not index.remove_trip(key):
+                    print(f"Поездки нет в индексе: {location}")
+        return 0
+
+    if args.command == 'info':
+        with TripIndex(args.index, readonly=True) as index:
+            json.dump(index.summary(), sys.stdout, indent=2, ensure_ascii=False)
+        print()
+        return 0
+
+    server = IndexServer((args.host, args.port), args.index, args.quiet)
+    print(f"Обзорная карта: http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nСервер остановлен")
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
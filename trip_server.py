@@ -0,0 +1,460 @@
+"""
+Модуль HTTP сервера страниц поездок.
+Отдает сгенерированные страницы для локальных папок и ссылок на Яндекс.Диск
+со сжатием, ETag и кэшированием готовых страниц в памяти.
+"""
+
+import os
+import sys
+import gzip
+import json
+import html
+import hashlib
+import argparse
+import threading
+import urllib.parse as ul
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Optional, Tuple
+
+from generate_html import load_trip_from_dir, load_trip_from_yandex, render_trip
+from html_generator import HTMLGenerator
+from trip_cache import MemoryLRU, SingleFlight
+from http_range import RangeNotSatisfiable, parse_range
+from pipeline_metrics import METRICS
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Файлы, по времени изменения которых определяется актуальность локальной страницы
+TRIP_FILES = ['gps.csv', 'detections.json', 'device.txt', 'times_full.json']
+
+# Размер блока при отдаче файлов
+CHUNK_SIZE = 256 * 1024
+
+# Предел размера отчета телеметрии (sendBeacon в браузерах ограничен 64 КБ)
+MAX_TELEMETRY_BYTES = 64 * 1024
+
+
+def build_page(source: str, location: str, files_prefix: str, gzip_level: int, brotli_quality: int,
+               generator_options: Dict[str, Any] = None) -> Tuple[Dict[str, bytes], Dict[str, Any]]:
+    """
+    Генерирует страницу поездки и все ее сжатые варианты (выполняется в пуле процессов).
+
+    Args:
+        source: 'local' или 'yandex'
+        location: Путь к папке или URL Яндекс.Диска
+        files_prefix: URL префикс для локальных видео файлов
+        gzip_level: Уровень сжатия gzip
+        brotli_quality: Качество сжатия brotli
+        generator_options: Параметры HTMLGenerator
+
+    Returns:
+        Кортеж (словарь {кодировка: тело ответа}, метрики этапов генерации для объединения в главном процессе)
+    """
+    # Метрики процесса пула отправляются в главный процесс вместе с результатом
+    METRICS.reset()
+
+    if source == 'local':
+        trip = load_trip_from_dir(location)
+        # Локальные видео отдаются сервером через /files/
+        trip['video_files'] = [files_prefix + ul.quote(os.path.basename(path)) for path in trip['video_files']]
+    else:
+        trip = load_trip_from_yandex(location)
+
+    body = render_trip(trip, HTMLGenerator(**(generator_options or {}))).encode('utf-8')
+    with METRICS.stage('compress') as record:
+        variants = {
+            'identity': body,
+            'gzip': gzip.compress(body, compresslevel=gzip_level)
+        }
+        if brotli is not None:
+            variants['br'] = brotli.compress(body, quality=brotli_quality)
+        record.bytes = len(body)
+    return variants, METRICS.export()
+
+
+class RenderedPage:
+    """Готовая страница со всеми вариантами сжатия и строгими ETag."""
+
+    def __init__(self, variants: Dict[str, bytes]):
+        self.variants = variants
+        digest = hashlib.sha256(variants['identity']).hexdigest()[:32]
+        # Строгий ETag должен различаться для разных представлений
+        self.etags = {
+            encoding: '"{}"'.format(digest if encoding == 'identity' else '{}-{}'.format(digest, encoding))
+            for encoding in variants
+        }
+
+    @property
+    def size(self) -> int:
+        return sum(len(body) for body in self.variants.values())
+
+
+def negotiate_encoding(accept_encoding: Optional[str], available: List[str]) -> str:
+    """
+    Выбирает кодировку ответа по заголовку Accept-Encoding.
+
+    Args:
+        accept_encoding: Значение заголовка Accept-Encoding
+        available: Доступные кодировки
+
+    Returns:
+        'br', 'gzip' или 'identity'
+    """
+    if not accept_encoding:
+        return 'identity'
+
+    weights = {}
+    for part in accept_encoding.split(','):
+        fields = part.strip().split(';')
+        name = fields[0].strip().lower()
+        weight = 1.0
+        for param in fields[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    weight = float(param[2:])
+                except ValueError:
+                    weight = 0.0
+        weights[name] = weight
+
+    best, best_weight = 'identity', 0.0
+    # Порядок определяет предпочтение при равных весах
+    for encoding in ['br', 'gzip']:
+        if encoding not in available:
+            continue
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверяет заголовок If-None-Match (слабое сравнение, как требует RFC 9110)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return any(tag[2:] == etag if tag.startswith('W/') else tag == etag for tag in candidates)
+
+
+class TripServer(ThreadingHTTPServer):
+    """HTTP сервер страниц поездок с пулом генерации и кэшем готовых страниц."""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], root: Optional[str] = None, workers: int = 4,
+                 cache_bytes: int = 256 * 1024 * 1024, gzip_level: int = 6, brotli_quality: int = 5,
+                 quiet: bool = False, metrics: bool = False, telemetry_log: str = None, tile_url: str = None,
+                 bundle: str = 'cdn'):
+        super().__init__(address, TripRequestHandler)
+        self.root = os.path.realpath(root) if root else None
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.quiet = quiet
+        self.metrics = metrics
+        # Страницы отправляют телеметрию на этот же сервер, сводки дописываются в файл JSON Lines
+        self.telemetry_log = telemetry_log
+        self.generator_options = {'telemetry': True, 'telemetry_endpoint': '/telemetry'} if telemetry_log else {}
+        if tile_url:
+            self.generator_options['tile_url'] = tile_url
+        if bundle != 'cdn':
+            self.generator_options['bundle'] = bundle
+        # Ссылки Яндекс.Диска на видео временные, поэтому страницы живут ограниченное время
+        self.pages = MemoryLRU(cache_bytes, ttl=3600)
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self._flight = SingleFlight()
+        self._stats_lock = threading.Lock()
+        self.telemetry_lock = threading.Lock()
+        self.counters = {'requests': 0, 'page_hits': 0, 'page_misses': 0, 'renders': 0,
+                         'coalesced': 0, 'not_modified': 0, 'telemetry_reports': 0}
+
+    def count(self, name: str):
+        with self._stats_lock:
+            self.counters[name] += 1
+
+    def get_page(self, key: Any, source: str, location: str, files_prefix: str = '') -> RenderedPage:
+        """Возвращает страницу из кэша или генерирует ее в пуле (одновременные запросы объединяются)."""
+        page = self.pages.get(key)
+        if page is not None:
+            self.count('page_hits')
+            return page
+
+        self.count('page_misses')
+
+        def render():
+            variants, metrics = self.executor.submit(build_page, source, location, files_prefix, self.gzip_level,
+                                                     self.brotli_quality, self.generator_options).result()
+            METRICS.merge(metrics)
+            self.count('renders')
+            page = RenderedPage(variants)
+            self.pages.put(key, page, page.size)
+            return page
+
+        page, shared = self._flight.do(key, render)
+        if shared:
+            self.count('coalesced')
+        return page
+
+    def resolve_local(self, relative_path: str) -> Optional[str]:
+        """Преобразует путь из URL в путь внутри корневой папки (или None, если он вне ее)."""
+        if self.root is None:
+            return None
+        path = os.path.realpath(os.path.join(self.root, relative_path))
+        if os.path.commonpath([path, self.root]) != self.root:
+            return None
+        return path
+
+    def find_local_trips(self) -> List[str]:
+        """Находит папки поездок (с gps.csv) в корневой папке."""
+        if self.root is None:
+            return []
+        trips = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            if 'gps.csv' in filenames:
+                trips.append(os.path.relpath(dirpath, self.root))
+        return trips
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            stats = dict(self.counters)
+        stats.update({
+            'page_entries': len(self.pages),
+            'page_bytes': self.pages.current_bytes,
+            'page_evictions': self.pages.evictions
+        })
+        return stats
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class TripRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов TripServer."""
+
+    server: TripServer
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def do_POST(self):
+        if ul.urlsplit(self.path).path != '/telemetry' or not self.server.telemetry_log:
+            self.send_error(404)
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_TELEMETRY_BYTES:
+            # Тело не читаем, поэтому соединение дальше использовать нельзя
+            self.close_connection = True
+            if length < 0:
+                self.send_error(400, explain="Некорректный Content-Length")
+            else:
+                self.send_error(413, explain="Слишком большой отчет телеметрии")
+            return
+        try:
+            report = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.send_error(400, explain="Некорректный JSON")
+            return
+        if not isinstance(report, dict):
+            self.send_error(400, explain="Отчет телеметрии должен быть JSON объектом")
+            return
+
+        report['client'] = self.client_address[0]
+        with self.server.telemetry_lock:
+            with open(self.server.telemetry_log, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(report, ensure_ascii=False) + '\n')
+        self.server.count('telemetry_reports')
+        self.send_bytes(204, b'', 'text/plain', False)
+
+    def handle_request(self, send_body: bool):
+        self.server.count('requests')
+        parsed = ul.urlsplit(self.path)
+        path = ul.unquote(parsed.path)
+        query = ul.parse_qs(parsed.query)
+
+        try:
+            if path == '/':
+                self.send_index(send_body)
+            elif path == '/stats':
+                body = json.dumps(self.server.stats(), indent=2).encode('utf-8')
+                self.send_bytes(200, body, 'application/json', send_body)
+            elif path == '/metrics' and self.server.metrics:
+                body = METRICS.to_prometheus({'server_' + name: value for name, value in self.server.stats().items()})
+                self.send_bytes(200, body.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8', send_body)
+            elif path == '/yandex':
+                url = query.get('url', [''])[0]
+                if not url:
+                    self.send_error(400, explain="Не указан параметр url")
+                    return
+                page = self.server.get_page(('yandex', url), 'yandex', url)
+                self.send_page(page, send_body)
+            elif path.startswith('/local/'):
+                self.send_local_trip(path[len('/local/'):].strip('/'), send_body)
+            elif path.startswith('/files/'):
+                self.send_file(path[len('/files/'):], send_body)
+            else:
+                self.send_error(404)
+        except Exception as e:
+            self.send_error(500, explain="Ошибка генерации страницы: {}".format(e))
+
+    def send_index(self, send_body: bool):
+        """Отдает список локальных поездок и форму для ссылки на Яндекс.Диск."""
+        items = ''.join(
+            '<li><a href="/local/{}/">{}</a></li>'.format(ul.quote(trip), html.escape(trip))
+            for trip in self.server.find_local_trips()
+        )
+        body = (
+            '<!DOCTYPE html><html lang="ru"><head><meta charset="UTF-8"><title>Поездки</title></head><body>'
+            '<h1>Поездки</h1>'
+            '<form action="/yandex"><input name="url" size="60" placeholder="https://disk.yandex.ru/d/...">'
+            '<button type="submit">Открыть</button></form>'
+            '<ul>{}</ul></body></html>'
+        ).format(items).encode('utf-8')
+        self.send_bytes(200, body, 'text/html; charset=utf-8', send_body)
+
+    def send_local_trip(self, relative_path: str, send_body: bool):
+        """Отдает страницу поездки из локальной папки."""
+        data_dir = self.server.resolve_local(relative_path)
+        if data_dir is None or not os.path.isfile(os.path.join(data_dir, 'gps.csv')):
+            self.send_error(404, explain="Поездка не найдена")
+            return
+
+        # Ключ включает время изменения файлов, чтобы страница обновлялась вместе с данными
+        mtimes = tuple(
+            os.path.getmtime(os.path.join(data_dir, filename))
+            for filename in TRIP_FILES if os.path.exists(os.path.join(data_dir, filename))
+        )
+        files_prefix = '/files/{}/'.format(ul.quote(relative_path)) if relative_path else '/files/'
+        page = self.server.get_page(('local', data_dir, mtimes), 'local', data_dir, files_prefix)
+        self.send_page(page, send_body)
+
+    def send_page(self, page: RenderedPage, send_body: bool):
+        """Отдает страницу с учетом Accept-Encoding и If-None-Match."""
+        encoding = negotiate_encoding(self.headers.get('Accept-Encoding'), list(page.variants))
+        etag = page.etags[encoding]
+
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.server.count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+
+        body = page.variants[encoding]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Cache-Control', 'no-cache')
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_file(self, relative_path: str, send_body: bool):
+        """Отдает локальный файл (видео) с поддержкой Range."""
+        file_path = self.server.resolve_local(relative_path)
+        if file_path is None or not os.path.isfile(file_path):
+            self.send_error(404)
+            return
+
+        file_size = os.path.getsize(file_path)
+        try:
+            byte_range = parse_range(self.headers.get('Range'), file_size)
+        except RangeNotSatisfiable:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{}'.format(file_size))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start, end = byte_range if byte_range else (0, file_size - 1)
+        length = end - start + 1
+
+        self.send_response(206 if byte_range else 200)
+        self.send_header('Content-Type', 'video/mp4' if file_path.endswith('.mp4') else 'application/octet-stream')
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        if byte_range:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, file_size))
+        self.end_headers()
+
+        if not send_body:
+            return
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def send_bytes(self, status: int, body: bytes, content_type: str, send_body: bool):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(prog='generate_html.py serve', description='HTTP сервер страниц поездок')
+    parser.add_argument('--root', help='Папка с локальными поездками (подпапки с gps.csv)')
+    parser.add_argument('--host', default='127.0.0.1', help='Адрес для прослушивания')
+    parser.add_argument('--port', type=int, default=8000, help='Порт')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Количество процессов генерации страниц')
+    parser.add_argument('--cache-mb', type=int, default=256, help='Лимит памяти кэша страниц, МБ')
+    parser.add_argument('--gzip-level', type=int, default=6, help='Уровень сжатия gzip (1-9)')
+    parser.add_argument('--brotli-quality', type=int, default=5, help='Качество сжатия brotli (0-11)')
+    parser.add_argument('--quiet', action='store_true', help='Не выводить журнал запросов')
+    parser.add_argument('--metrics', action='store_true', help='Включить эндпоинт /metrics в формате Prometheus')
+    parser.add_argument('--telemetry-log', metavar='JSONL', help='Встроить в страницы телеметрию и дописывать ее сводки в файл')
+    parser.add_argument('--tile-url', metavar='URL', help='Шаблон адреса тайлов подложки в страницах (прокси тайлов)')
+    parser.add_argument('--bundle', choices=['cdn', 'inline'], default='cdn',
+                        help='Подключение Leaflet: с unpkg или встроенной в страницы сохраненной копией')
+
+    args = parser.parse_args(argv)
+
+    if brotli is None:
+        print("Модуль brotli не установлен, сжатие br недоступно")
+
+    server = TripServer((args.host, args.port), args.root, args.workers, args.cache_mb * 1024 * 1024,
+                        args.gzip_level, args.brotli_quality, args.quiet, args.metrics, args.telemetry_log,
+                        args.tile_url, args.bundle)
+    print(f"Сервер запущен: http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nСервер остановлен")
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
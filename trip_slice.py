@@ -0,0 +1,87 @@
+"""
+Модуль для вырезания интервала времени из поездки.
+GPS точки, события и кадры ищутся бинарным поиском по отсортированному времени,
+так что работа зависит от длины интервала, а не всей записи.
+"""
+
+from bisect import bisect_left, bisect_right
+from typing import List, Dict, Any, Optional, Union
+
+from event_store import EventStore
+
+
+def parse_time_value(value: str) -> float:
+    """
+    Разбирает время от начала записи: секунды ("90.5"), "ММ:СС" или "ЧЧ:ММ:СС".
+
+    Args:
+        value: Строка времени
+
+    Returns:
+        Время в секундах
+    """
+    seconds = 0.0
+    for part in value.strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def slice_trip(gps_data: List[Dict[str, Any]], events: Union[List[Dict[str, Any]], EventStore],
+               times_data: Optional[Dict[str, Any]], start: float = None, end: float = None) -> Dict[str, Any]:
+    """
+    Вырезает интервал [start, end] из поездки и переводит время в отсчет от начала интервала.
+
+    Args:
+        gps_data: GPS точки, отсортированные по времени
+        events: События (список или EventStore)
+        times_data: Данные о кадрах из DataParser.parse_times_data (или None)
+        start: Начало интервала в секундах от начала записи (None - с начала)
+        end: Конец интервала в секундах от начала записи (None - до конца)
+
+    Returns:
+        Словарь с gps_data, events, times_data и смещениями для видео:
+        time_offset (начало интервала в исходной записи), frame_offset (индекс первого
+        кадра интервала в видео файле) и frame_count (количество кадров в файле)
+    """
+    if not isinstance(events, EventStore):
+        events = EventStore.from_events(events)
+
+    frame_times = times_data.get('frame_times', []) if times_data else []
+    if times_data and times_data['duration'] > 0:
+        record_end = times_data['duration']
+    else:
+        record_end = max(gps_data[-1]['time'] if gps_data else 0, events.end_time or 0)
+
+    start = max(start or 0.0, 0.0)
+    end = min(end, record_end) if end is not None else record_end
+    if end <= start:
+        raise ValueError(f"Пустой интервал времени: {start:.3f}-{end:.3f} с (длина записи {record_end:.3f} с)")
+
+    # GPS: берем по одной соседней точке за границами интервала, чтобы маркер интерполировался до краев
+    lo = bisect_left(gps_data, start, key=lambda point: point['time'])
+    hi = bisect_right(gps_data, end, lo, key=lambda point: point['time'])
+    gps_slice = [dict(point, time=point['time'] - start) for point in gps_data[max(lo - 1, 0):hi + 1]]
+    if not gps_slice:
+        raise ValueError("В интервале нет GPS точек")
+
+    # Кадры: индекс первого кадра нужен для пересчета времени видео в время интервала
+    frame_lo = bisect_left(frame_times, start, key=lambda frame: frame['time'])
+    frame_hi = bisect_right(frame_times, end, frame_lo, key=lambda frame: frame['time'])
+    sliced_times = None
+    if times_data:
+        sliced_times = dict(times_data)
+        sliced_times['start_time'] = times_data['start_time'] + start
+        sliced_times['end_time'] = times_data['start_time'] + end
+        sliced_times['duration'] = end - start
+        sliced_times['frame_times'] = [dict(frame, time=frame['time'] - start)
+                                       for frame in frame_times[frame_lo:frame_hi]]
+
+    return {
+        'gps_data': gps_slice,
+        'events': events.slice(start, end, start),
+        'times_data': sliced_times,
+        'duration': end - start,
+        'time_offset': start,
+        'frame_offset': frame_lo,
+        'frame_count': len(frame_times)
+    }
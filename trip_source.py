@@ -0,0 +1,382 @@
+"""
+Модуль источников файлов поездки.
+Источник отдает файлы поездки парсерам как байты, буферы или бинарные потоки,
+независимо от того, где лежат данные: в локальной папке, в памяти, в архиве
+или на Яндекс.Диске.
+"""
+
+import io
+import os
+import abc
+import mmap
+import shutil
+import tarfile
+import zipfile
+from typing import Dict, Any, BinaryIO, Callable, List, Optional, Union
+
+from data_parser import DataParser
+from yandex_downloader import YandexDownloader
+
+# Буфер с содержимым файла: байты или отображение файла в память
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+# Файлы данных поездки
+TRIP_DATA_FILES = ['gps.csv', 'detections.json', 'device.txt', 'times_full.json']
+
+# Видео файлы поездки внутри архивов
+VIDEO_FILE_NAMES = ['video.mp4', 'video_2.mp4']
+
+# Размер блока при распаковке видео
+EXTRACT_CHUNK_SIZE = 1024 * 1024
+
+
+class TripSource(abc.ABC):
+    """Базовый класс источника файлов поездки (gps.csv, detections.json, device.txt, times_full.json)."""
+
+    @abc.abstractmethod
+    def exists(self, filename: str) -> bool:
+        """Проверяет, есть ли файл в источнике."""
+
+    @abc.abstractmethod
+    def open(self, filename: str) -> BinaryIO:
+        """
+        Открывает файл как бинарный поток.
+
+        Args:
+            filename: Имя файла поездки
+
+        Returns:
+            Поток для чтения (закрывается вызывающим кодом)
+        """
+
+    def read(self, filename: str) -> Buffer:
+        """
+        Возвращает содержимое файла целиком.
+
+        Args:
+            filename: Имя файла поездки
+
+        Returns:
+            Байты или буфер с содержимым файла
+        """
+        with self.open(filename) as f:
+            return f.read()
+
+    def video_files(self) -> List[str]:
+        """Возвращает пути или ссылки на видео поездки, пригодные для страницы."""
+        return []
+
+    def probe_videos(self, video_files: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Читает метаданные видео (см. mp4_probe) без загрузки кадров.
+
+        Args:
+            video_files: Видео из video_files()
+
+        Returns:
+            Метаданные каждого видео (None, если прочитать не удалось)
+        """
+        return DataParser.probe_video_files(video_files)
+
+    def close(self):
+        """Освобождает ресурсы источника (открытые архивы, отображения файлов)."""
+
+    @staticmethod
+    def _extract(open_member: Callable[[], BinaryIO], size: int, target: str) -> str:
+        """
+        Распаковывает член архива в файл, если он еще не распакован (сравнивается размер).
+
+        Args:
+            open_member: Функция, открывающая член архива как поток
+            size: Размер члена архива в байтах
+            target: Путь к файлу назначения
+
+        Returns:
+            Путь к файлу назначения
+        """
+        if os.path.exists(target) and os.path.getsize(target) == size:
+            return target
+        os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+        # Пишем во временный файл, чтобы прерванная распаковка не выглядела готовой
+        partial = target + '.part'
+        with open_member() as member, open(partial, 'wb') as f:
+            shutil.copyfileobj(member, f, EXTRACT_CHUNK_SIZE)
+        os.replace(partial, target)
+        print(f"Распаковано видео: {target}")
+        return target
+
+    def __enter__(self) -> 'TripSource':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class LocalDirSource(TripSource):
+    """Файлы поездки в локальной папке."""
+
+    def __init__(self, data_dir: str):
+        """
+        Args:
+            data_dir: Путь к папке с данными
+        """
+        self.data_dir = data_dir
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.data_dir, filename)
+
+    def exists(self, filename: str) -> bool:
+        return os.path.exists(self.path(filename))
+
+    def open(self, filename: str) -> BinaryIO:
+        return open(self.path(filename), 'rb')
+
+    def video_files(self) -> List[str]:
+        return DataParser.find_video_files(self.data_dir)
+
+    def __str__(self) -> str:
+        return self.data_dir
+
+
+class MmapSource(LocalDirSource):
+    """Файлы поездки в локальной папке, отображаемые в память (без копирования в буфер процесса)."""
+
+    def __init__(self, data_dir: str):
+        super().__init__(data_dir)
+        self._maps: List[mmap.mmap] = []
+
+    def read(self, filename: str) -> Buffer:
+        with open(self.path(filename), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Пустой файл нельзя отобразить в память
+                return b''
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return mapped
+
+    def open(self, filename: str) -> BinaryIO:
+        # mmap поддерживает read/readline/seek и используется как поток
+        mapped = self.read(filename)
+        return mapped if isinstance(mapped, mmap.mmap) else io.BytesIO(mapped)
+
+    def close(self):
+        for mapped in self._maps:
+            mapped.close()
+        self._maps = []
+
+
+class BytesSource(TripSource):
+    """Файлы поездки, уже находящиеся в памяти (например, загруженные пользователем)."""
+
+    def __init__(self, files: Dict[str, Buffer], video_files: List[str] = None):
+        """
+        Args:
+            files: Словарь {имя файла: содержимое}
+            video_files: Пути или ссылки на видео (опционально)
+        """
+        self.files = files
+        self._video_files = video_files or []
+
+    def exists(self, filename: str) -> bool:
+        return filename in self.files
+
+    def open(self, filename: str) -> BinaryIO:
+        # BytesIO разделяет буфер с bytes до первой записи, копии не создается
+        return io.BytesIO(self.files[filename])
+
+    def read(self, filename: str) -> Buffer:
+        return self.files[filename]
+
+    def video_files(self) -> List[str]:
+        return list(self._video_files)
+
+    def __str__(self) -> str:
+        return '<память: {}>'.format(', '.join(sorted(self.files)))
+
+
+class ZipSource(TripSource):
+    """
+    Файлы поездки в zip архиве (в корне архива или в одной вложенной папке).
+    Файлы распаковываются потоком при чтении, архив целиком в память не загружается.
+    """
+
+    def __init__(self, archive_path: str, video_dir: str = None):
+        """
+        Args:
+            archive_path: Путь к zip архиву
+            video_dir: Папка для распаковки видео (None - видео не распаковываются)
+        """
+        self.archive_path = archive_path
+        self.video_dir = video_dir
+        self.archive = zipfile.ZipFile(archive_path)
+        # Имя файла -> запись архива (первая найденная, независимо от вложенной папки)
+        self.entries: Dict[str, zipfile.ZipInfo] = {}
+        for info in self.archive.infolist():
+            if not info.is_dir():
+                self.entries.setdefault(os.path.basename(info.filename), info)
+
+    def exists(self, filename: str) -> bool:
+        return filename in self.entries
+
+    def open(self, filename: str) -> BinaryIO:
+        return self.archive.open(self.entries[filename])
+
+    def video_files(self) -> List[str]:
+        # Видео распаковываются только при запросе и только если задана папка
+        if self.video_dir is None:
+            return []
+        return [
+            self._extract(lambda info=self.entries[name]: self.archive.open(info), self.entries[name].file_size,
+                          os.path.join(self.video_dir, name))
+            for name in VIDEO_FILE_NAMES if name in self.entries
+        ]
+
+    def close(self):
+        self.archive.close()
+
+    def __str__(self) -> str:
+        return self.archive_path
+
+
+class TarSource(TripSource):
+    """
+    Файлы поездки в tar архиве (.tar, .tar.gz, .tgz, .tar.bz2, .tar.xz).
+
+    Сжатый tar не поддерживает произвольный доступ, поэтому архив читается одним
+    потоковым проходом: файлы данных сохраняются в памяти, а проход прекращается,
+    как только найдены все файлы данных, - видео, лежащие после них, не распаковываются.
+    Видео распаковываются отдельным проходом только при запросе video_files().
+    """
+
+    def __init__(self, archive_path: str, video_dir: str = None):
+        """
+        Args:
+            archive_path: Путь к tar архиву
+            video_dir: Папка для распаковки видео (None - видео не распаковываются)
+        """
+        self.archive_path = archive_path
+        self.video_dir = video_dir
+        self._files: Optional[Dict[str, bytes]] = None
+
+    @property
+    def files(self) -> Dict[str, bytes]:
+        """Содержимое файлов данных (архив читается при первом обращении)."""
+        if self._files is None:
+            files = {}
+            with tarfile.open(self.archive_path, 'r|*') as archive:
+                for member in archive:
+                    name = os.path.basename(member.name)
+                    if member.isfile() and name in TRIP_DATA_FILES and name not in files:
+                        files[name] = archive.extractfile(member).read()
+                        if len(files) == len(TRIP_DATA_FILES):
+                            break
+            self._files = files
+        return self._files
+
+    def exists(self, filename: str) -> bool:
+        return filename in self.files
+
+    def open(self, filename: str) -> BinaryIO:
+        return io.BytesIO(self.files[filename])
+
+    def read(self, filename: str) -> Buffer:
+        return self.files[filename]
+
+    def video_files(self) -> List[str]:
+        if self.video_dir is None:
+            return []
+        video_files = {}
+        with tarfile.open(self.archive_path, 'r|*') as archive:
+            for member in archive:
+                name = os.path.basename(member.name)
+                if member.isfile() and name in VIDEO_FILE_NAMES and name not in video_files:
+                    video_files[name] = self._extract(lambda member=member: archive.extractfile(member), member.size,
+                                                      os.path.join(self.video_dir, name))
+        return [video_files[name] for name in VIDEO_FILE_NAMES if name in video_files]
+
+    def __str__(self) -> str:
+        return self.archive_path
+
+
+class YandexSource(TripSource):
+    """Файлы публичной папки на Яндекс.Диске (список файлов запрашивается один раз)."""
+
+    def __init__(self, url: str, yandex_downloader: YandexDownloader = None):
+        """
+        Args:
+            url: URL папки на Яндекс.Диске
+            yandex_downloader: Загрузчик (по умолчанию создается новый)
+        """
+        self.url = url
+        self.yandex_downloader = yandex_downloader or YandexDownloader()
+        self._files: Optional[Dict[str, Any]] = None
+
+    @property
+    def files(self) -> Dict[str, Any]:
+        """Список файлов папки из API (запрашивается при первом обращении)."""
+        if self._files is None:
+            files = self.yandex_downloader.list_files(self.url)
+            if not files:
+                raise Exception("Не удалось получить список файлов")
+            self._files = files
+        return self._files
+
+    def exists(self, filename: str) -> bool:
+        return filename in self.files
+
+    def read(self, filename: str) -> Buffer:
+        content = self.yandex_downloader.download_file(self.files[filename])
+        if content is None:
+            raise Exception(f"Не удалось загрузить файл {filename}")
+        return content
+
+    def open(self, filename: str) -> BinaryIO:
+        return io.BytesIO(self.read(filename))
+
+    def video_files(self) -> List[str]:
+        return list(self.yandex_downloader.get_video_urls_from_files(self.files).values())
+
+    def probe_videos(self, video_files: List[str]) -> List[Optional[Dict[str, Any]]]:
+        # Кэш по md5 из списка файлов: ссылки на скачивание временные
+        video_info = self.yandex_downloader.probe_videos_from_files(self.files)
+        info_by_url = {self.files[name]['file']: info for name, info in video_info.items()}
+        return [info_by_url.get(url) for url in video_files]
+
+    def __str__(self) -> str:
+        return self.url
+
+
+def is_archive(path: str) -> bool:
+    """Проверяет, является ли путь zip или tar архивом поездки."""
+    return os.path.isfile(path) and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
+
+def open_trip_source(location: str, local: bool = None, use_mmap: bool = False,
+                     video_dir: str = None) -> TripSource:
+    """
+    Создает источник по пути или URL.
+
+    Args:
+        location: Путь к папке, путь к zip/tar архиву или URL Яндекс.Диска
+        local: True - локальный путь, False - URL Яндекс.Диска, None - определить автоматически
+            (URL Яндекс.Диска - только адрес http(s)://, остальное - локальный путь)
+        use_mmap: Отображать файлы локальной папки в память
+        video_dir: Папка для распаковки видео из архива (None - видео из архива не используются)
+
+    Returns:
+        Источник файлов поездки
+
+    Raises:
+        FileNotFoundError: Локальный путь не существует
+    """
+    if local is None:
+        local = not location.startswith(('http://', 'https://'))
+    if not local:
+        return YandexSource(location)
+    if not os.path.exists(location):
+        raise FileNotFoundError(f"Папка или архив поездки не найдены: {location}")
+    if os.path.isfile(location) and zipfile.is_zipfile(location):
+        return ZipSource(location, video_dir)
+    if os.path.isfile(location) and tarfile.is_tarfile(location):
+        return TarSource(location, video_dir)
+    return MmapSource(location) if use_mmap else LocalDirSource(location)
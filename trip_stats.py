@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Модуль расчета статистики поездки: пройденное расстояние, время в движении и на стоянке,
+распределение скорости, события на километр и остановки.
+Статистика считается векторными операциями numpy по массивам GPS точек, без генерации HTML.
+"""
+
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Union
+
+import numpy as np
+
+from data_parser import DataParser
+from event_store import EventStore
+from pipeline_metrics import METRICS
+from trip_source import open_trip_source
+
+# Радиус Земли в метрах
+EARTH_RADIUS = 6371008.8
+
+# Шаг гистограммы скорости (м/с) и верхняя граница (все, что выше, попадает в последний интервал)
+SPEED_BIN = 0.1
+SPEED_MAX = 70.0
+HISTOGRAM_BINS = int(SPEED_MAX / SPEED_BIN) + 1
+
+# Перцентили скорости в движении
+SPEED_PERCENTILES = (50, 90, 95, 99)
+
+
+class TripStats:
+    """Класс для расчета статистики поездки по GPS точкам."""
+
+    def __init__(self, stop_speed: float = 1.0, min_stop_duration: float = 30.0, max_gap: float = 60.0):
+        """
+        Args:
+            stop_speed: Скорость (м/с), ниже которой автомобиль считается стоящим
+            min_stop_duration: Минимальная длительность остановки в секундах
+            max_gap: Интервал между точками (с), больше которого отрезок считается пропуском записи
+        """
+        self.stop_speed = stop_speed
+        self.min_stop_duration = min_stop_duration
+        self.max_gap = max_gap
+
+    def compute(self, gps_data: List[Dict[str, Any]],
+                events: Union[List[Dict[str, Any]], EventStore, None] = None) -> Dict[str, Any]:
+        """
+        Считает статистику векторными операциями numpy над массивами точек (линейное время).
+
+        Скорость отрезка берется из поля speed GPS точки (м/с), а если оно отсутствует
+        или отрицательно - из расстояния между точками. Перцентили скорости считаются
+        по гистограмме, взвешенной временем, поэтому точки не нужно сортировать.
+
+        Args:
+            gps_data: GPS точки, отсортированные по времени
+            events: События поездки (опционально)
+
+        Returns:
+            Словарь статистики (расстояние в метрах, время в секундах, скорость в км/ч)
+        """
+        with METRICS.stage('trip_stats') as record:
+            stats = self._compute(gps_data)
+            event_count = len(events) if events is not None else 0
+            distance_km = stats['distance_m'] / 1000
+            stats['events'] = event_count
+            stats['events_per_km'] = round(event_count / distance_km, 3) if distance_km > 0 else None
+            record.items = len(gps_data)
+        return stats
+
+    def _compute(self, gps_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+        count = len(gps_data)
+        times = np.fromiter((point['time'] for point in gps_data), dtype=np.float64, count=count)
+        lats = np.fromiter((point['lat'] for point in gps_data), dtype=np.float64, count=count)
+        lons = np.fromiter((point['lon'] for point in gps_data), dtype=np.float64, count=count)
+        speeds = np.fromiter((-1.0 if point.get('speed') is None else point['speed'] for point in gps_data),
+                             dtype=np.float64, count=count)
+
+        # Точки с временем не позже предыдущих пропускаются
+        if count:
+            keep = np.empty(count, dtype=bool)
+            keep[0] = True
+            keep[1:] = times[1:] > np.maximum.accumulate(times)[:-1]
+            times, lats, lons, speeds = times[keep], lats[keep], lons[keep], speeds[keep]
+
+        # Отрезки между соседними точками: гаверсинус, интервал и скорость в начале отрезка
+        dt = np.diff(times)
+        lat_radians = np.radians(lats)
+        dlat = np.diff(lat_radians)
+        dlon = np.radians(np.diff(lons))
+        h = np.sin(dlat / 2) ** 2 + np.cos(lat_radians[:-1]) * np.cos(lat_radians[1:]) * np.sin(dlon / 2) ** 2
+        segments = 2 * EARTH_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(h)))
+        speed = np.where(speeds[:-1] < 0, segments / dt, speeds[:-1])
+
+        # Пропуск записи: расстояние учитываем, время и скорость - нет
+        gaps = dt > self.max_gap
+        moving = ~gaps & (speed >= self.stop_speed)
+        stopped = ~gaps & ~moving
+
+        moving_time = float(dt[moving].sum())
+        moving_speed = speed[moving]
+        histogram = np.bincount(np.minimum((moving_speed / SPEED_BIN).astype(np.int64), HISTOGRAM_BINS - 1),
+                                weights=dt[moving], minlength=HISTOGRAM_BINS)
+        moving_distance = float(segments[moving].sum())
+
+        stops = self._stops(stopped, times, lats, lons)
+        duration = gps_data[-1]['time'] - gps_data[0]['time'] if gps_data else 0.0
+        return {
+            'points': count,
+            'duration_s': round(duration, 3),
+            'distance_m': round(float(segments.sum()), 1),
+            'moving_time_s': round(moving_time, 3),
+            'stopped_time_s': round(float(dt[stopped].sum()), 3),
+            'gap_time_s': round(float(dt[gaps].sum()), 3),
+            'avg_moving_speed_kmh': round(moving_distance / moving_time * 3.6, 2) if moving_time > 0 else None,
+            'max_speed_kmh': round(float(moving_speed.max()) * 3.6, 2) if moving_speed.size else 0.0,
+            'speed_percentiles_kmh': self._percentiles(histogram, moving_time),
+            'stop_count': len(stops),
+            'stops': stops
+        }
+
+    def _stops(self, stopped: np.ndarray, times: np.ndarray, lats: np.ndarray, lons: np.ndarray) -> List[Dict[str, Any]]:
+        """Остановки: серии отрезков стоянки подряд не короче min_stop_duration."""
+        edges = np.diff(np.concatenate(([0], stopped.astype(np.int8), [0])))
+        # Серия отрезков [start, end) начинается в точке start и заканчивается в точке end
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        durations = times[ends] - times[starts]
+        long_enough = durations >= self.min_stop_duration
+        return [
+            {
+                'start': round(float(times[start]), 3),
+                'duration': round(float(stop_duration), 3),
+                'lat': float(lats[start]),
+                'lon': float(lons[start])
+            }
+            for start, stop_duration in zip(starts[long_enough], durations[long_enough])
+        ]
+
+    @staticmethod
+    def _percentiles(histogram: np.ndarray, total: float) -> Dict[str, Optional[float]]:
+        """Перцентили скорости (км/ч) по гистограмме, взвешенной временем."""
+        if total <= 0:
+            return {f'p{p}': None for p in SPEED_PERCENTILES}
+        accumulated = np.cumsum(histogram)
+        thresholds = np.array(SPEED_PERCENTILES, dtype=np.float64) * total / 100
+        indexes = np.searchsorted(accumulated, thresholds)
+        # Середина интервала гистограммы
+        return {
+            f'p{p}': round((int(index) + 0.5) * SPEED_BIN * 3.6, 1) if index < len(histogram)
+            else round(SPEED_MAX * 3.6, 1)
+            for p, index in zip(SPEED_PERCENTILES, indexes)
+        }
+
+
+def format_stats_html(stats: Dict[str, Any]) -> str:
+    """Форматирует основные показатели статистики для шапки страницы."""
+    def duration(seconds: float) -> str:
+        seconds = int(round(seconds))
+        if seconds >= 3600:
+            return f'{seconds // 3600} ч {seconds % 3600 // 60:02d} мин'
+        return f'{seconds // 60} мин {seconds % 60:02d} с'
+
+    def value(number: Optional[float], unit: str = '') -> str:
+        return f'{number} {unit}'.strip() if number is not None else '—'
+
+    items = [
+        ('Расстояние', f"{stats['distance_m'] / 1000:.2f} км"),
+        ('В движении', duration(stats['moving_time_s'])),
+        ('Стоянки', f"{duration(stats['stopped_time_s'])} ({stats['stop_count']})"),
+        ('Средняя скорость', value(stats['avg_moving_speed_kmh'], 'км/ч')),
+        ('Скорость p50 / p95', '{} / {}'.format(value(stats['speed_percentiles_kmh']['p50'], 'км/ч'),
+                                                 value(stats['speed_percentiles_kmh']['p95'], 'км/ч'))),
+        ('Событий на км', value(stats['events_per_km']))
+    ]
+    return '\n'.join(
+        '<span class="trip-stat"><strong>{}:</strong> {}</span>'.format(label, text) for label, text in items
+    )
+
+
+def stats_for_dir(trip_dir: str, stop_speed: float = 1.0, min_stop_duration: float = 30.0) -> Dict[str, Any]:
+    """
+    Считает статистику локальной поездки (читаются только gps.csv и detections.json).
+
+    Args:
+        trip_dir: Папка поездки или zip архив
+        stop_speed: Скорость (м/с), ниже которой автомобиль считается стоящим
+        min_stop_duration: Минимальная длительность остановки в секундах
+
+    Returns:
+        Словарь статистики с путем к поездке или с ошибкой
+    """
+    try:
+        with open_trip_source(trip_dir, local=True) as source:
+            with source.open('gps.csv') as f:
+                gps_data = DataParser.parse_gps_data(f)
+            events = []
+            if source.exists('detections.json'):
+                with source.open('detections.json') as f:
+                    events = DataParser.parse_detections_data(f)
+        stats = TripStats(stop_speed, min_stop_duration).compute(gps_data, events)
+    except Exception as e:
+        return {'trip': trip_dir, 'error': str(e)}
+    return dict(trip=trip_dir, **stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Статистика поездок (без генерации HTML)')
+    parser.add_argument('trips', nargs='+', help='Папки поездок или zip архивы')
+    parser.add_argument('-o', '--output', help='JSON файл отчета (по умолчанию вывод в консоль)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Количество процессов')
+    parser.add_argument('--stop-speed', type=float, default=1.0, help='Порог скорости стоянки, м/с')
+    parser.add_argument('--min-stop', type=float, default=30.0, help='Минимальная длительность остановки, с')
+    parser.add_argument('--no-stops', action='store_true', help='Не включать список остановок в отчет')
+
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(args.jobs) as executor:
+        report = list(executor.map(stats_for_dir, args.trips,
+                                   [args.stop_speed] * len(args.trips), [args.min_stop] * len(args.trips)))
+
+    if args.no_stops:
+        for stats in report:
+            stats.pop('stops', None)
+
+    failed = [stats for stats in report if 'error' in stats]
+    for stats in failed:
+        print(f"Ошибка {stats['trip']}: {stats['error']}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        total_km = sum(stats.get('distance_m', 0) for stats in report) / 1000
+        print(f"Поездок: {len(report)}, с ошибками: {len(failed)}, всего {total_km:.1f} км. Отчет: {args.output}")
+    else:
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
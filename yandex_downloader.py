@@ -3,17 +3,39 @@
 Работает с данными в памяти без скачивания файлов на диск.
 """
 
+import os
 import json
 import urllib.parse as ul
 import requests
 from typing import Dict, Optional, Any
+from pipeline_metrics import METRICS
+from mp4_probe import PROBER
 
 
 class YandexDownloader:
     """Класс для загрузки данных с Яндекс.Диска в память."""
     
-    def __init__(self):
+    # Файлы данных поездки, загружаемые в память
+    REQUIRED_FILES = ['detections.json', 'gps.csv', 'device.txt', 'times_full.json']
+    
+    # Видео файлы не имеют расширения
+    VIDEO_FILES = ['video', 'video_2']
+    
+    # Адрес API по умолчанию (можно переопределить переменной окружения YANDEX_API_BASE_URL)
+    DEFAULT_API_BASE_URL = 'https://cloud-api.yandex.net'
+    
+    # Количество элементов на странице списка файлов
+    PAGE_LIMIT = 1000
+    
+    def __init__(self, api_base_url: str = None, page_limit: int = None):
+        """
+        Args:
+            api_base_url: Адрес API (например, локального мок-сервера для тестов и бенчмарков)
+            page_limit: Количество элементов на странице списка файлов
+        """
         self.session = requests.Session()
+        self.api_base_url = (api_base_url or os.environ.get('YANDEX_API_BASE_URL') or self.DEFAULT_API_BASE_URL).rstrip('/')
+        self.page_limit = page_limit or self.PAGE_LIMIT
     
     def get_data_from_yandex_disk(self, url: str) -> Dict[str, Any]:
         """
@@ -23,28 +45,20 @@ class YandexDownloader:
             url: URL папки на Яндекс.Диске
             
         Returns:
-            Словарь с данными файлов в памяти
+            Словарь {имя файла: содержимое в байтах}
         """
-        # Извлекаем ID папки из URL
-        folder_id = self._extract_folder_id(url)
-        if not folder_id:
-            print("Не удалось извлечь ID папки из URL")
-            return {}
-        
         # Получаем список всех файлов в папке одним запросом
-        files_data = self._get_all_files_from_folder(folder_id, url)
+        files_data = self.list_files(url)
         if not files_data:
-            print("Не удалось получить список файлов")
             return {}
         
         # Загружаем нужные файлы в память
-        required_files = ['detections.json', 'gps.csv', 'device.txt', 'times_full.json']
         loaded_data = {}
         
-        for filename in required_files:
+        for filename in self.REQUIRED_FILES:
             if filename in files_data:
                 print(f"Загружаем {filename} в память...")
-                file_content = self._download_file_content(files_data[filename])
+                file_content = self.download_file(files_data[filename])
                 if file_content is not None:
                     loaded_data[filename] = file_content
                     print(f"Загружен: {filename}")
@@ -63,23 +77,65 @@ class YandexDownloader:
         Returns:
             Словарь с прямыми ссылками на видео файлы
         """
+        # Получаем список всех файлов в папке одним запросом
+        files_data = self.list_files(url)
+        if not files_data:
+            return {}
+        
+        return self.get_video_urls_from_files(files_data)
+    
+    def list_files(self, url: str) -> Dict[str, Any]:
+        """
+        Получает список файлов папки на Яндекс.Диске.
+        
+        Args:
+            url: URL папки на Яндекс.Диске
+            
+        Returns:
+            Словарь {имя файла: информация о файле из API}
+        """
         # Извлекаем ID папки из URL
         folder_id = self._extract_folder_id(url)
         if not folder_id:
             print("Не удалось извлечь ID папки из URL")
             return {}
         
-        # Получаем список всех файлов в папке одним запросом
-        files_data = self._get_all_files_from_folder(folder_id, url)
+        with METRICS.stage('listing') as record:
+            files_data = self._get_all_files_from_folder(folder_id, url)
+            record.items = len(files_data)
         if not files_data:
             print("Не удалось получить список файлов")
-            return {}
+        return files_data
+    
+    def download_file(self, file_info: Dict[str, Any]) -> Optional[bytes]:
+        """
+        Загружает содержимое файла из списка list_files в память.
+        
+        Args:
+            file_info: Информация о файле из API
+            
+        Returns:
+            Содержимое файла в байтах или None при ошибке
+        """
+        with METRICS.stage('download', file_info.get('name', '')) as record:
+            content = self._download_file_content(file_info)
+            if content is not None:
+                record.bytes = len(content)
+        return content
+    
+    def get_video_urls_from_files(self, files_data: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Извлекает прямые ссылки на видео из уже полученного списка файлов.
         
-        # Ищем видео файлы
-        video_files = ['video', 'video_2'] # видео файлы не имеют расширения
+        Args:
+            files_data: Словарь файлов из list_files
+            
+        Returns:
+            Словарь с прямыми ссылками на видео файлы
+        """
         video_urls = {}
         
-        for video_filename in video_files:
+        for video_filename in self.VIDEO_FILES:
             if video_filename in files_data:
                 video_url = files_data[video_filename].get('file')
                 if video_url:
@@ -88,6 +144,29 @@ class YandexDownloader:
         
         return video_urls
     
+    def probe_videos_from_files(self, files_data: Dict[str, Any]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Читает метаданные видео (длительность, кадры, ключевые кадры) запросами Range,
+        не загружая видео. Результаты кэшируются по md5 файла, так как ссылки временные.
+        
+        Args:
+            files_data: Словарь файлов из list_files
+            
+        Returns:
+            Словарь {имя видео: метаданные или None, если прочитать не удалось}
+        """
+        video_info = {}
+        for video_filename in self.VIDEO_FILES:
+            file_info = files_data.get(video_filename)
+            if not file_info or not file_info.get('file'):
+                continue
+            try:
+                video_info[video_filename] = PROBER.probe_url(file_info['file'], file_info.get('md5'), self.session)
+            except Exception as e:
+                print(f"Метаданные видео {video_filename} не прочитаны: {e}")
+                video_info[video_filename] = None
+        return video_info
+    
     def _get_all_files_from_folder(self, folder_id: str, url: str) -> Dict[str, Any]:
         """
         Получает список всех файлов в папке одним запросом.
@@ -104,21 +183,29 @@ class YandexDownloader:
             folder_path = self._extract_folder_path(url)
             print(f"Путь к папке: {folder_path}")
             
-            # Генерируем URL для получения списка всех файлов
-            api_url = self._generate_api_url(folder_id, folder_path)
-            print(f"API URL: {api_url}")
-            
-            # Получаем список файлов
-            json_response = self._request_json(api_url)
-            if not json_response or "_embedded" not in json_response or "items" not in json_response["_embedded"]:
-                print("Не удалось получить список файлов")
-                return {}
-            
             files_data = {}
-            for item in json_response["_embedded"]["items"]:
-                if item.get("type") == "file":
-                    filename = item.get("name")
-                    files_data[filename] = item
+            offset = 0
+            while True:
+                # Генерируем URL для получения очередной страницы списка файлов
+                api_url = self._generate_api_url(folder_id, folder_path, offset)
+                print(f"API URL: {api_url}")
+                
+                # Получаем список файлов
+                json_response = self._request_json(api_url)
+                if not json_response or "_embedded" not in json_response or "items" not in json_response["_embedded"]:
+                    print("Не удалось получить список файлов")
+                    return {}
+                
+                embedded = json_response["_embedded"]
+                for item in embedded["items"]:
+                    if item.get("type") == "file":
+                        filename = item.get("name")
+                        files_data[filename] = item
+                
+                # Переходим к следующей странице, пока не получены все элементы
+                offset += len(embedded["items"])
+                if not embedded["items"] or offset >= embedded.get("total", offset):
+                    break
             
             print(f"Найдено файлов: {len(files_data)}")
             return files_data
@@ -127,7 +214,7 @@ class YandexDownloader:
             print(f"Ошибка при получении списка файлов: {e}")
             return {}
     
-    def _download_file_content(self, file_info: Dict[str, Any]) -> Optional[str]:
+    def _download_file_content(self, file_info: Dict[str, Any]) -> Optional[bytes]:
         """
         Загружает содержимое файла в память.
         
@@ -135,7 +222,7 @@ class YandexDownloader:
             file_info: Информация о файле из API
             
         Returns:
-            Содержимое файла как строка или None при ошибке
+            Содержимое файла в байтах (декодирует парсер) или None при ошибке
         """
         try:
             if "file" not in file_info:
@@ -146,7 +233,7 @@ class YandexDownloader:
             response = self.session.get(download_url)
             
             if response.status_code == 200:
-                return response.text
+                return response.content
             else:
                 print(f"Ошибка загрузки файла: {response.status_code}")
                 return None
@@ -191,13 +278,14 @@ class YandexDownloader:
             return '/' + path if path else ""
         return ""
     
-    def _generate_api_url(self, folder_id: str, path: str = "") -> str:
+    def _generate_api_url(self, folder_id: str, path: str = "", offset: int = 0) -> str:
         """
         Генерирует URL для API запроса.
         
         Args:
             folder_id: ID папки
             path: Путь к файлу или папке
+            offset: Смещение страницы списка файлов
             
         Returns:
             URL для API запроса
@@ -207,7 +295,8 @@ class YandexDownloader:
         key = ul.quote(base_url, safe="")
         path_key = ul.quote(f"{path}", safe="") if path else ""
         
-        api_url = f"https://cloud-api.yandex.net/v1/disk/public/resources?public_key={key}&path={path_key}&limit=1000"
+        api_url = (f"{self.api_base_url}/v1/disk/public/resources?public_key={key}&path={path_key}"
+                   f"&limit={self.page_limit}&offset={offset}")
         return api_url
     
     def _request_json(self, url: str) -> Optional[dict]: